@@ -2,14 +2,111 @@ from coffea import util, processor
 from ttgamma import TTGammaProcessor
 from ttgamma.utils.fileSet_2016_LZ4 import fileSet_2016 as fileset
 from ttgamma.utils.fileSet_2016_LZ4 import fileSet_Data_2016
+from ttgamma.utils.selectionCache import hitRate
+from ttgamma.utils.jit import warmPool, threadsPerWorker
+from ttgamma.utils.lumiMask import lumiJSON
+from ttgamma.utils.faultTolerance import FaultTolerantExecutor, missingEntries
 
+import os
 import time
 import sys
 
 tstart = time.time()
 
+#overlap reading and decompression of the next chunks with the processing of the current one, in a single process
+prefetch = 'prefetch' in sys.argv[2:]
+
+#copy the input files to a local cache directory on first use, and read the local copies in later runs
+useCache = 'cache' in sys.argv[2:]
+
+#schedule the chunks over worker processes pulling them from this process, the local ones and those started on other nodes
+#  (python -m ttgamma.utils.cluster HOST:PORT, or submitWorkersToCondor.jdl), with retries and work stealing (see utils/cluster.py)
+#  the address to listen on for remote workers is TTGAMMA_CLUSTER_ADDRESS (host:port), with the key in TTGAMMA_CLUSTER_KEY
+cluster = 'cluster' in sys.argv[2:]
+
+#number of local worker processes of the futures or cluster executor
+workers = int(os.environ.get('TTGAMMA_LOCAL_WORKERS', 5))
+
+#a chunk or file which still can not be read after its retries is recorded in output['failedChunks'] instead of stopping the job,
+#  and the files with failures are written to a quarantine list next to the output (see utils/faultTolerance.py)
+chunkRetries = int(os.environ.get('TTGAMMA_CHUNK_RETRIES', 2))
+
+#do not read the files quarantined by the previous runs (the files which failed in 2 consecutive runs)
+skipQuarantined = 'skipQuarantined' in sys.argv[2:]
+
+def runJob(fileSet, processor_instance, quarantine=None):
+    if useCache:
+        #the local copies are pinned in the cache (not evicted by other jobs sharing it) until the job is done
+        from ttgamma.utils.fileCache import FileCache, cacheFileset
+        with FileCache(os.environ.get('TTGAMMA_CACHE_DIR', 'inputCache'),
+                       maxBytes=float(os.environ.get('TTGAMMA_CACHE_GB', 100))*1024**3) as cache:
+            return _runJob(cacheFileset(fileSet, cache), processor_instance, quarantine)
+    return _runJob(fileSet, processor_instance, quarantine)
+
+def _runJob(fileSet, processor_instance, quarantine=None):
+    if prefetch:
+        #(the failed chunks are reported, but no quarantine list is kept in this mode)
+        from ttgamma.utils.prefetch import run_prefetch_job
+        output = run_prefetch_job(fileSet,
+                                  treename='Events',
+                                  processor_instance=processor_instance,
+                                  chunksize=50000,
+                                  prefetch=4,
+                                  readThreads=4,
+                                  maxMemory=4*1024**3,
+                                  isolate=True,
+                                  retries=chunkRetries,
+                                 )
+        reportFailedChunks(output)
+        return output
+    if cluster:
+        from ttgamma.utils.cluster import cluster_executor
+        executor = cluster_executor
+        executor_args = {'workers': workers, 'flatten': True,
+                         'address': os.environ.get('TTGAMMA_CLUSTER_ADDRESS', '127.0.0.1:0')}
+    else:
+        executor = processor.futures_executor
+        #the numba kernels are compiled (or loaded from the cache) when each worker starts
+        executor_args = {'workers': workers, 'flatten': True, 'pool': warmPool}
+
+    executor = FaultTolerantExecutor(executor, retries=chunkRetries, backoff=5., quarantine=quarantine, skipQuarantined=skipQuarantined)
+    output = processor.run_uproot_job(fileSet,
+                                      treename='Events',
+                                      processor_instance=processor_instance,
+                                      executor=executor,
+                                      executor_args=executor_args,
+                                      chunksize=50000,
+                                      # maxchunks=1,
+                                     )
+    if executor.finish(output) > 0:
+        print("Files with failures are listed in %s"%quarantine)
+    reportFailedChunks(output)
+    return output
+
+def reportFailedChunks(output):
+    if len(output['failedChunks']) > 0:
+        print("Failed chunks, the output is missing these entries:")
+        for dataset, missing in missingEntries(output['failedChunks']).items():
+            for fileName, entrystart, entrystop in missing:
+                print("    %s %s [%s, %s)"%(dataset, fileName, entrystart, entrystop))
+
+#fill the b-tagging efficiency histograms during the MC pass, and write the efficiency lookup for the processed samples
+#  to taggingEfficienciesDenseLookup_<mcType>.pkl, once all the groups are done they are merged into the lookup used by the processor with
+#  python -m ttgamma.utils.getBtagEfficiencies merge ttgamma/utils/taggingEfficienciesDenseLookup.pkl taggingEfficienciesDenseLookup_MC*.pkl
+measureBtagEff = 'btagEff' in sys.argv[2:]
+
+#read the derived generator level columns from the gen cache (built with python -m ttgamma.utils.genCache) instead of the gen branches
+genCacheDir = os.environ.get('TTGAMMA_GEN_CACHE_DIR', 'genCache') if 'genCache' in sys.argv[2:] else None
+
+#compute kinematics and weights in float32 instead of the default float64 (histograms are accumulated in float64 either way)
+precision = 'float32' if 'float32' in sys.argv[2:] else 'float64'
+
+#threads of the parallel kernels of each process, the prefetch mode processes the chunks in a single process using all cores
+#  the cluster workers set their own from the cores of the node they run on
+threads = None if prefetch or cluster else threadsPerWorker(workers)
+
 if 'MC' in sys.argv[1]:
-    mcEventYields = {'DYjetsM10to50_2016': 35114961.0, 'DYjetsM50_2016': 146280395.0, 'GJets_HT40To100_2016': 9326139.0, 'GJets_HT100To200_2016': 10104155.0, 'GJets_HT200To400_2016': 20527506.0, 'GJets_HT400To600_2016': 5060070.0, 'GJets_HT600ToInf_2016': 5080857.0, 'QCD_Pt20to30_Ele_2016': 9241500.0, 'QCD_Pt30to50_Ele_2016': 11508842.0, 'QCD_Pt50to80_Ele_2016': 45789059.0, 'QCD_Pt80to120_Ele_2016': 77800204.0, 'QCD_Pt120to170_Ele_2016': 75367655.0, 'QCD_Pt170to300_Ele_2016': 11105095.0, 'QCD_Pt300toInf_Ele_2016': 7090318.0, 'QCD_Pt20to30_Mu_2016': 31878740.0, 'QCD_Pt30to50_Mu_2016': 29936360.0, 'QCD_Pt50to80_Mu_2016': 19662175.0, 'QCD_Pt80to120_Mu_2016': 23686772.0, 'QCD_Pt120to170_Mu_2016': 7897731.0, 'QCD_Pt170to300_Mu_2016': 17350231.0, 'QCD_Pt300to470_Mu_2016': 49005976.0, 'QCD_Pt470to600_Mu_2016': 19489276.0, 'QCD_Pt600to800_Mu_2016': 9981311.0, 'QCD_Pt800to1000_Mu_2016': 19940747.0, 'QCD_Pt1000toInf_Mu_2016': 13608903.0, 'ST_s_channel_2016': 6137801.0, 'ST_tW_channel_2016': 4945734.0, 'ST_tbarW_channel_2016': 4942374.0, 'ST_tbar_channel_2016': 17780700.0, 'ST_t_channel_2016': 31848000.0, 'TTGamma_Dilepton_2016': 5728644.0, 'TTGamma_Hadronic_2016': 5635346.0, 'TTGamma_SingleLept_2016': 10991612.0, 'TTWtoLNu_2016': 2716249.0, 'TTWtoQQ_2016': 430310.0, 'TTZtoLL_2016': 6420825.0, 'TTbarPowheg_Dilepton_2016': 67339946.0, 'TTbarPowheg_Hadronic_2016': 67963984.0, 'TTbarPowheg_Semilept_2016': 106438920.0, 'W1jets_2016': 45283121.0, 'W2jets_2016': 60438768.0, 'W3jets_2016': 59300029.0, 'W4jets_2016': 29941394.0, 'WGamma_01J_5f_2016': 6103817.0, 'ZGamma_01J_5f_lowMass_2016': 9696539.0, 'WW_2016': 7982180.0, 'WZ_2016': 3997571.0, 'ZZ_2016': 1988098.0}
+    #the number of generated events for each sample is taken from the normalization table in ttgamma/utils/normalization.py
 
     if sys.argv[1]=="MC":
         fileSet = {k: fileset[k] for k in fileset}
@@ -39,34 +136,43 @@ if 'MC' in sys.argv[1]:
 
     print(fileSet.keys())
 
-    output = processor.run_uproot_job(fileSet,
-                                      treename='Events',
-                                      processor_instance=TTGammaProcessor(mcEventYields=mcEventYields),
-                                      executor=processor.futures_executor,
-                                      executor_args={'workers': 5, 'flatten': True},
-                                      chunksize=50000,
-                                      # maxchunks=1,
-                                  )
+    output = runJob(fileSet, TTGammaProcessor(measureBtagEff=measureBtagEff,
+                                              btagEffOutput=f"taggingEfficienciesDenseLookup_{mcType}.pkl" if measureBtagEff else None,
+                                              precision=precision,
+                                              genCacheDir=genCacheDir,
+                                              threads=threads),
+                    quarantine=f"output{mcType}_ttgamma_condorFull_4jet_quarantine.json")
     
     elapsed = time.time() - tstart
     print("Total time: %.1f seconds"%elapsed)
     print("Total rate: %.1f events / second"%(output['EventCount'].value/elapsed))
+    if not hitRate(output['selectionCache']) is None:
+        print("Selection cache hit rate: %.1f%%"%(100*hitRate(output['selectionCache'])))
     
     util.save(output, f"output{mcType}_ttgamma_condorFull_4jet.coffea")
 
     
 if sys.argv[1]=='Data':
-    output = processor.run_uproot_job(fileSet_Data_2016,
-                                      treename='Events',
-                                      processor_instance=TTGammaProcessor(),
-                                      executor=processor.futures_executor,
-                                      executor_args={'workers': 5, 'flatten': True},
-                                      chunksize=50000,
-                                      # maxchunks=1,
-                                  )
+    #golden JSON of the certified luminosity sections, if the data were not already filtered upstream
+    goldenJSON = os.environ.get('TTGAMMA_GOLDEN_JSON')
+
+    #write the kept events to this directory, to check that no event is selected from both primary datasets
+    #  (python -m ttgamma.utils.duplicates duplicateCheck after the job)
+    duplicateCheckDir = 'duplicateCheck' if 'checkDuplicates' in sys.argv[2:] else None
+
+    output = runJob(fileSet_Data_2016, TTGammaProcessor(precision=precision, threads=threads, goldenJSON=goldenJSON,
+                                                        duplicateCheckDir=duplicateCheckDir),
+                    quarantine='outputData_ttgamma_condorFull_4jet_quarantine.json')
     
     elapsed = time.time() - tstart
     print("Total time: %.1f seconds"%elapsed)
     print("Total rate: %.1f events / second"%(output['EventCount'].value/elapsed))
+    if not hitRate(output['selectionCache']) is None:
+        print("Selection cache hit rate: %.1f%%"%(100*hitRate(output['selectionCache'])))
     
+    #the processed luminosity sections, to compute the recorded luminosity with brilcalc (or utils.lumiMask.recordedLuminosity)
+    print("Processed luminosity sections: %i"%len(output['lumis']))
+    print("Events removed as kept in another primary dataset: %i"%sum(output['duplicates'].values()))
+    lumiJSON(output['lumis'], 'outputData_processedLumis.json')
+
     util.save(output, 'outputData_ttgamma_condorFull_4jet.coffea')
@@ -5,5 +5,10 @@ source coffeaenv/bin/activate
 
 tar -zxf ttgamma.tgz
 
-python runFullDataset.py $1
+if [ "$1" == "worker" ]; then
+    # worker pulling chunks from a runFullDataset.py coordinator started with the cluster option, at the address $2
+    python -m ttgamma.utils.cluster $2 --workers ${3:-4}
+else
+    python runFullDataset.py $1
+fi
 
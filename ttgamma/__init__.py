@@ -1,7 +1,27 @@
 from .version import __version__
-from .processor import TTGammaProcessor
+
+#the processor loads the jet corrections, pileup lookups and b-tagging efficiencies when it is imported,
+#  so it is only imported when TTGammaProcessor is first accessed (importing ttgamma.utils stays fast)
+_lazy = {'TTGammaProcessor': '.processor'}
 
 __all__ = [
     '__version__',
     'TTGammaProcessor',
 ]
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        #an AttributeError raised while importing the module would be reported as a missing attribute of the package
+        try:
+            value = getattr(importlib.import_module(_lazy[name], __name__), name)
+        except AttributeError as e:
+            raise ImportError(f"cannot import {name!r} from {_lazy[name][1:]!r}: {e}") from e
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
@@ -3,7 +3,7 @@ import time
 from coffea import hist, util
 from coffea.analysis_objects import JaggedCandidateArray, JaggedTLorentzVectorArray
 import coffea.processor as processor
-from coffea.jetmet_tools import FactorizedJetCorrector, JetCorrectionUncertainty, JetTransformer, JetResolution, JetResolutionScaleFactor
+from coffea.jetmet_tools import FactorizedJetCorrector, JetCorrectionUncertainty, JetResolution, JetResolutionScaleFactor
 from coffea.lookup_tools import extractor, dense_lookup
 
 import uproot
@@ -13,13 +13,24 @@ from uproot_methods.classes.TLorentzVector import TLorentzVectorArray
 import numpy as np
 import pickle
 
-import re
 
 from .utils.crossSections import *
 from .utils.efficiencies import getMuSF, getEleSF
 
-from .utils.genParentage import maxHistoryPDGID
+from .utils.genCache import readGenCache, computeGenColumns
 from .utils.updateJets import updateJetP4
+from .utils.jetCorrections import JetCorrector, chunkSeed
+from .utils.getBtagEfficiencies import btagEfficiencyHists, fillBtagEfficiencyHists, taggingEfficiencyLookup, saveTaggingEfficiencyLookup
+from .utils.normalization import normalize, defaultNormalization
+from .utils.precision import precisionTypes, PrecisionDataFrame, castCandidates
+from .utils.weightMatrix import WeightMatrix
+from .utils.theoryWeights import theoryWeights
+from .utils.objectID import muonID, electronID, photonID, jetID
+from .utils.selectionView import SelectionView
+from .utils.selectionCache import SelectionCache
+from .utils.jit import setThreads
+from .utils.lumiMask import LumiMask, processedLumis
+from .utils.duplicates import precedenceMask, writeEventKeys
 
 import os.path
 cwd = os.path.dirname(__file__)
@@ -60,24 +71,61 @@ JECuncertainties = JetCorrectionUncertainty(**{name:Jetevaluator[name] for name
 JER = JetResolution(**{name:Jetevaluator[name] for name in jer_names})
 JERsf = JetResolutionScaleFactor(**{name:Jetevaluator[name] for name in jersf_names})
 
-Jet_transformer = JetTransformer(jec=JECcorrector,junc=JECuncertainties, jer = JER, jersf = JERsf)
+Jet_corrector = JetCorrector(jec=JECcorrector,junc=JECuncertainties, jer = JER, jersf = JERsf)
 
 
 
 # Look at ProcessorABC to see the expected methods and what they are supposed to do
 class TTGammaProcessor(processor.ProcessorABC):
-    def __init__(self, mcEventYields = None, jetSyst='nominal'):
+    def __init__(self, mcEventYields = None, jetSyst='nominal', measureBtagEff=False, btagEffOutput=None, normalization=defaultNormalization, precision='float64', genCacheDir=None, jerSeed=None, threads=None, goldenJSON=None, duplicateCheckDir=None):
         ################################
         # INITIALIZE COFFEA PROCESSOR
         ################################
 
+        # MC histograms are filled without the cross section and luminosity weight, which is applied in postprocess
+        #   normalization is the version of the normalization table to use (None leaves the output unnormalized, see utils/normalization.py)
+        #   mcEventYields optionally overrides the number of generated events from the table
         self.mcEventYields = mcEventYields
+        self.normalization = normalization
+
+        # measureBtagEff fills the b-tagging efficiency histograms (hJets, hBJets) in the same pass over MC
+        #   if btagEffOutput is given, the dense efficiency lookup is derived and saved to that file in postprocess
+        self.measureBtagEff = measureBtagEff
+        self.btagEffOutput = btagEffOutput
 
         if not jetSyst in ['nominal','JERUp','JERDown','JESUp','JESDown']:
             raise Exception(f'{jetSyst} is not in acceptable jet systematic types [nominal, JERUp, JERDown, JESUp, JESDown]')
 
         self.jetSyst = jetSyst
 
+        # jerSeed makes the stochastic JER smearing reproducible, each chunk is smeared with a seed derived from it (see utils/jetCorrections.py)
+        self.jerSeed = jerSeed
+
+        # precision policy for the floating point columns, kinematics and weights (see utils/precision.py)
+        #   float32 is opt-in until it has been validated against float64 on full samples (utils.precision.validatePrecision)
+        #   histograms are accumulated in float64 for either choice
+        if not precision in precisionTypes:
+            raise Exception(f'{precision} is not in acceptable precision types {list(precisionTypes)}')
+        self.floatType = precisionTypes[precision]
+
+        # genCacheDir is the directory of the friend trees of derived generator level columns (see utils/genCache.py)
+        #   files with a cache are processed without reading the GenPart_* and GenJet_* branches
+        self.genCacheDir = genCacheDir
+
+        # threads is the number of threads of the parallel numba kernels in each process (None keeps the setting of the process, all cores by default)
+        #   when running with several worker processes, use threadsPerWorker(workers) to not use more threads than cores (see utils/jit.py)
+        #   the workers of the cluster executor set it themselves, on the node they run on
+        self.threads = threads
+
+        # goldenJSON is the file of certified luminosity sections, data events outside of them fail every selection (see utils/lumiMask.py)
+        #   None processes all the data events, for inputs already filtered upstream
+        self.lumiMask = None if goldenJSON is None else LumiMask(goldenJSON)
+
+        # data events are kept only in the first primary dataset whose triggers they fire (see utils/duplicates.py)
+        #   duplicateCheckDir is a directory shared by the workers where the kept events are written, to validate the removal of the
+        #   duplicated events with python -m ttgamma.utils.duplicates duplicateCheckDir
+        self.duplicateCheckDir = duplicateCheckDir
+
         dataset_axis = hist.Cat("dataset", "Dataset")
         lep_axis = hist.Cat("lepFlavor", "Lepton Flavor")
 
@@ -110,9 +158,28 @@ class TTGammaProcessor(processor.ProcessorABC):
             ## book histogram for M3 variable
             #'M3':
 
-            'EventCount':processor.value_accumulator(int)
+            'EventCount':processor.value_accumulator(int),
+
+            ## number of processed MC events per dataset, and the normalization factors applied to the histograms
+            'processedEvents':processor.defaultdict_accumulator(int),
+            'normalization':processor.set_accumulator(),
+
+            ## hits and misses of the memoized event selection masks
+            'selectionCache':processor.defaultdict_accumulator(int),
+
+            ## (run, luminosity section) pairs of the processed certified data events, to check the luminosity after merging
+            'lumis':processor.set_accumulator(),
+
+            ## number of data events removed per dataset, as they are kept in a primary dataset of higher precedence
+            'duplicates':processor.defaultdict_accumulator(int),
+
+            ## chunks which failed after their retries, as (dataset, filename, entrystart, entrystop, error) (see utils/faultTolerance.py)
+            'failedChunks':processor.set_accumulator(),
         })
 
+        if self.measureBtagEff:
+            self._accumulator.update(btagEfficiencyHists())
+
         ext = extractor()
         ext.add_weight_sets([f"btag2016 * {cwd}/ScaleFactors/Btag/DeepCSV_2016LegacySF_V1.btag.csv"])
         ext.finalize()
@@ -140,11 +207,36 @@ class TTGammaProcessor(processor.ProcessorABC):
     def process(self, df):
         output = self.accumulator.identity()
 
+        #the number of threads is a setting of the thread calling the kernels
+        setThreads(self.threads)
+
+        #read the floating point columns with the precision policy of the processor
+        #  (with float64, the columns are used as they are read and only the derived columns are computed in float64)
+        if self.floatType != np.float64:
+            df = PrecisionDataFrame(df, self.floatType)
+
         datasetFull = df['dataset']
         dataset=datasetFull.replace('_2016','')
 
         isData = 'Data' in dataset
 
+        #data events in the certified luminosity sections, all events for MC (or without a golden JSON)
+        if isData and not self.lumiMask is None:
+            lumiMask = self.lumiMask(df['run'], df['luminosityBlock'])
+        else:
+            lumiMask = np.ones(df.size, dtype=bool)
+        if isData:
+            output['lumis'].add(processedLumis(df['run'], df['luminosityBlock'], lumiMask))
+
+        #data events which are not in a primary dataset of higher precedence, so each event is selected from one primary dataset only
+        eventMask = lumiMask
+        if isData:
+            uniqueMask = precedenceMask(df, dataset)
+            output['duplicates'][datasetFull] += int((lumiMask & ~uniqueMask).sum())
+            eventMask = lumiMask & uniqueMask
+            if not self.duplicateCheckDir is None:
+                writeEventKeys(self.duplicateCheckDir, df, eventMask)
+
         ################################
         # DEFINE JAGGED CANDIDATE ARRAYS
         ################################
@@ -194,6 +286,10 @@ class TTGammaProcessor(processor.ProcessorABC):
             ptGenJet=np.zeros_like(df['Jet_pt']),
         )
 
+        #fill the b-tagging efficiency histograms, using the uncorrected jets
+        if self.measureBtagEff and not isData:
+            fillBtagEfficiencyHists(output, datasetFull, jets)
+
         #load photon objects
         photons = JaggedCandidateArray.candidatesfromcounts(
             df['nPhoton'],
@@ -217,21 +313,17 @@ class TTGammaProcessor(processor.ProcessorABC):
         
         if not isData:
 
-            #load gen parton objects
-            genPart = JaggedCandidateArray.candidatesfromcounts(
-                df['nGenPart'],
-                pt=df['GenPart_pt'],
-                eta=df['GenPart_eta'],
-                phi=df['GenPart_phi'],
-                mass=df['GenPart_mass'],
-                pdgid=df['GenPart_pdgId'],
-                motherIdx=df['GenPart_genPartIdxMother'],
-                status=df['GenPart_status'],
-                statusFlags=df['GenPart_statusFlags'],
-            )
+            #derived generator level columns (overlap removal, gen matching of photons and jets), read from the gen cache
+            #  of the file when there is one, otherwise computed from the gen particles and gen jets
+            genColumns = None
+            if not self.genCacheDir is None:
+                genColumns = readGenCache(self.genCacheDir, df, datasetFull, photons.counts, jets.counts)
+            if genColumns is None:
+                genColumns = computeGenColumns(df, dataset, photons.genIdx, jets.genJetIdx)
 
-            genmotherIdx = genPart.motherIdx
-            genpdgid = genPart.pdgid
+            photons['genMatchedPho'] = genColumns['Photon_genMatchedPho']
+            photons['genMatchedEle'] = genColumns['Photon_genMatchedEle']
+            photons['genMaxParent'] = genColumns['Photon_genMaxParent']
 
 
         #################
@@ -244,50 +336,9 @@ class TTGammaProcessor(processor.ProcessorABC):
         # ZGamma and ZJets
         # We need to remove events from TTbar which are already counted in the phase space in which the TTGamma sample is produced
         # photon with pT> 10 GeV, eta<5, and at least dR>0.1 from other gen objects 
-        doOverlapRemoval = False
-        if 'TTbar' in dataset:
-            doOverlapRemoval = True
-            overlapPt = 10.
-            overlapEta = 5.
-            overlapDR = 0.1
-        if re.search("^W[1234]jets$", dataset):
-            doOverlapRemoval = True
-            overlapPt = 10.
-            overlapEta = 2.5
-            overlapDR = 0.05
-        if 'DYjetsM' in dataset:
-            doOverlapRemoval = True
-            overlapPt = 15.
-            overlapEta = 2.6
-            overlapDR = 0.05
-
-            
-        if doOverlapRemoval:
-            overlapPhoSelect = ((genPart.pt>=overlapPt) & 
-                                (abs(genPart.eta) < overlapEta) & 
-                                (genPart.pdgid==22) & 
-                                (genPart.status==1)
-                               )
-            #potential overlap photons are only those passing the kinematic cuts
-            OverlapPhotons = genPart[overlapPhoSelect] 
-
-            #if the overlap photon is actually from a non prompt decay, it's not part of the phase space of the separate sample
-            idx = OverlapPhotons.motherIdx
-            maxParent = maxHistoryPDGID(idx.content, idx.starts, idx.stops, 
-                                        genpdgid.content, genpdgid.starts, genpdgid.stops, 
-                                        genmotherIdx.content, genmotherIdx.starts, genmotherIdx.stops)
-
-            
-            finalGen = genPart[((genPart.status==1)|(genPart.status==71)) & ~((abs(genPart.pdgid)==12) | (abs(genPart.pdgid)==14) | (abs(genPart.pdgid)==16))]
-            genPairs = OverlapPhotons['p4'].cross(finalGen['p4'],nested=True)
-            ##remove the case where the cross produce is the gen photon with itself
-            genPairs = genPairs[~(genPairs.i0==genPairs.i1)]
-            #find closest gen particle to overlap photons
-            dRPairs = genPairs.i0.delta_r(genPairs.i1)
-
-            #the event is overlapping with the separate sample if there is an overlap photon passing the dR cut and not coming from hadronic activity
-            isOverlap = ((dRPairs.min()>overlapDR) & (maxParent<37)).any()
-            passOverlapRemoval = ~isOverlap
+        #  the thresholds for each sample and the overlap definition are in utils/genCache.py
+        if not isData:
+            passOverlapRemoval = genColumns['passOverlapRemoval']
         else:
             passOverlapRemoval = np.ones_like(df['event'])==1
             
@@ -298,57 +349,43 @@ class TTGammaProcessor(processor.ProcessorABC):
         ##################
         # PART 1A Uncomment to add in object selection
         """
+        #object identification, each collection is evaluated in a single pass into a bitmask of the cuts passed by every object
+        #  the loose selections and the other cuts are defined in utils/objectID.py
+        #  loose muons and electrons pass looser versions of the tight cuts, and fail the tight selection
+        #  each tight cut is written as a string, an expression on a single object using the names of its columns, ex: 'relIso < 0.25'
+
         # 1. ADD SELECTION
         #select tight muons
-        # tight muons should have a pt of at least 30 GeV, |eta| < 2.4, pass the tight muon ID cut (tightID variable), and have a relative isolation of less than 0.15
-        muonSelectTight = ((?) &
-                           (?) &
-                           ? &
-                           (?))
-
-        #select loose muons
-        muonSelectLoose = ((muons.pt>15) & 
-                           (abs(muons.eta)<2.4) & 
-                           ((muons.isPFcand) & (muons.isTracker | muons.isGlobal)) & 
-                           (muons.relIso < 0.25) &
-                           np.invert(muonSelectTight)
-                          )
-
-
+        # tight muons should have a pt of at least 30 GeV, |eta| < 2.4, pass the tight muon ID cut (tightId variable), and have a relative isolation of less than 0.15
+        tightMuonID = muonID.withSelection('tight', [?,
+                                                     ?,
+                                                     ?,
+                                                     ?])
+        muonBits = tightMuonID.bitmask(muons)
+        muonSelectTight = tightMuonID.passes(muonBits, 'tight')
+        muonSelectLoose = tightMuonID.passes(muonBits, 'loose')
 
-        eleEtaGap = (abs(electrons.eta) < 1.4442) | (abs(electrons.eta) > 1.566)
-        elePassD0 = ((abs(electrons.eta) < 1.479) & (abs(electrons.d0) < 0.05) |
-                     (abs(electrons.eta) > 1.479)  & (abs(electrons.d0) < 0.1)
-                    )
-        elePassDZ = ((abs(electrons.eta) < 1.479) & (abs(electrons.dz) < 0.1) |
-                     (abs(electrons.eta) > 1.479)  & (abs(electrons.dz) < 0.2)
-                    )
-
-
-        #select tight electrons
         # 1. ADD SELECTION
         #select tight electrons
-        # tight electrons should have a pt of at least 35 GeV, |eta| < 2.1, pass the cut based electron id (cutBased variable in NanoAOD>=4), and pass the etaGap, D0, and DZ cuts defined above
-        electronSelectTight = ((?) &
-                               (?) &
-                               (?) &
-                               ? & 
-                               ? & 
-                               ? )
-
-        #select loose electrons
-        electronSelectLoose = ((electrons.pt>15) & 
-                               (abs(electrons.eta)<2.4) & 
-                               (electrons.cutBased>=1) &
-                               eleEtaGap &      
-                               elePassD0 & 
-                               elePassDZ & 
-                               np.invert(electronSelectTight)
-                              )
+        # tight electrons should have a pt of at least 35 GeV, |eta| < 2.1, pass the cut based electron id (cutBased variable in NanoAOD>=4), and pass the etaGap, D0, and DZ cuts
+        #  (the etaGap, d0 and dz cuts are defined in utils/objectID.py, and can be given by name: 'etaGap', 'd0', 'dz')
+        tightElectronID = electronID.withSelection('tight', [?,
+                                                             ?,
+                                                             ?,
+                                                             ?,
+                                                             ?,
+                                                             ?])
+        electronBits = tightElectronID.bitmask(electrons)
+        electronSelectTight = tightElectronID.passes(electronBits, 'tight')
+        electronSelectLoose = tightElectronID.passes(electronBits, 'loose')
         
         # 1. ADD SELECTION
         #  Object selection
         #select the subset of muons passing the muonSelectTight and muonSelectLoose cuts
+        #  selected collections are SelectionView(collection, mask) objects, which keep the index of the selected objects
+        #  and only gather the columns which are used, instead of copying every column as collection[mask] does
+        #  ex: tightMuon = SelectionView(muons, muonSelectTight)
+        #  the views support the operations used below: columns, ['p4'], jagged masks, event masks (as tightMuon[weightMask]) and [:,:n]
         tightMuon = ?
         looseMuon = ?
         
@@ -370,42 +407,21 @@ class TTGammaProcessor(processor.ProcessorABC):
         phoEle = photons['p4'].cross(tightElectron['p4'],nested=True)
         dRphoele = ((phoEle.i0.delta_r(phoEle.i1)).min()>0.4) | (tightElectron.counts==0)
         
-        #photon selection (no ID requirement used here)
-        photonSelect = ((photons.pt>20) & 
-                        (abs(photons.eta) < 1.4442) &
-                        (photons.isEE | photons.isEB) &
-                        (photons.passEleVeto) & 
-                        np.invert(photons.pixelSeed) & 
-                        dRphomu & dRphoele
-                       )
-        
-        
-        #split out the ID requirement, enabling Iso and SIEIE to be inverted for control regions
-        photonID = photons.photonId >= 2
-
-
-        #parse VID cuts, define loose photons (photons without chIso cut)
-        photon_MinPtCut = (photons.vidCuts>>0 & 3)>=2 
-        photon_PhoSCEtaMultiRangeCut = (photons.vidCuts>>2 & 3)>=2 
-        photon_PhoSingleTowerHadOverEmCut = (photons.vidCuts>>4 & 3)>=2  
-        photon_PhoFull5x5SigmaIEtaIEtaCut = (photons.vidCuts>>6 & 3)>=2  
-        photon_ChIsoCut = (photons.vidCuts>>8 & 3)>=2  
-        photon_NeuIsoCut = (photons.vidCuts>>10 & 3)>=2  
-        photon_PhoIsoCut = (photons.vidCuts>>12 & 3)>=2  
-        
-        #photons passing all ID requirements, without the charged hadron isolation cut applied
-        photonID_NoChIso = (photon_MinPtCut & 
-                            photon_PhoSCEtaMultiRangeCut & 
-                            photon_PhoSingleTowerHadOverEmCut & 
-                            photon_PhoFull5x5SigmaIEtaIEtaCut & 
-                            photon_NeuIsoCut & 
-                            photon_PhoIsoCut)
+        #photon selection (no ID requirement used here), the medium ID, and the VID cuts decoded from vidNestedWPBitmap
+        #  the ID requirement is split out, enabling Iso and SIEIE to be inverted for control regions
+        photonBits = photonID.bitmask(photons, dRphomu=dRphomu, dRphoele=dRphoele)
+        photonSelect = photonID.passes(photonBits, 'select')
+
+        #photons passing the photon selection and the medium ID
+        photonSelectTight = photonID.passes(photonBits, 'tight')
+        #photons passing the photon selection and all ID requirements, without the charged hadron isolation cut applied
+        photonSelectNoChIso = photonID.passes(photonBits, 'looseNoChIso')
         
         # 1. ADD SELECTION
         #  Object selection
-        #select tightPhotons, the subset of photons passing the photonSelect cut and the photonID cut
+        #select tightPhotons, the subset of photons passing the photonSelectTight cut
         tightPhotons = ?
-        #select loosePhotons, the subset of photons passing the photonSelect cut and all photonID cuts without the charged hadron isolation cut applied
+        #select loosePhotons, the subset of photons passing the photonSelectNoChIso cut
         loosePhotons = ?
         
 
@@ -414,25 +430,25 @@ class TTGammaProcessor(processor.ProcessorABC):
 
         #update jet kinematics based on jete energy systematic uncertainties
         if not isData:
-            genJet = JaggedCandidateArray.candidatesfromcounts(
-                df['nGenJet'],
-                pt = df['GenJet_pt'],
-                eta = df['GenJet_eta'],
-                phi = df['GenJet_phi'],
-                mass = df['GenJet_mass'],
-            )
-
-            jets.genJetIdx[jets.genJetIdx>=genJet.counts] = -1 #fixes a but in genJet indices, skimmed after genJet matching
-
-            jets['ptGenJet'][jets.genJetIdx>-1] = genJet[jets.genJetIdx[jets.genJetIdx>-1]].pt
+            #gen jet matching, from the derived generator level columns
+            jets['genJetIdx'] = genColumns['Jet_genJetIdx']
+            jets['ptGenJet'] = genColumns['Jet_ptGenJet']
             jets['rho'] = jets.pt.ones_like()*rho
 
-            #adds additional columns to the jets array, containing the jet pt with JEC and JER variations
-            #    additional columns added to jets:  pt_jer_up,   mass_jer_up
-            #                                       pt_jer_down, mass_jer_down
-            #                                       pt_jes_up,   mass_jes_up
-            #                                       pt_jes_down, mass_jes_down
-            Jet_transformer.transform(jets)
+            #jet preselection, on quantities which are not changed by the jet energy corrections (|eta| < 2.4 and the jet ID)
+            #  only these jets are corrected and kept, every jet selection below requires them
+            jetPreselect = (abs(jets.eta) < 2.4) & ((jets.jetId >> 1 & 1) == 1)
+
+            #applies JEC and JER to the preselected jets, and adds columns to the jets array with the variation of self.jetSyst
+            #    additional columns added to jets:  pt_jer_up,   mass_jer_up   (JERUp)
+            #                                       pt_jer_down, mass_jer_down (JERDown)
+            #                                       pt_jes_up,   mass_jes_up   (JESUp)
+            #                                       pt_jes_down, mass_jes_down (JESDown)
+            jets = Jet_corrector.transform(jets, self.jetSyst, mask=jetPreselect,
+                                           seed=None if self.jerSeed is None else chunkSeed(self.jerSeed, df))
+            #the corrections are computed in float64, bring the new columns back to the float32 policy
+            if self.floatType != np.float64:
+                castCandidates(jets, self.floatType)
 
             # 4. ADD SYSTEMATICS
             #   If processing a jet systematic (based on value of self.jetSyst variable) update the jet pt and mass to reflect the jet systematic uncertainty variations
@@ -454,10 +470,13 @@ class TTGammaProcessor(processor.ProcessorABC):
         # 1. ADD SELECTION
         #select good jets
         # jetsshould have a pt of at least 30 GeV, |eta| < 2.4, pass the medium jet id (bit-wise selected from the jetID variable), and pass the delta R cuts defined above (dRjetmu, dRjetele, dRjetpho)
-        jetSelect = ((?) &
-                     (?) &
-                     ((jets.jetId >> 1 & 1)==1) &
-                     ? & ? & ? )
+        #  (the jet id and delta R cuts are defined in utils/objectID.py, and can be given by name: 'jetId', 'dRmu', 'dRele', 'dRpho')
+        tightJetID = jetID.withSelection('tight', [?,
+                                                   ?,
+                                                   'jetId',
+                                                   ?, ?, ?])
+        jetBits = tightJetID.bitmask(jets, dRjetmu=dRjetmu, dRjetele=dRjetele, dRjetpho=dRjetpho)
+        jetSelect = tightJetID.passes(jetBits, 'tight')
         
         # 1. ADD SELECTION
         #select the subset of jets passing the jetSelect cuts
@@ -468,14 +487,26 @@ class TTGammaProcessor(processor.ProcessorABC):
         bTagWP = 0.6321   #2016 DeepCSV working point
 
         # 1. ADD SELECTION
-        # select the subset of tightJets which pass the Deep CSV tagger
+        # bTagSelect should be true for the jets passing jetSelect and the Deep CSV tagger (btag column) working point
+        bTagSelect = ?
+        # select the subset of jets which pass the bTagSelect cuts
         bTaggedJets = ?
+
+        #b-tagging decision of each of the tightJets, used for the b-tagging weights
+        btagged = bTagSelect[jetSelect]
         """
 
 
         #####################
         # EVENT SELECTION
         #####################
+        #create a selection object
+        #  SelectionCache is used like a PackedSelection, and memoizes the masks returned by selection.all()
+        #  cuts which change with a jet energy systematic can also be added for it, ex: selection.add('jetSel', array_of_booleans, syst='JESUp')
+        #  data events outside of the certified luminosity sections, or kept in another primary dataset (eventMask), fail every combination of cuts
+        #  the masks returned by selection.all() are shared by all the calls, and read-only (use mask & other, not mask &= other)
+        selection = SelectionCache(mask=eventMask)
+
         ### PART 1B: Uncomment to add event selection
         """
         # 1. ADD SELECTION
@@ -524,9 +555,6 @@ class TTGammaProcessor(processor.ProcessorABC):
         #                                                have no loose electrons
         electron_eventSelection = ?
 
-        #create a selection object
-        selection = processor.PackedSelection()
-
         # 1. ADD SELECTION
         #add selection 'eleSel', for events passing the electron event selection, and muSel for those passing the muon event selection
         #  ex: selection.add('testSelection', array_of_booleans)
@@ -545,6 +573,10 @@ class TTGammaProcessor(processor.ProcessorABC):
         selection.add('onePho', ?)
         # add selection for events with exactly 1 loose photon
         selection.add('loosePho', ?)
+
+        #events which can be filled in a histogram (passing a lepton selection and one of the jet selections)
+        #  the scale factors and event weights are only computed for these events
+        weightMask = (selection.all('eleSel') | selection.all('muSel')) & (selection.all('jetSel') | selection.all('jetSel_3j0t'))
         """
 
         ##################
@@ -581,27 +613,22 @@ class TTGammaProcessor(processor.ProcessorABC):
 
         # Define photon category for each event
 
-        phoCategory = np.ones(df.size)
-        phoCategoryLoose = np.ones(df.size)
+        phoCategory = np.ones(df.size, dtype=self.floatType)
+        phoCategoryLoose = np.ones(df.size, dtype=self.floatType)
 
         # PART 2B: Uncomment to begin implementing photon categorization
         """
         if not isData:
-            #### Photon categories, using genIdx branch of the leading photon in the event
-            idx = leadingPhoton.genIdx
-            
-            # look through gen particle history, finding the highest PDG ID
-            maxParent = maxHistoryPDGID(idx.content, idx.starts, idx.stops, 
-                                        genpdgid.content, genpdgid.starts, genpdgid.stops, 
-                                        genmotherIdx.content, genmotherIdx.starts, genmotherIdx.stops)
+            #### Photon categories, using the gen matching of the leading photon in the event
+            #  genMatchedPho, genMatchedEle and genMaxParent are the derived generator level columns of the photons
 
             # reco photons matched to a generated photon
-            matchedPho = (genpdgid[idx]==22).any()
+            matchedPho = leadingPhoton.genMatchedPho.any()
             # reco photons really generated as electrons
-            matchedEle = (abs(genpdgid[idx])==11).any()
+            matchedEle = leadingPhoton.genMatchedEle.any()
 
             # if the gen photon has a PDG ID > 25 in it's history, it has a hadronic parent
-            hadronicParent = maxParent>25
+            hadronicParent = (leadingPhoton.genMaxParent>25).any()
 
 
             #####
@@ -621,19 +648,13 @@ class TTGammaProcessor(processor.ProcessorABC):
             
 
             # do photon matching for loose photons as well
-            # look through parentage to find if any hadrons in genPhoton parent history
-            idx = leadingPhotonLoose.genIdx
-
             # reco photons matched to a generated photon
-            matchedPhoLoose = (genpdgid[idx]==22).any()
+            matchedPhoLoose = leadingPhotonLoose.genMatchedPho.any()
             # reco photons really generated as electrons
-            matchedEleLoose = (abs(genpdgid[idx])==11).any()
+            matchedEleLoose = leadingPhotonLoose.genMatchedEle.any()
 
-            maxParent = maxHistoryPDGID(idx.content, idx.starts, idx.stops, 
-                                        genpdgid.content, genpdgid.starts, genpdgid.stops, 
-                                        genmotherIdx.content, genmotherIdx.starts, genmotherIdx.stops)
-
-            hadronicParent = maxParent>25
+            # look through parentage to find if any hadrons in genPhoton parent history
+            hadronicParent = (leadingPhotonLoose.genMaxParent>25).any()
 
             #####
             # 2. DEFINE VARIABLES
@@ -654,27 +675,29 @@ class TTGammaProcessor(processor.ProcessorABC):
         # EVENT WEIGHTS
         ################
 
-        #create a processor Weights object, with the same length as the number of events in the chunk
-        weights = processor.Weights(len(df['event']))
+        #create a WeightMatrix object (used like a processor Weights object), with the same length as the number of events in the chunk
+        #  (for MC, PART 4 replaces it by one which only keeps the weights of the events in weightMask)
+        weights = WeightMatrix(len(df['event']), dtype=self.floatType)
   
         if not isData:
 
-            lumiWeight = np.ones(df.size)
-            nMCevents = self.mcEventYields[datasetFull]
-            xsec = crossSections[dataset]
-            luminosity = 35860.0
-            lumiWeight *= xsec * luminosity / nMCevents
-
-            weights.add('lumiWeight',lumiWeight)
+            #the cross section and luminosity normalization is deferred to postprocess, only the processed datasets are recorded here
+            #  (normalized by the number of generated events of the normalization table)
+            output['processedEvents'][datasetFull] += df.size
 
             # PART 4: Uncomment to add weights and systematics
             """
-            nPUTrue = df['Pileup_nTrueInt']
+            #the weights are only kept for the events in weightMask, and the scale factors are evaluated only for these events
+            #  (the events which are not filled in any histogram have a weight of 1)
+            weights = WeightMatrix(len(df['event']), mask=weightMask, dtype=self.floatType)
+
+            nPUTrue = df['Pileup_nTrueInt'][weightMask]
 
             # 4. SYSTEMATICS
             # calculate pileup weights and variations
             # use the puLookup, puLookup_Up, and puLookup_Down lookup functions to find the nominal and up/down systematic weights
             # the puLookup function is called with the full dataset name (datasetFull) and the number of true interactions
+            #   ex: puWeight = puLookup(datasetFull, nPUTrue)
             puWeight = ?
             puWeight_Up = ?
             puWeight_Down = ?
@@ -682,10 +705,11 @@ class TTGammaProcessor(processor.ProcessorABC):
             weights.add('puWeight',weight=?, weightUp=?, weightDown=?)
 
 
-            eleID = self.ele_id_sf(tightElectron.eta, tightElectron.pt)
-            eleIDerr = self.ele_id_err(tightElectron.eta, tightElectron.pt)
-            eleRECO = self.ele_reco_sf(tightElectron.eta, tightElectron.pt)
-            eleRECOerr = self.ele_reco_err(tightElectron.eta, tightElectron.pt)
+            weightElectron = tightElectron[weightMask]
+            eleID = self.ele_id_sf(weightElectron.eta, weightElectron.pt)
+            eleIDerr = self.ele_id_err(weightElectron.eta, weightElectron.pt)
+            eleRECO = self.ele_reco_sf(weightElectron.eta, weightElectron.pt)
+            eleRECOerr = self.ele_reco_err(weightElectron.eta, weightElectron.pt)
 
             eleSF = (eleID*eleRECO).prod()
             eleSF_up = ((eleID + eleIDerr) * (eleRECO + eleRECOerr)).prod()
@@ -694,12 +718,13 @@ class TTGammaProcessor(processor.ProcessorABC):
             # add electron efficiency weights to the weight container
             weights.add('eleEffWeight',weight=?, weightUp=?, weightDown=?)
 
-            muID = self.mu_id_sf(tightMuon.eta, tightMuon.pt)
-            muIDerr = self.mu_id_err(tightMuon.eta, tightMuon.pt)
-            muIso = self.mu_iso_sf(tightMuon.eta, tightMuon.pt)
-            muIsoerr = self.mu_iso_err(tightMuon.eta, tightMuon.pt)
-            muTrig = self.mu_iso_sf(abs(tightMuon.eta), tightMuon.pt)
-            muTrigerr = self.mu_iso_err(abs(tightMuon.eta), tightMuon.pt)
+            weightMuon = tightMuon[weightMask]
+            muID = self.mu_id_sf(weightMuon.eta, weightMuon.pt)
+            muIDerr = self.mu_id_err(weightMuon.eta, weightMuon.pt)
+            muIso = self.mu_iso_sf(weightMuon.eta, weightMuon.pt)
+            muIsoerr = self.mu_iso_err(weightMuon.eta, weightMuon.pt)
+            muTrig = self.mu_iso_sf(abs(weightMuon.eta), weightMuon.pt)
+            muTrigerr = self.mu_iso_err(abs(weightMuon.eta), weightMuon.pt)
             
             muSF = (muID*muIso*muTrig).prod()
             muSF_up = ((muID + muIDerr) * (muIso + muIsoerr) * (muTrig + muTrigerr)).prod()
@@ -709,49 +734,54 @@ class TTGammaProcessor(processor.ProcessorABC):
             # add electron efficiency weights to the weight container
             weights.add('muEffWeight',weight=?, weightUp=?, weightDown=?)
 
+            #the jets of the events in weightMask (SelectionView or JaggedCandidateArray), the scale factor arrays below are
+            #  built with their counts and flattened values, as tightJets[weightMask] is not compact for a JaggedCandidateArray
+            weightJets = tightJets[weightMask]
+            weightBtagged = btagged[weightMask]
+
             #btag key name
             #name / working Point / type / systematic / jetType
             #  ... / 0-loose 1-medium 2-tight / comb,mujets,iterativefit / central,up,down / 0-b 1-c 2-udcsg 
 
-            bJetSF_b = self.evaluator['btag2016DeepCSV_1_comb_central_0'](tightJets[tightJets.hadFlav==5].eta, tightJets[tightJets.hadFlav==5].pt, tightJets[tightJets.hadFlav==5].btag)
-            bJetSF_c = self.evaluator['btag2016DeepCSV_1_comb_central_1'](tightJets[tightJets.hadFlav==4].eta, tightJets[tightJets.hadFlav==4].pt, tightJets[tightJets.hadFlav==4].btag)
-            bJetSF_udcsg = self.evaluator['btag2016DeepCSV_1_incl_central_2'](tightJets[tightJets.hadFlav==0].eta, tightJets[tightJets.hadFlav==0].pt, tightJets[tightJets.hadFlav==0].btag)
+            bJetSF_b = self.evaluator['btag2016DeepCSV_1_comb_central_0'](weightJets[weightJets.hadFlav==5].eta, weightJets[weightJets.hadFlav==5].pt, weightJets[weightJets.hadFlav==5].btag)
+            bJetSF_c = self.evaluator['btag2016DeepCSV_1_comb_central_1'](weightJets[weightJets.hadFlav==4].eta, weightJets[weightJets.hadFlav==4].pt, weightJets[weightJets.hadFlav==4].btag)
+            bJetSF_udcsg = self.evaluator['btag2016DeepCSV_1_incl_central_2'](weightJets[weightJets.hadFlav==0].eta, weightJets[weightJets.hadFlav==0].pt, weightJets[weightJets.hadFlav==0].btag)
 
-            bJetSF_b_up = self.evaluator['btag2016DeepCSV_1_comb_up_0'](tightJets[tightJets.hadFlav==5].eta, tightJets[tightJets.hadFlav==5].pt, tightJets[tightJets.hadFlav==5].btag)
-            bJetSF_c_up = self.evaluator['btag2016DeepCSV_1_comb_up_1'](tightJets[tightJets.hadFlav==4].eta, tightJets[tightJets.hadFlav==4].pt, tightJets[tightJets.hadFlav==4].btag)
-            bJetSF_udcsg_up = self.evaluator['btag2016DeepCSV_1_incl_up_2'](tightJets[tightJets.hadFlav==0].eta, tightJets[tightJets.hadFlav==0].pt, tightJets[tightJets.hadFlav==0].btag)
+            bJetSF_b_up = self.evaluator['btag2016DeepCSV_1_comb_up_0'](weightJets[weightJets.hadFlav==5].eta, weightJets[weightJets.hadFlav==5].pt, weightJets[weightJets.hadFlav==5].btag)
+            bJetSF_c_up = self.evaluator['btag2016DeepCSV_1_comb_up_1'](weightJets[weightJets.hadFlav==4].eta, weightJets[weightJets.hadFlav==4].pt, weightJets[weightJets.hadFlav==4].btag)
+            bJetSF_udcsg_up = self.evaluator['btag2016DeepCSV_1_incl_up_2'](weightJets[weightJets.hadFlav==0].eta, weightJets[weightJets.hadFlav==0].pt, weightJets[weightJets.hadFlav==0].btag)
 
-            bJetSF_b_down = self.evaluator['btag2016DeepCSV_1_comb_down_0'](tightJets[tightJets.hadFlav==5].eta, tightJets[tightJets.hadFlav==5].pt, tightJets[tightJets.hadFlav==5].btag)
-            bJetSF_c_down = self.evaluator['btag2016DeepCSV_1_comb_down_1'](tightJets[tightJets.hadFlav==4].eta, tightJets[tightJets.hadFlav==4].pt, tightJets[tightJets.hadFlav==4].btag)
-            bJetSF_udcsg_down = self.evaluator['btag2016DeepCSV_1_incl_down_2'](tightJets[tightJets.hadFlav==0].eta, tightJets[tightJets.hadFlav==0].pt, tightJets[tightJets.hadFlav==0].btag)
+            bJetSF_b_down = self.evaluator['btag2016DeepCSV_1_comb_down_0'](weightJets[weightJets.hadFlav==5].eta, weightJets[weightJets.hadFlav==5].pt, weightJets[weightJets.hadFlav==5].btag)
+            bJetSF_c_down = self.evaluator['btag2016DeepCSV_1_comb_down_1'](weightJets[weightJets.hadFlav==4].eta, weightJets[weightJets.hadFlav==4].pt, weightJets[weightJets.hadFlav==4].btag)
+            bJetSF_udcsg_down = self.evaluator['btag2016DeepCSV_1_incl_down_2'](weightJets[weightJets.hadFlav==0].eta, weightJets[weightJets.hadFlav==0].pt, weightJets[weightJets.hadFlav==0].btag)
 
-            bJetSF = JaggedArray(content = np.ones_like(tightJets.pt.content,dtype=np.float64), starts = tightJets.starts, stops = tightJets.stops)
-            bJetSF.content[(tightJets.hadFlav==5).content] = bJetSF_b.content
-            bJetSF.content[(tightJets.hadFlav==4).content] = bJetSF_c.content
-            bJetSF.content[(tightJets.hadFlav==0).content] = bJetSF_udcsg.content
+            bJetSF = JaggedArray.fromcounts(weightJets.counts, np.ones(weightJets.counts.sum(), dtype=self.floatType))
+            bJetSF.content[(weightJets.hadFlav==5).flatten()] = bJetSF_b.flatten()
+            bJetSF.content[(weightJets.hadFlav==4).flatten()] = bJetSF_c.flatten()
+            bJetSF.content[(weightJets.hadFlav==0).flatten()] = bJetSF_udcsg.flatten()
 
-            bJetSF_heavy_up = JaggedArray(content = np.ones_like(tightJets.pt.content,dtype=np.float64), starts = tightJets.starts, stops = tightJets.stops)
-            bJetSF_heavy_up.content[(tightJets.hadFlav==5).content] = bJetSF_b_up.content
-            bJetSF_heavy_up.content[(tightJets.hadFlav==4).content] = bJetSF_c_up.content
-            bJetSF_heavy_up.content[(tightJets.hadFlav==0).content] = bJetSF_udcsg.content
+            bJetSF_heavy_up = JaggedArray.fromcounts(weightJets.counts, np.ones(weightJets.counts.sum(), dtype=self.floatType))
+            bJetSF_heavy_up.content[(weightJets.hadFlav==5).flatten()] = bJetSF_b_up.flatten()
+            bJetSF_heavy_up.content[(weightJets.hadFlav==4).flatten()] = bJetSF_c_up.flatten()
+            bJetSF_heavy_up.content[(weightJets.hadFlav==0).flatten()] = bJetSF_udcsg.flatten()
 
-            bJetSF_heavy_down = JaggedArray(content = np.ones_like(tightJets.pt.content,dtype=np.float64), starts = tightJets.starts, stops = tightJets.stops)
-            bJetSF_heavy_down.content[(tightJets.hadFlav==5).content] = bJetSF_b_down.content
-            bJetSF_heavy_down.content[(tightJets.hadFlav==4).content] = bJetSF_c_down.content
-            bJetSF_heavy_down.content[(tightJets.hadFlav==0).content] = bJetSF_udcsg.content
+            bJetSF_heavy_down = JaggedArray.fromcounts(weightJets.counts, np.ones(weightJets.counts.sum(), dtype=self.floatType))
+            bJetSF_heavy_down.content[(weightJets.hadFlav==5).flatten()] = bJetSF_b_down.flatten()
+            bJetSF_heavy_down.content[(weightJets.hadFlav==4).flatten()] = bJetSF_c_down.flatten()
+            bJetSF_heavy_down.content[(weightJets.hadFlav==0).flatten()] = bJetSF_udcsg.flatten()
 
-            bJetSF_light_up = JaggedArray(content = np.ones_like(tightJets.pt.content,dtype=np.float64), starts = tightJets.starts, stops = tightJets.stops)
-            bJetSF_light_up.content[(tightJets.hadFlav==5).content] = bJetSF_b.content
-            bJetSF_light_up.content[(tightJets.hadFlav==4).content] = bJetSF_c.content
-            bJetSF_light_up.content[(tightJets.hadFlav==0).content] = bJetSF_udcsg_up.content
+            bJetSF_light_up = JaggedArray.fromcounts(weightJets.counts, np.ones(weightJets.counts.sum(), dtype=self.floatType))
+            bJetSF_light_up.content[(weightJets.hadFlav==5).flatten()] = bJetSF_b.flatten()
+            bJetSF_light_up.content[(weightJets.hadFlav==4).flatten()] = bJetSF_c.flatten()
+            bJetSF_light_up.content[(weightJets.hadFlav==0).flatten()] = bJetSF_udcsg_up.flatten()
 
-            bJetSF_light_down = JaggedArray(content = np.ones_like(tightJets.pt.content,dtype=np.float64), starts = tightJets.starts, stops = tightJets.stops)
-            bJetSF_light_down.content[(tightJets.hadFlav==5).content] = bJetSF_b.content
-            bJetSF_light_down.content[(tightJets.hadFlav==4).content] = bJetSF_c.content
-            bJetSF_light_down.content[(tightJets.hadFlav==0).content] = bJetSF_udcsg_down.content
+            bJetSF_light_down = JaggedArray.fromcounts(weightJets.counts, np.ones(weightJets.counts.sum(), dtype=self.floatType))
+            bJetSF_light_down.content[(weightJets.hadFlav==5).flatten()] = bJetSF_b.flatten()
+            bJetSF_light_down.content[(weightJets.hadFlav==4).flatten()] = bJetSF_c.flatten()
+            bJetSF_light_down.content[(weightJets.hadFlav==0).flatten()] = bJetSF_udcsg_down.flatten()
 
             ## mc efficiency lookup, data efficiency is eff* scale factor
-            btagEfficiencies = taggingEffLookup(datasetFull,tightJets.hadFlav,tightJets.pt,tightJets.eta)
+            btagEfficiencies = taggingEffLookup(datasetFull,weightJets.hadFlav,weightJets.pt,weightJets.eta)
             btagEfficienciesData = btagEfficiencies*bJetSF
 
             btagEfficienciesData_b_up   = btagEfficiencies*bJetSF_heavy_up
@@ -761,12 +791,12 @@ class TTGammaProcessor(processor.ProcessorABC):
 
             ##probability is the product of all efficiencies of tagged jets, times product of 1-eff for all untagged jets
             ## https://twiki.cern.ch/twiki/bin/view/CMS/BTagSFMethods#1a_Event_reweighting_using_scale
-            pMC   = btagEfficiencies[btagged].prod()     * (1.-btagEfficiencies[np.invert(btagged)]).prod() 
-            pData = btagEfficienciesData[btagged].prod() * (1.-btagEfficienciesData[np.invert(btagged)]).prod()
-            pData_b_up = btagEfficienciesData_b_up[btagged].prod() * (1.-btagEfficienciesData_b_up[np.invert(btagged)]).prod()
-            pData_b_down = btagEfficienciesData_b_down[btagged].prod() * (1.-btagEfficienciesData_b_down[np.invert(btagged)]).prod()
-            pData_l_up = btagEfficienciesData_l_up[btagged].prod() * (1.-btagEfficienciesData_l_up[np.invert(btagged)]).prod()
-            pData_l_down = btagEfficienciesData_l_down[btagged].prod() * (1.-btagEfficienciesData_l_down[np.invert(btagged)]).prod()
+            pMC   = btagEfficiencies[weightBtagged].prod()     * (1.-btagEfficiencies[np.invert(weightBtagged)]).prod() 
+            pData = btagEfficienciesData[weightBtagged].prod() * (1.-btagEfficienciesData[np.invert(weightBtagged)]).prod()
+            pData_b_up = btagEfficienciesData_b_up[weightBtagged].prod() * (1.-btagEfficienciesData_b_up[np.invert(weightBtagged)]).prod()
+            pData_b_down = btagEfficienciesData_b_down[weightBtagged].prod() * (1.-btagEfficienciesData_b_down[np.invert(weightBtagged)]).prod()
+            pData_l_up = btagEfficienciesData_l_up[weightBtagged].prod() * (1.-btagEfficienciesData_l_up[np.invert(weightBtagged)]).prod()
+            pData_l_down = btagEfficienciesData_l_down[weightBtagged].prod() * (1.-btagEfficienciesData_l_down[np.invert(weightBtagged)]).prod()
 
             pMC[pMC==0]=1. #avoid 0/0 error
             btagWeight = pData/pMC
@@ -785,60 +815,19 @@ class TTGammaProcessor(processor.ProcessorABC):
 
 
 
+            #PDF, Q2 scale and ISR/FSR uncertainty weights, computed from the generator weights for the events in weightMask
             #in some samples, generator systemtatics are not available, in those case the systematic weights of 1. are used
             try:
-                generatorWeight = df['Generator_weight']
-                generatorWeight.shape = (generatorWeight.size,1)
-
-                LHEWeight_originalXWGTUP = df['LHEWeight_originalXWGTUP']
-                LHEWeight_originalXWGTUP.shape = (LHEWeight_originalXWGTUP.size,1)
-
-                nPSWeights = df['nPSWeight']
-                PSWeights = df['PSWeight']
-                PSWeights.shape = (nPSWeights.size,int(nPSWeights.mean()))
-                if nPSWeights.mean()==1:
-                    hasWeights=False
-                
-                nLHEScaleWeights = df['nLHEScaleWeight']
-                LHEScaleWeights = df['LHEScaleWeight']
-                LHEScaleWeights.shape = (nLHEScaleWeights.size,int(nLHEScaleWeights.mean()))
-                
-                nLHEPdfWeights = df['nLHEPdfWeight']
-                LHEPdfWeights = df['LHEPdfWeight']
-                LHEPdfWeights.shape = (nLHEPdfWeights.size,int(nLHEPdfWeights.mean()))
-
-                #PDF Uncertainty weights
-                #avoid errors from 0/0 division
-                if (LHEPdfWeights[:,:1]==0).any():
-                    LHEPdfWeights[:,0][LHEPdfWeights[:,0]==0] = 1.
-                LHEPdfVariation = LHEPdfWeights / LHEPdfWeights[:,:1]
-
-                weights.add('PDF', weight=np.ones(df.size), weightUp=LHEPdfVariation.max(axis=1), weightDown=LHEPdfVariation.min(axis=1))
-
-                #Q2 Uncertainty weights
-                if nLHEScaleWeights.mean()==9:
-                    scaleWeightSelector=[0,1,3,5,7,8]
-                elif nLHEScaleWeights.mean()==44:
-                    scaleWeightSelector=[0,5,15,24,34,39]
+                theory = theoryWeights(df, weightMask, dtype=self.floatType)
+            except KeyError:
+                theory = None
+
+            nWeighted = weightMask.sum()
+            for name in ['PDF','Q2Scale','ISR','FSR']:
+                if theory is None:
+                    weights.add(name, weight=np.ones(nWeighted, dtype=self.floatType), weightUp=np.ones(nWeighted, dtype=self.floatType), weightDown=np.ones(nWeighted, dtype=self.floatType))
                 else:
-                    scaleWeightSelector=[]
-
-                LHEScaleVariation = LHEScaleWeights[:,scaleWeightSelector]
-
-                weights.add('Q2Scale', weight=np.ones(df.size), weightUp=LHEScaleVariation.max(axis=1), weightDown=LHEScaleVariation.min(axis=1))
-
-                #ISR / FSR uncertainty weights
-                if not (generatorWeight==LHEWeight_originalXWGTUP).all():
-                    PSWeights = PSWeights * LHEWeight_originalXWGTUP / generatorWeight
-
-                weights.add('ISR',weight=np.ones(df.size), weightUp=PSWeights[:,2], weightDown=PSWeights[:,0])
-                weights.add('FSR',weight=np.ones(df.size), weightUp=PSWeights[:,3], weightDown=PSWeights[:,1])
-
-            else:
-                weights.add('ISR',    weight=np.ones(df.size),weightUp=np.ones(df.size),weightDown=np.ones(df.size))
-                weights.add('FSR',    weight=np.ones(df.size),weightUp=np.ones(df.size),weightDown=np.ones(df.size))
-                weights.add('PDF',    weight=np.ones(df.size),weightUp=np.ones(df.size),weightDown=np.ones(df.size))
-                weights.add('Q2Scale',weight=np.ones(df.size),weightUp=np.ones(df.size),weightDown=np.ones(df.size))
+                    weights.add(name, weight=np.ones(nWeighted, dtype=self.floatType), weightUp=theory[f'{name}Up'], weightDown=theory[f'{name}Down'])
 
             """
 
@@ -860,6 +849,9 @@ class TTGammaProcessor(processor.ProcessorABC):
         if isData:
             systList = ['noweight']
 
+        #compute the nominal weight and all its variations at once, only for the events which can be filled in a histogram
+        weights.build()
+
         for syst in systList:
             
             #find the event weight to be used when filling the histograms
@@ -868,11 +860,12 @@ class TTGammaProcessor(processor.ProcessorABC):
             if syst in ['nominal','JERUp','JERDown','JESUp','JESDown']:
                 weightSyst=None
                 
+            #evtWeight(mask) gives the weights of the events passing mask
             if syst=='noweight':
-                evtWeight = np.ones(df.size)
+                evtWeight = lambda mask: np.ones(mask.sum(), dtype=self.floatType)
             else:
-                # call weights.weight() with the name of the systematic to be varied
-                evtWeight = weights.weight(weightSyst)
+                # call weights.weight() with the name of the systematic to be varied, and the mask of the events to be filled
+                evtWeight = lambda mask: weights.weight(weightSyst, mask)
 
 
             #loop over both electron and muon selections
@@ -884,12 +877,14 @@ class TTGammaProcessor(processor.ProcessorABC):
 
                 # 3. GET HISTOGRAM EVENT SELECTION
                 #  use the selection.all() method to select events passing the lepton selection, 4-jet 1-tag jet selection, and either the one-photon or loose-photon selections
-                #  ex: selection.all( *('LIST', 'OF', 'SELECTION', 'CUTS') )
+                #  ex: selection.all( *('LIST', 'OF', 'SELECTION', 'CUTS'), syst=syst )
+                #  weight systematics reuse the masks of the nominal selection, only cuts added for syst are recombined
                 phosel = selection.all( *(???))
                 phoselLoose = selection.all( *(???) )
 
                 # 3. FILL HISTOGRAMS
                 #    fill photon_pt and photon_eta, using the tightPhotons array, from events passing the phosel selection
+                #    the weights of the events passing the phosel selection are evtWeight(phosel)
                 output['photon_pt'].fill(dataset=dataset,
                                          pt=?,
                                          category=?,
@@ -924,8 +919,8 @@ class TTGammaProcessor(processor.ProcessorABC):
             
             # 3. GET HISTOGRAM EVENT SELECTION
             #  use the selection.all() method to select events passing the eleSel or muSel selection, 3-jet 0-btag selection, and have exactly one photon
-            phosel_3j0t_e  = selection.all( *('eleSel', ???) )
-            phosel_3j0t_mu = selection.all( *('muSel', ???) )
+            phosel_3j0t_e  = selection.all( *('eleSel', ???), syst=syst )
+            phosel_3j0t_mu = selection.all( *('muSel', ???), syst=syst )
 
             # 3. FILL HISTOGRAMS
             # fill photon_lepton_mass_3j0t histogram, using the egammaMass array, for events passing the phosel_3j0t_e 
@@ -941,14 +936,25 @@ class TTGammaProcessor(processor.ProcessorABC):
                                                    lepFlavor='muon',
                                                    systematic=syst,
                                                    weight=?)
-            
         """
 
+        selection.report(output['selectionCache'])
+
         output['EventCount'] = len(df['event'])
 
         return output
 
     def postprocess(self, accumulator):
+        #derive the b-tagging efficiency lookup from the histograms filled in this pass
+        #  for outputs split over several jobs, merge the outputs first and call taggingEfficiencyLookup on the merged hJets and hBJets
+        if self.measureBtagEff and not self.btagEffOutput is None and len(accumulator['hJets'].identifiers('dataset'))>0:
+            saveTaggingEfficiencyLookup(taggingEfficiencyLookup(accumulator['hJets'], accumulator['hBJets']), self.btagEffOutput)
+
+        #scale MC histograms to cross section times luminosity
+        #  the output can later be renormalized with another table version using ttgamma.utils.normalization.normalize
+        if not self.normalization is None:
+            normalize(accumulator, self.normalization, self.mcEventYields)
+
         return accumulator
 
 
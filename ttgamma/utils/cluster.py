@@ -0,0 +1,302 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.managers import BaseManager
+
+import cloudpickle
+import lz4.frame as lz4f
+from tqdm import tqdm
+
+from .jit import setThreads, threadsPerWorker, warmUp
+
+#executor scheduling the work units of run_uproot_job over worker processes, started locally and/or on remote nodes by any batch system
+#  the coordinator (the process calling run_uproot_job) serves a queue of work units, workers connect to it and pull one unit at a time,
+#  so fast workers simply process more units (dynamic scheduling), and the results are merged into the output as they arrive
+#  - work stealing: once the queue is empty, idle workers also run a copy of the units which have been running the longest,
+#                   the first copy to finish is kept, so a slow or stuck worker does not hold up the end of the job
+#  - retries:       a unit which raises, or whose worker stops sending heartbeats (killed, preempted, lost node), is queued again,
+#                   up to retries times
+#  workers on other nodes are started with:  python -m ttgamma.utils.cluster HOST:PORT [--workers N]
+#  each worker sets the threads of the parallel kernels from the workers and cores of its own node (or batch slot), so the processor
+#  should be given threads=None
+#  with the same key in TTGAMMA_CLUSTER_KEY, which is needed to accept connections from other hosts (the workers unpickle what they receive)
+
+_done = 'done'
+
+
+def _address(address):
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+def _authkey(authkey=None):
+    if authkey is None and 'TTGAMMA_CLUSTER_KEY' in os.environ:
+        authkey = os.environ['TTGAMMA_CLUSTER_KEY']
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+class _SchedulerManager(BaseManager):
+    pass
+
+_SchedulerManager.register('scheduler')
+
+
+#state of the work units, shared by the connections of the workers (each served in its own thread)
+class Scheduler:
+    def __init__(self, items, function, retries=2, timeout=120., stealAfter=30.):
+        self._lock = threading.Lock()
+        self._items = items
+        self._function = cloudpickle.dumps(function)
+        self.retries = retries
+        self.timeout = timeout
+        self.stealAfter = stealAfter
+
+        self._pending = collections.deque(range(len(items)))
+        self._running = collections.defaultdict(dict)
+        self._attempts = [0]*len(items)
+        self._finished = set()
+        self._workers = {}
+        self._connected = 0
+        self._closed = False
+        self.results = queue.Queue()
+        self.stolen = 0
+        self.requeued = 0
+
+    def hello(self, host):
+        with self._lock:
+            workerId = f'{host}_{self._connected}'
+            self._connected += 1
+            self._workers[workerId] = time.time()
+        return workerId, self._function
+
+    def heartbeat(self, workerId):
+        with self._lock:
+            if workerId in self._workers:
+                self._workers[workerId] = time.time()
+
+    #next unit for a worker: None if there is nothing to do for now, 'done' once every unit is finished
+    def next(self, workerId):
+        with self._lock:
+            if self._closed:
+                return _done
+            #(also brings back a worker which was considered lost)
+            self._workers[workerId] = time.time()
+
+            now = time.time()
+            if len(self._pending) > 0:
+                unit = self._pending.popleft()
+                self._attempts[unit] += 1
+            else:
+                #steal the unit running for the longest time, which is not already running on this worker or copied
+                candidates = [(min(copies.values()), unit) for unit, copies in self._running.items()
+                              if len(copies) == 1 and not workerId in copies and now - min(copies.values()) > self.stealAfter]
+                if len(candidates) == 0:
+                    return None
+                unit = min(candidates)[1]
+                self.stolen += 1
+            self._running[unit][workerId] = now
+            return unit, self._items[unit]
+
+    def result(self, workerId, unit, payload, error=None):
+        with self._lock:
+            self._workers[workerId] = time.time()
+            self._running[unit].pop(workerId, None)
+            if unit in self._finished:
+                #a copy of this unit has already finished
+                return
+            if error is None:
+                self._finished.add(unit)
+                self._running.pop(unit)
+                self.results.put((unit, payload, None))
+            elif len(self._running[unit]) == 0:
+                self._retry(unit, error)
+
+    def _retry(self, unit, error):
+        self._running.pop(unit, None)
+        if self._attempts[unit] > self.retries:
+            self._finished.add(unit)
+            self.results.put((unit, None, error))
+        else:
+            self.requeued += 1
+            self._pending.appendleft(unit)
+
+    #forget the workers without heartbeat for timeout seconds, and queue again the units which were only running on them
+    def expire(self):
+        with self._lock:
+            now = time.time()
+            lost = [workerId for workerId, last in self._workers.items() if now - last > self.timeout]
+            for workerId in lost:
+                del self._workers[workerId]
+            for unit, copies in list(self._running.items()):
+                for workerId in lost:
+                    copies.pop(workerId, None)
+                if len(copies) == 0:
+                    self._retry(unit, f'worker lost (no heartbeat for {self.timeout} s)')
+            return len(self._workers)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+
+def _connect(address, authkey, attempts=30):
+    for attempt in range(attempts):
+        try:
+            manager = _SchedulerManager(address=address, authkey=authkey)
+            manager.connect()
+            return manager.scheduler()
+        except ConnectionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(1)
+
+
+#heartbeats of a worker, on their own connection while the worker is processing a unit
+def _heartbeat(address, authkey, workerId, stop, interval):
+    scheduler = _connect(address, authkey)
+    while not stop.wait(interval):
+        try:
+            scheduler.heartbeat(workerId)
+        except (EOFError, ConnectionError):
+            return
+
+
+#worker loop: pull units from the coordinator at address until every unit is done, or the coordinator is gone
+#  threads is the number of threads of the parallel kernels of this worker (None keeps numba's default)
+def runWorker(address, authkey=None, heartbeat=10., warm=True, threads=None):
+    address, authkey = _address(address), _authkey(authkey)
+    setThreads(threads)
+    scheduler = _connect(address, authkey)
+    workerId, function = scheduler.hello(socket.gethostname())
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(address, authkey, workerId, stop, heartbeat), daemon=True).start()
+
+    try:
+        function = cloudpickle.loads(function)
+        if warm:
+            warmUp()
+        while True:
+            try:
+                task = scheduler.next(workerId)
+                if task == _done:
+                    break
+                if task is None:
+                    time.sleep(0.5)
+                    continue
+                unit, item = task
+                try:
+                    payload, error = lz4f.compress(cloudpickle.dumps(function(item)), compression_level=1), None
+                except Exception:
+                    payload, error = None, traceback.format_exc()
+                scheduler.result(workerId, unit, payload, error)
+            except (EOFError, ConnectionError):
+                break
+    finally:
+        stop.set()
+
+
+#executor for run_uproot_job (executor=cluster_executor), with the executor_args:
+#  workers:    number of local worker processes (default 1), can be 0 if all the workers are remote
+#  address:    'host:port' the coordinator listens on (default: a free port on localhost, for local workers only)
+#  authkey:    key of the connections (default: TTGAMMA_CLUSTER_KEY, or a random key for local workers only)
+#  retries:    number of times a failed or lost unit is queued again (default 2)
+#  timeout:    seconds without heartbeat after which a worker is considered lost (default 120)
+#  stealAfter: seconds a unit must have been running before idle workers run a copy of it (default 30)
+#  status:     progress bar (default True)
+def cluster_executor(items, function, accumulator, **kwargs):
+    if len(items) == 0:
+        return accumulator
+    workers = kwargs.pop('workers', 1)
+    address = _address(kwargs.pop('address', ('127.0.0.1', 0)))
+    authkey = _authkey(kwargs.pop('authkey', None))
+    status = kwargs.pop('status', True)
+    unit = kwargs.pop('unit', 'items')
+    desc = kwargs.pop('desc', 'Processing')
+    localOnly = address[0] in ['127.0.0.1', 'localhost']
+    if authkey is None:
+        if not localOnly:
+            raise Exception('a key (TTGAMMA_CLUSTER_KEY) is needed to accept workers from other hosts')
+        authkey = os.urandom(16)
+
+    scheduler = Scheduler(items, function,
+                          retries=kwargs.pop('retries', 2),
+                          timeout=kwargs.pop('timeout', 120.),
+                          stealAfter=kwargs.pop('stealAfter', 30.))
+    manager = type('CoordinatorManager', (BaseManager,), {})
+    manager.register('scheduler', callable=lambda: scheduler)
+    server = manager(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    #local workers connect to the interface the coordinator listens on (the loopback one if it listens on all of them)
+    host = server.address[0] if not server.address[0] in ['', '0.0.0.0'] else '127.0.0.1'
+    if not localOnly:
+        publicHost = socket.getfqdn() if host == '127.0.0.1' else host
+        print(f"Coordinator listening on {publicHost}:{server.address[1]}, "
+              f"start workers with: python -m ttgamma.utils.cluster {publicHost}:{server.address[1]}", file=sys.stderr)
+
+    context = multiprocessing.get_context('spawn')
+    def startWorker():
+        process = context.Process(target=runWorker, args=((host, server.address[1]), authkey, 10., True, threadsPerWorker(workers)), daemon=True)
+        process.start()
+        return process
+    processes = [startWorker() for _ in range(workers)]
+    #local workers which died are replaced, a limited number of times so a systematic crash does not loop forever
+    restarts = workers*scheduler.retries
+
+    try:
+        with tqdm(disable=not status, unit=unit, total=len(items), desc=desc) as pbar:
+            for _ in range(len(items)):
+                while True:
+                    try:
+                        index, payload, error = scheduler.results.get(timeout=1.)
+                        break
+                    except queue.Empty:
+                        connected = scheduler.expire()
+                        for i, process in enumerate(processes):
+                            if not process.is_alive() and restarts > 0:
+                                processes[i] = startWorker()
+                                restarts -= 1
+                        #with remote workers, only once none of them has sent a heartbeat for timeout seconds either
+                        if workers > 0 and not any(process.is_alive() for process in processes) and (localOnly or connected == 0):
+                            raise Exception('all the local workers have stopped' + ('' if localOnly else ', and no remote worker is connected'))
+                if not error is None:
+                    raise Exception(f'work unit {items[index]} failed after {scheduler.retries + 1} attempts:\n{error}')
+                #streaming merge of the results, each result is released once merged
+                accumulator.add(pickle.loads(lz4f.decompress(payload)))
+                pbar.update(1)
+    finally:
+        #idle workers stop at their next request, those still running a copy of a finished unit are stopped
+        scheduler.close()
+        for process in processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        server.stop_event.set()
+    if status and (scheduler.stolen > 0 or scheduler.requeued > 0):
+        print(f"{scheduler.stolen} units stolen by idle workers, {scheduler.requeued} units retried", file=sys.stderr)
+    return accumulator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start workers for a coordinator running run_uproot_job with cluster_executor')
+    parser.add_argument('address', help='host:port of the coordinator')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes on this node')
+    parser.add_argument('--cores', type=int, default=None, help='cores shared by the workers (default: the cores of the batch slot or node)')
+    args = parser.parse_args()
+
+    threads = threadsPerWorker(args.workers, args.cores)
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=runWorker, args=(args.address, None, 10., True, threads)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,86 @@
+import glob
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+#primary datasets of the data, in order of precedence, with the triggers selecting their events in the analysis
+#  an event firing the triggers of several primary datasets is recorded in each of them, it is only kept in the first one
+primaryDatasets = [('SingleMu',  ['HLT_IsoMu24', 'HLT_IsoTkMu24']),
+                   ('SingleEle', ['HLT_Ele27_WPTight_Gsf']),
+                  ]
+
+
+#name of the primary dataset of a data sample (ex: Data_SingleEle_b_2016 -> SingleEle), None if it is not in precedence
+def primaryDataset(dataset, precedence=primaryDatasets):
+    for name, _ in precedence:
+        if f'_{name}_' in f'_{dataset}_':
+            return name
+    return None
+
+
+#events of a data chunk kept in its primary dataset: those which do not fire the triggers of a primary dataset of higher precedence
+#  each event is then counted in exactly one primary dataset, whichever chunk, file or worker processes it
+def precedenceMask(df, dataset, precedence=primaryDatasets):
+    name = primaryDataset(dataset, precedence)
+    mask = np.ones(df.size, dtype=bool)
+    if name is None:
+        return mask
+    for other, triggers in precedence:
+        if other == name:
+            break
+        for trigger in triggers:
+            mask &= ~np.asarray(df[trigger], dtype=bool)
+    return mask
+
+
+#validation of the duplicate removal: the (run, event) of the events kept by each chunk are written to a directory shared by the
+#  workers, in one of nPartitions partitions by run, and findDuplicates then compares one partition at a time, so the memory
+#  needed is that of a single partition whatever the size of the dataset
+#  the file of a chunk is named by its file and first entry, so a chunk processed again overwrites it
+def writeEventKeys(checkDir, df, mask, nPartitions=64):
+    runs = np.asarray(df['run'], dtype=np.uint32)[mask]
+    events = np.asarray(df['event'], dtype=np.uint64)[mask]
+    fileName = df['fileuuid'] if 'fileuuid' in df else os.path.basename(df['filename'])
+    partitions = runs % nPartitions
+    for partition in np.unique(partitions):
+        selected = partitions == partition
+        directory = os.path.join(checkDir, f'{partition:03d}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{df['dataset']}_{fileName}_{df['entrystart']}.npz")
+        with open(f'{path}.tmp', 'wb') as f:
+            np.savez(f, run=runs[selected], event=events[selected], dataset=df['dataset'])
+        os.replace(f'{path}.tmp', path)
+
+
+#events found in more than one chunk, from the directory filled by writeEventKeys
+#  returns the number of duplicated events for each pair of datasets
+def findDuplicates(checkDir):
+    duplicates = defaultdict(int)
+    for directory in sorted(glob.glob(os.path.join(checkDir, '[0-9][0-9][0-9]'))):
+        runs, events, sources, datasets = [], [], [], []
+        for i, path in enumerate(sorted(glob.glob(os.path.join(directory, '*.npz')))):
+            with np.load(path) as keys:
+                runs.append(keys['run'])
+                events.append(keys['event'])
+                datasets.append(str(keys['dataset']))
+            sources.append(np.full(len(runs[-1]), i, dtype=np.int32))
+        if len(runs) == 0:
+            continue
+        runs, events, sources = np.concatenate(runs), np.concatenate(events), np.concatenate(sources)
+
+        order = np.lexsort((events, runs))
+        runs, events, sources = runs[order], events[order], sources[order]
+        repeated = np.flatnonzero((runs[1:] == runs[:-1]) & (events[1:] == events[:-1]))
+        for i in repeated:
+            duplicates[tuple(sorted([datasets[sources[i]], datasets[sources[i + 1]]]))] += 1
+    return dict(duplicates)
+
+
+if __name__ == '__main__':
+    duplicates = findDuplicates(sys.argv[1])
+    for datasets, count in sorted(duplicates.items()):
+        print(f"{' / '.join(datasets)}: {count} duplicated events")
+    if len(duplicates) == 0:
+        print('no duplicated events')
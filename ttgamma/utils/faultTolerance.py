@@ -0,0 +1,188 @@
+import collections
+import json
+import os
+import time
+from functools import partial
+
+import uproot4
+
+from coffea.processor import dict_accumulator, set_accumulator
+from coffea.processor.executor import FileMeta
+
+#error isolation for run_uproot_job: a chunk (or a file, when reading its metadata) which can not be read is retried with an
+#  exponential backoff, and if it still fails it is recorded in the output instead of stopping the job, so the rest of the datasets completes
+#  - only read errors are isolated: I/O errors, and the errors raised by uproot (deserialization, decompression, missing keys),
+#    any other error (a bug in the processor) stops the job as usual
+#  - the failed chunks are recorded in output['failedChunks'] as (dataset, filename, entrystart, entrystop, error),
+#    a file whose metadata can not be read is recorded as a single range (0, None)
+#  - a worker skips the remaining chunks of a file once maxFileFailures of its chunks have failed
+#  - the files with failures are written to a quarantine list next to the output, with the number of consecutive runs in which
+#    they failed (a file read without failure is removed from the list). Once a file has failed in quarantineAfter runs it is
+#    quarantined, and with skipQuarantined the quarantined files are not read again (remove the file from the list to process it again)
+
+#chunks of each file which failed in this worker process
+_fileFailures = collections.Counter()
+
+
+#packages whose errors come from reading a file (corrupted or truncated baskets raise ValueError and the like inside uproot)
+_readPackages = ('uproot', 'uproot3', 'uproot4')
+
+
+def _raisedIn(exception, packages):
+    tb = exception.__traceback__
+    while not tb is None and not tb.tb_next is None:
+        tb = tb.tb_next
+    return not tb is None and tb.tb_frame.f_globals.get('__name__', '').split('.')[0] in packages
+
+
+#the read error behind an exception, or None for any other error
+#  coffea re-raises the errors of process() (where the branches are read lazily) as a generic Exception, so the chain is followed
+def readError(exception):
+    while not exception is None:
+        if isinstance(exception, (OSError, EOFError, uproot4.deserialization.DeserializationError, uproot4.KeyInFileError)):
+            return exception
+        if _raisedIn(exception, _readPackages):
+            return exception
+        exception = exception.__cause__ or (None if exception.__suppress_context__ else exception.__context__)
+    return None
+
+
+#first line of the error message, which is enough to tell the errors apart in the records and the quarantine list
+def errorMessage(exception):
+    message = str(exception).strip().split('\n')[0]
+    return f'{type(exception).__name__}: {message}'
+
+
+def _failedChunk(item, error, wholeFile=False):
+    record = (item.dataset, item.filename, 0 if wholeFile else item.entrystart, None if wholeFile else item.entrystop, error)
+    return dict_accumulator({'out': dict_accumulator({'failedChunks': set_accumulator({record})})})
+
+
+def _retry(function, item, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            return function(item), None
+        except Exception as e:
+            if readError(e) is None:
+                raise
+            error = errorMessage(readError(e))
+            if attempt < retries:
+                time.sleep(backoff*2**attempt)
+    return None, error
+
+
+#work function of a chunk, returning the record of the failure instead of raising
+def _isolatedChunk(function, retries, backoff, maxFileFailures, item):
+    if _fileFailures[item.filename] >= maxFileFailures:
+        return _failedChunk(item, f'skipped after {maxFileFailures} failed chunks of the file')
+    result, error = _retry(function, item, retries, backoff)
+    if error is None:
+        return result
+    _fileFailures[item.filename] += 1
+    return _failedChunk(item, error)
+
+
+#metadata of a file, a file which can not be read gets no entries (so no chunks), and its error in the metadata
+def _isolatedMetadata(function, retries, backoff, item):
+    result, error = _retry(function, item, retries, backoff)
+    if error is None:
+        return result
+    return set_accumulator({FileMeta(item.dataset, item.filename, item.treename, {'numentries': 0, 'uuid': bytes(16), 'error': error})})
+
+
+def readQuarantine(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+#executor wrapping another one (futures_executor, cluster_executor, ...), for both the executor and pre_executor of run_uproot_job
+#  retries:         attempts after the first one for a chunk or file (coffea's own retries should be left to 0)
+#  backoff:         seconds before the first retry, doubled for each of the next ones
+#  maxFileFailures: failed chunks of a file after which a worker skips the rest of the file
+#  quarantine:      path of the quarantine list
+#  quarantineAfter: consecutive runs with failures after which a file is quarantined
+#  skipQuarantined: do not read the quarantined files (by default they are read again, and recorded again if they still fail)
+class FaultTolerantExecutor:
+    def __init__(self, executor, retries=2, backoff=5., maxFileFailures=2, quarantine=None, quarantineAfter=2, skipQuarantined=False):
+        self.executor = executor
+        self.retries = retries
+        self.backoff = backoff
+        self.maxFileFailures = maxFileFailures
+        self.quarantine = quarantine
+        self.failures = readQuarantine(quarantine)
+        self.quarantined = {filename: entry for filename, entry in self.failures.items()
+                            if skipQuarantined and entry.get('failures', 1) >= quarantineAfter}
+        #files whose metadata could not be read in this job
+        self.badFiles = {}
+        #files read in this job
+        self.readFiles = set()
+
+    def __call__(self, items, function, accumulator, **kwargs):
+        if kwargs.get('function_name') == 'get_metadata':
+            return self._metadata(items, function, accumulator, **kwargs)
+
+        skipped = [item for item in items if item.filename in self.badFiles or item.filename in self.quarantined]
+        items = [item for item in items if not (item.filename in self.badFiles or item.filename in self.quarantined)]
+        self.readFiles.update(item.filename for item in items)
+        function = partial(_isolatedChunk, function, self.retries, self.backoff, self.maxFileFailures)
+        self.executor(items, function, accumulator, **kwargs)
+
+        for item in skipped:
+            error = 'quarantined' if item.filename in self.quarantined else self.badFiles[item.filename]
+            accumulator.add(_failedChunk(item, error, wholeFile=True))
+        return accumulator
+
+    def _metadata(self, items, function, accumulator, **kwargs):
+        #the quarantined files are not opened, they get no chunks
+        for item in items:
+            if item.filename in self.quarantined:
+                accumulator.add({FileMeta(item.dataset, item.filename, item.treename, {'numentries': 0, 'uuid': bytes(16)})})
+        items = [item for item in items if not item.filename in self.quarantined]
+        self.readFiles.update(item.filename for item in items)
+
+        function = partial(_isolatedMetadata, function, self.retries, self.backoff)
+        self.executor(items, function, accumulator, **kwargs)
+
+        for filemeta in accumulator:
+            if 'error' in filemeta.metadata:
+                self.badFiles[filemeta.filename] = filemeta.metadata['error']
+        return accumulator
+
+    #update the quarantine list with the files which had a failure in this job (the skipped quarantined files are kept as they are)
+    #  returns the number of failed chunks
+    def finish(self, output):
+        failed = {}
+        for dataset, filename, entrystart, entrystop, error in output['failedChunks']:
+            if error == 'quarantined':
+                continue
+            entry = failed.setdefault(filename, {'dataset': dataset, 'missing': [], 'errors': []})
+            if not [entrystart, entrystop] in entry['missing']:
+                entry['missing'].append([entrystart, entrystop])
+            if not error in entry['errors']:
+                entry['errors'].append(error)
+
+        for filename in self.readFiles:
+            if not filename in failed:
+                self.failures.pop(filename, None)
+        for filename, entry in failed.items():
+            entry['failures'] = self.failures.get(filename, {}).get('failures', 0) + 1
+            self.failures[filename] = entry
+
+        if not self.quarantine is None:
+            if len(self.failures) > 0:
+                with open(f'{self.quarantine}.tmp', 'w') as f:
+                    json.dump(self.failures, f, indent=1)
+                os.replace(f'{self.quarantine}.tmp', self.quarantine)
+            elif os.path.exists(self.quarantine):
+                os.remove(self.quarantine)
+        return len(output['failedChunks'])
+
+
+#missing entry ranges of each dataset, from output['failedChunks'] (entrystop None for a whole file)
+def missingEntries(failedChunks):
+    missing = collections.defaultdict(list)
+    for dataset, filename, entrystart, entrystop, error in sorted(failedChunks, key=lambda record: record[:3]):
+        missing[dataset].append((filename, entrystart, entrystop))
+    return dict(missing)
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import xxhash
+
+
+#size of a remote file, for root:// (through xrdfs), http(s):// and local paths (or file://), which stand in for the remote side in tests
+def remoteSize(url):
+    if url.startswith('root://'):
+        server, path = url[len('root://'):].split('/', 1)
+        stat = subprocess.run(['xrdfs', server, 'stat', '/' + path.lstrip('/')], check=True, capture_output=True, text=True).stdout
+        for line in stat.splitlines():
+            if line.strip().startswith('Size:'):
+                return int(line.split(':')[1])
+        raise IOError(f"Could not get the size of {url}")
+    if url.startswith('http://') or url.startswith('https://'):
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD')) as response:
+            return int(response.headers['Content-Length'])
+    return os.path.getsize(url[len('file://'):] if url.startswith('file://') else url)
+
+
+#copy a remote file to a local path
+def fetchFile(url, destination):
+    if url.startswith('root://'):
+        subprocess.run(['xrdcp', '--silent', '--force', url, destination], check=True)
+    elif url.startswith('http://') or url.startswith('https://'):
+        with urllib.request.urlopen(url) as response, open(destination, 'wb') as f:
+            shutil.copyfileobj(response, f, 1024**2)
+    else:
+        shutil.copyfile(url[len('file://'):] if url.startswith('file://') else url, destination)
+
+
+def fileChecksum(path):
+    h = xxhash.xxh64()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(16*1024**2), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+#open file holding a lock on path
+#  the lock files of an entry are removed when it is evicted, so a lock taken on a file which was removed meanwhile
+#  is dropped and taken again on the current file (with LOCK_NB, raises BlockingIOError if the lock is held)
+def _lock(path, mode=fcntl.LOCK_EX):
+    while True:
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, mode)
+        except BlockingIOError:
+            f.close()
+            raise
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+@contextmanager
+def _flock(path, mode=fcntl.LOCK_EX):
+    f = _lock(path, mode)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+#read-through cache of remote input files in a local directory, bounded to maxBytes with least-recently-used eviction
+#  every entry is a data file plus a json record of its url, size and xxhash checksum, written only once the copy is complete
+#  a copy is accepted if it has the size of the remote file and starts with the ROOT file signature, and cache hits are checked
+#  against the recorded size (and checksum, with verify='checksum'); failed checks drop the entry and fetch the file again
+#  workers in several processes can share a cache directory: each entry is fetched under its own file lock, and the
+#  bookkeeping (space accounting and eviction) is done under a lock on the whole directory. The space of a copy is reserved
+#  before it starts, so parallel copies can not overfill the cache
+#  an entry returned by get is pinned (a shared lock on its .pin file) until release is called, or the process exits:
+#  entries being fetched, verified or pinned by a running job are never evicted
+class FileCache:
+    def __init__(self, cacheDir, maxBytes=100*1024**3, verify='size', fetch=fetchFile, size=remoteSize, retries=2):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.maxBytes = maxBytes
+        self.verify = verify
+        self.fetch = fetch
+        self.size = size
+        self.retries = retries
+        self._pins = {}
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _entry(self, url):
+        name = f"{xxhash.xxh64(url.encode()).hexdigest()}_{os.path.basename(url)}"
+        return os.path.join(self.cacheDir, name)
+
+    def _record(self, path):
+        try:
+            with open(path + '.json') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _drop(self, path):
+        for p in [path + '.json', path]:
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _valid(self, path, url, verify):
+        record = self._record(path)
+        if record is None or record['url'] != url or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != record['size']:
+            return False
+        if verify == 'checksum' and fileChecksum(path) != record['checksum']:
+            return False
+        return True
+
+    def _pin(self, path):
+        if not path in self._pins:
+            self._pins[path] = _lock(path + '.pin', fcntl.LOCK_SH)
+
+    #unpin the entries returned by get, so they can be evicted again
+    def release(self):
+        for pin in self._pins.values():
+            fcntl.flock(pin, fcntl.LOCK_UN)
+            pin.close()
+        self._pins = {}
+
+    #drop an entry and its lock files, unless another worker is fetching or verifying it, or a job has it pinned
+    #  returns False if the entry is in use
+    def _evict(self, path):
+        try:
+            lock = _lock(path + '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        with lock:
+            try:
+                pin = _lock(path + '.pin', fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            with pin:
+                self._drop(path)
+                os.remove(path + '.pin')
+            os.remove(path + '.lock')
+        return True
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cacheDir, name[:-len('.json')])
+            record = self._record(path)
+            try:
+                if not record is None:
+                    entries.append((os.path.getmtime(path + '.json'), record['size'], path))
+            except FileNotFoundError:
+                #(dropped meanwhile)
+                pass
+        return sorted(entries)
+
+    #bytes reserved by the copies in progress, the reservations of copies whose worker is gone are dropped
+    def reservedBytes(self):
+        reserved = 0
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.reserved'):
+                continue
+            path = os.path.join(self.cacheDir, name[:-len('.reserved')])
+            try:
+                with _lock(path + '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    #(or the copy has finished meanwhile)
+                    if os.path.exists(path + '.reserved'):
+                        os.remove(path + '.reserved')
+                    continue
+            except BlockingIOError:
+                pass
+            try:
+                with open(path + '.reserved') as f:
+                    reserved += int(f.read())
+            except (IOError, ValueError):
+                pass
+        return reserved
+
+    def usedBytes(self):
+        return sum(size for _, size, _ in self.entries()) + self.reservedBytes()
+
+    #remove least recently used entries until nbytes more fit in the cache, skipping the entries that are in use
+    #  returns False if that much space cannot be freed
+    def _makeRoom(self, nbytes):
+        entries = self.entries()
+        used = sum(size for _, size, _ in entries) + self.reservedBytes()
+        for _, size, path in entries:
+            if used + nbytes <= self.maxBytes:
+                break
+            if self._evict(path):
+                used -= size
+        return used + nbytes <= self.maxBytes
+
+    #local path of a remote file, fetched into the cache on first access, and pinned until release is called
+    #  returns None if the file does not fit in the space which can be freed in the cache
+    def get(self, url):
+        path = self._entry(url)
+
+        with _flock(path + '.lock'):
+            if self._valid(path, url, self.verify):
+                os.utime(path + '.json')
+                self._pin(path)
+                return path
+            #(under the directory lock, as the other workers list the entries under it)
+            with _flock(os.path.join(self.cacheDir, '.lock')):
+                self._drop(path)
+
+            nbytes = self.size(url)
+            with _flock(os.path.join(self.cacheDir, '.lock')):
+                if not self._makeRoom(nbytes):
+                    return None
+                with open(path + '.reserved', 'w') as f:
+                    f.write(str(nbytes))
+
+            try:
+                for attempt in range(self.retries + 1):
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    try:
+                        self.fetch(url, tmp)
+                        with open(tmp, 'rb') as f:
+                            signature = f.read(4)
+                        if os.path.getsize(tmp) != nbytes or signature != b'root':
+                            raise IOError(f"Incomplete or corrupted copy of {url}")
+                        record = {'url': url, 'size': nbytes, 'checksum': fileChecksum(tmp), 'fetched': time.time()}
+                        os.replace(tmp, path)
+                        with open(path + '.json.tmp', 'w') as f:
+                            json.dump(record, f)
+                        os.replace(path + '.json.tmp', path + '.json')
+                        break
+                    except (IOError, OSError, subprocess.CalledProcessError):
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+                        if attempt == self.retries:
+                            raise
+            finally:
+                #the entry now counts in the used bytes (or the copy failed)
+                with _flock(os.path.join(self.cacheDir, '.lock')):
+                    os.remove(path + '.reserved')
+
+            self._pin(path)
+
+        return path
+
+
+#rewrite the files of a fileset to their local copies in a cache, fetching the missing ones with `workers` parallel copies
+#  the local copies stay pinned in the cache (never evicted) until cache.release() is called, once the job reading them is done
+#  files which do not fit in the cache keep their remote url
+def cacheFileset(fileset, cache, workers=4):
+    urls = sorted(set(url for files in fileset.values() for url in files))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        localPaths = dict(zip(urls, pool.map(cache.get, urls)))
+
+    nRemote = sum(path is None for path in localPaths.values())
+    if nRemote > 0:
+        print(f"{nRemote} of {len(urls)} files do not fit in the cache at {cache.cacheDir}, reading them remotely")
+
+    return {dataset: [localPaths[url] or url for url in files] for dataset, files in fileset.items()}
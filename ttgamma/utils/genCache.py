@@ -0,0 +1,218 @@
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import uproot
+import uproot4
+from awkward import JaggedArray
+from coffea.analysis_objects import JaggedCandidateArray
+from coffea.processor import LazyDataFrame
+
+from .genParentage import maxHistoryPDGID, objectMaxHistoryPDGID
+from .genJetMatching import matchGenJets
+
+#generator level columns derived for every event of an MC file, which do not change between runs of the processor
+#  passOverlapRemoval:   event is not in the phase space of the separate photon sample (TTGamma, WGamma, ZGamma)
+#  Photon_genMatchedPho: photon is matched to a generated photon
+#  Photon_genMatchedEle: photon is matched to a generated electron
+#  Photon_genMaxParent:  highest PDG ID in the history of the matched gen particle
+#  Jet_genJetIdx:        index of the matched gen jet, -1 if the gen jet was removed by the skim
+#  Jet_ptGenJet:         pt of the matched gen jet, 0 for unmatched jets
+#  the columns are computed once per file and stored in a friend tree aligned by entry with the Events tree,
+#  so the processor can read them instead of the GenPart_* and GenJet_* branches
+#  (flags are stored as int16, since the uproot writer does not support booleans or int8)
+genBranches = {'event'                : np.int64,
+               'passOverlapRemoval'   : np.int16,
+               'Photon_genMatchedPho' : uproot.newbranch(np.dtype('i2'), size='nPhoton'),
+               'Photon_genMatchedEle' : uproot.newbranch(np.dtype('i2'), size='nPhoton'),
+               'Photon_genMaxParent'  : uproot.newbranch(np.dtype('i4'), size='nPhoton'),
+               'Jet_genJetIdx'        : uproot.newbranch(np.dtype('i4'), size='nJet'),
+               'Jet_ptGenJet'         : uproot.newbranch(np.dtype('f4'), size='nJet'),
+              }
+photonGenColumns = {'Photon_genMatchedPho' : bool, 'Photon_genMatchedEle' : bool, 'Photon_genMaxParent' : np.int32}
+jetGenColumns = {'Jet_genJetIdx' : np.int32, 'Jet_ptGenJet' : np.float32}
+
+
+# Overlap removal between related samples
+# TTGamma and TTbar
+# WGamma and WJets
+# ZGamma and ZJets
+# We need to remove events from TTbar which are already counted in the phase space in which the TTGamma sample is produced
+# photon with pT> 10 GeV, eta<5, and at least dR>0.1 from other gen objects
+#  returns the (pt, eta, dR) thresholds of the overlap photons, or None for samples without overlap removal
+def overlapParameters(dataset):
+    if 'TTbar' in dataset:
+        return 10., 5., 0.1
+    if re.search("^W[1234]jets$", dataset):
+        return 10., 2.5, 0.05
+    if 'DYjetsM' in dataset:
+        return 15., 2.6, 0.05
+    return None
+
+
+def passOverlapRemoval(genPart, overlapPt, overlapEta, overlapDR):
+    genmotherIdx = genPart.motherIdx
+    genpdgid = genPart.pdgid
+
+    overlapPhoSelect = ((genPart.pt>=overlapPt) &
+                        (abs(genPart.eta) < overlapEta) &
+                        (genPart.pdgid==22) &
+                        (genPart.status==1)
+                       )
+    #potential overlap photons are only those passing the kinematic cuts
+    OverlapPhotons = genPart[overlapPhoSelect]
+
+    #if the overlap photon is actually from a non prompt decay, it's not part of the phase space of the separate sample
+    idx = OverlapPhotons.motherIdx
+    maxParent = maxHistoryPDGID(idx.content, idx.starts, idx.stops,
+                                genpdgid.content, genpdgid.starts, genpdgid.stops,
+                                genmotherIdx.content, genmotherIdx.starts, genmotherIdx.stops)
+
+    finalGen = genPart[((genPart.status==1)|(genPart.status==71)) & ~((abs(genPart.pdgid)==12) | (abs(genPart.pdgid)==14) | (abs(genPart.pdgid)==16))]
+    genPairs = OverlapPhotons['p4'].cross(finalGen['p4'],nested=True)
+    ##remove the case where the cross produce is the gen photon with itself
+    genPairs = genPairs[~(genPairs.i0==genPairs.i1)]
+    #find closest gen particle to overlap photons
+    dRPairs = genPairs.i0.delta_r(genPairs.i1)
+
+    #the event is overlapping with the separate sample if there is an overlap photon passing the dR cut and not coming from hadronic activity
+    isOverlap = ((dRPairs.min()>overlapDR) & (maxParent<37)).any()
+    return ~isOverlap
+
+
+#compute the derived generator level columns of a chunk from the GenPart_* and GenJet_* branches
+#  photonGenIdx and jetGenJetIdx are the jagged Photon_genPartIdx and Jet_genJetIdx of the chunk
+def computeGenColumns(df, dataset, photonGenIdx, jetGenJetIdx):
+    columns = {}
+
+    #load gen parton objects
+    genPart = JaggedCandidateArray.candidatesfromcounts(
+        df['nGenPart'],
+        pt=df['GenPart_pt'],
+        eta=df['GenPart_eta'],
+        phi=df['GenPart_phi'],
+        mass=df['GenPart_mass'],
+        pdgid=df['GenPart_pdgId'],
+        motherIdx=df['GenPart_genPartIdxMother'],
+        status=df['GenPart_status'],
+        statusFlags=df['GenPart_statusFlags'],
+    )
+    genmotherIdx = genPart.motherIdx
+    genpdgid = genPart.pdgid
+
+    overlap = overlapParameters(dataset)
+    if overlap is None:
+        columns['passOverlapRemoval'] = np.ones(df.size, dtype=bool)
+    else:
+        columns['passOverlapRemoval'] = passOverlapRemoval(genPart, *overlap)
+
+    #gen particle matched to each photon
+    matchedPdgid = genpdgid[photonGenIdx]
+    columns['Photon_genMatchedPho'] = matchedPdgid==22
+    columns['Photon_genMatchedEle'] = abs(matchedPdgid)==11
+    columns['Photon_genMaxParent'] = photonGenIdx.copy(content=objectMaxHistoryPDGID(photonGenIdx.content, photonGenIdx.starts, photonGenIdx.stops,
+                                                                                     genpdgid.content, genpdgid.starts, genpdgid.stops,
+                                                                                     genmotherIdx.content, genmotherIdx.starts, genmotherIdx.stops))
+
+    #gen jet matched to each jet
+    #  indices of gen jets removed by the skim (skimmed after genJet matching) are set to -1
+    genJetIdx, matched = matchGenJets(jetGenJetIdx, {'pt': JaggedArray.fromcounts(df['nGenJet'], df['GenJet_pt'])})
+    columns['Jet_genJetIdx'] = genJetIdx
+    columns['Jet_ptGenJet'] = matched['pt']
+
+    return columns
+
+
+def genCachePath(cacheDir, dataset, fileuuid):
+    return os.path.join(cacheDir, dataset, f'{fileuuid}.root')
+
+
+#read the derived generator level columns of a chunk from the gen cache, returns None if the file has no (valid) cache
+#  photonCounts and jetCounts are the number of photons and jets in each event, to rebuild the jagged columns
+def readGenCache(cacheDir, df, dataset, photonCounts, jetCounts):
+    if not 'fileuuid' in df:
+        return None
+    path = genCachePath(cacheDir, dataset, df['fileuuid'])
+    if not os.path.exists(path):
+        return None
+
+    with uproot4.open(path) as file:
+        tree = file['Events']
+        if tree.num_entries < df['entrystop']:
+            return None
+        cache = LazyDataFrame(tree, df['entrystart'], df['entrystop'], flatten=True)
+
+        #the cache must be aligned entry by entry with the events of the chunk
+        if not np.array_equal(cache['event'], df['event']):
+            return None
+
+        columns = {'passOverlapRemoval': np.asarray(cache['passOverlapRemoval'], dtype=bool)}
+        for name, dtype in photonGenColumns.items():
+            columns[name] = JaggedArray.fromcounts(photonCounts, np.asarray(cache[name], dtype=dtype))
+        for name, dtype in jetGenColumns.items():
+            columns[name] = JaggedArray.fromcounts(jetCounts, np.asarray(cache[name], dtype=dtype))
+    return columns
+
+
+#compute the derived generator level columns of every event of an MC file, and write them to the gen cache
+def buildGenCache(fileName, cacheDir, dataset, treename='Events', chunksize=100000):
+    shortName = dataset.replace('_2016','')
+    with uproot4.open(fileName) as file:
+        tree = file[treename]
+        path = genCachePath(cacheDir, dataset, file.file.uuid)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        #written under a temporary name, so an interrupted job does not leave an incomplete cache behind
+        with uproot.recreate(f'{path}.tmp', compression=uproot.ZLIB(4)) as out:
+            out['Events'] = uproot.newtree(genBranches)
+            for start in range(0, tree.num_entries, chunksize):
+                df = LazyDataFrame(tree, start, start + chunksize, flatten=True)
+                photonGenIdx = JaggedArray.fromcounts(df['nPhoton'], df['Photon_genPartIdx'])
+                jetGenJetIdx = JaggedArray.fromcounts(df['nJet'], df['Jet_genJetIdx'])
+                columns = computeGenColumns(df, shortName, photonGenIdx, jetGenJetIdx)
+
+                branches = {'event' : np.asarray(df['event'], dtype=np.int64),
+                            'nPhoton' : photonGenIdx.counts.astype(np.int32),
+                            'nJet' : jetGenJetIdx.counts.astype(np.int32),
+                           }
+                for name, column in columns.items():
+                    if name in photonGenColumns or name in jetGenColumns:
+                        branches[name] = column.copy(content=column.content.astype(genBranches[name].type))
+                    else:
+                        branches[name] = column.astype(genBranches[name])
+                out['Events'].extend(branches)
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def _buildGenCache(args):
+    fileName, cacheDir, dataset, treename, chunksize = args
+    return buildGenCache(fileName, cacheDir, dataset, treename, chunksize)
+
+
+#build the gen cache of every MC file of a fileset, files which already have a cache are skipped
+def buildFilesetGenCache(fileset, cacheDir, treename='Events', chunksize=100000, workers=4):
+    jobs = [(fileName, cacheDir, dataset, treename, chunksize)
+            for dataset, files in fileset.items() if not 'Data' in dataset
+            for fileName in files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path in executor.map(_buildGenCache, jobs):
+            print(path)
+
+
+if __name__ == '__main__':
+    from .fileSet_2016_LZ4 import fileSet_2016
+
+    parser = argparse.ArgumentParser(description='Build the friend trees of derived generator level columns for the MC samples')
+    parser.add_argument('cacheDir', help='directory of the gen cache')
+    parser.add_argument('--datasets', nargs='*', default=None, help='datasets to process (default: all MC datasets)')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    fileset = {k: v for k, v in fileSet_2016.items() if args.datasets is None or k in args.datasets}
+    buildFilesetGenCache(fileset, args.cacheDir, chunksize=args.chunksize, workers=args.workers)
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+from awkward import JaggedArray
+from coffea.analysis_objects import JaggedCandidateArray
+from numba import prange
+
+from .jit import kernel
+
+
+#function to validate the gen jet index of every jet, and find the position of the matched gen jet in the gen jet columns
+#  indices outside of the gen jets of the event (the gen jets are skimmed after the matching) are set to -1
+@kernel('void(int32[::1], int64[::1], int64[::1], int64[::1], int64[::1], int32[::1], int64[::1])', parallel=True)
+def genJetPositions(idx_contents, idx_starts, idx_stops, genJet_starts, genJet_stops, genJetIdx_out, position_out):
+    for i in prange(len(idx_starts)):
+        nGenJet = genJet_stops[i] - genJet_starts[i]
+        for j in range(idx_starts[i], idx_stops[i]):
+            idx = idx_contents[j]
+            if idx < 0 or idx >= nGenJet:
+                genJetIdx_out[j] = -1
+                position_out[j] = -1
+            else:
+                genJetIdx_out[j] = idx
+                position_out[j] = genJet_starts[i] + idx
+
+
+#function to gather a gen jet column for every jet, with fill for the jets without a matched gen jet
+@kernel('void(int64[::1], float32[::1], float64, float32[::1])',
+        'void(int64[::1], float64[::1], float64, float64[::1])', parallel=True)
+def gatherGenJet(position, column, fill, out):
+    for j in prange(len(position)):
+        if position[j] < 0:
+            out[j] = fill
+        else:
+            out[j] = column[position[j]]
+
+
+#match jets to gen jets, from the jagged Jet_genJetIdx
+#  genJets is a dict of the jagged gen jet columns to gather (ex: {'pt': GenJet_pt, 'eta': GenJet_eta}), all with the same counts
+#  returns the validated gen jet index of the jets, and a dict of the gathered columns (fill for unmatched jets)
+def matchGenJets(genJetIdx, genJets, fill=0.):
+    reference = next(iter(genJets.values()))
+
+    idx = genJetIdx.content
+    genJetIdxOut = np.empty(len(idx), dtype=np.int32)
+    position = np.empty(len(idx), dtype=np.int64)
+    genJetPositions(idx, genJetIdx.starts, genJetIdx.stops, reference.starts, reference.stops, genJetIdxOut, position)
+
+    matched = {}
+    for name, column in genJets.items():
+        out = np.empty(len(idx), dtype=column.content.dtype)
+        gatherGenJet(position, column.content, fill, out)
+        matched[name] = genJetIdx.copy(content=out)
+    return genJetIdx.copy(content=genJetIdxOut), matched
+
+
+#micro-benchmark of the matching kernel against the jagged array expression used before, on random events
+def benchmarkGenJetMatching(nEvents=200000, repeat=5, seed=0):
+    random = np.random.RandomState(seed)
+    nJet = random.poisson(6, nEvents)
+    nGenJet = random.poisson(5, nEvents)
+    #indices of -1 and indices of skimmed gen jets, as in the skims
+    jetGenJetIdx = JaggedArray.fromcounts(nJet, np.concatenate([random.randint(-1, n + 2, size=m) for n, m in zip(nGenJet, nJet)]).astype(np.int32))
+    genJetPt = JaggedArray.fromcounts(nGenJet, random.exponential(40., nGenJet.sum()).astype(np.float32))
+
+    def jagged():
+        genJet = JaggedCandidateArray.candidatesfromcounts(
+            nGenJet,
+            pt = genJetPt.content,
+            eta = np.zeros_like(genJetPt.content),
+            phi = np.zeros_like(genJetPt.content),
+            mass = np.zeros_like(genJetPt.content),
+        )
+        genJetIdx = jetGenJetIdx.copy(content=jetGenJetIdx.content.copy())
+        genJetIdx[genJetIdx>=genJet.counts] = -1
+        ptGenJet = genJetIdx.copy(content=np.zeros(len(genJetIdx.content), dtype=np.float32))
+        ptGenJet[genJetIdx>-1] = genJet[genJetIdx[genJetIdx>-1]].pt
+        return genJetIdx, ptGenJet
+
+    def kernel():
+        genJetIdx, matched = matchGenJets(jetGenJetIdx, {'pt': genJetPt})
+        return genJetIdx, matched['pt']
+
+    #compile, and check that both give the same matching
+    idxJagged, ptJagged = jagged()
+    idxKernel, ptKernel = kernel()
+    if not (np.array_equal(idxJagged.content, idxKernel.content) and np.array_equal(ptJagged.content, ptKernel.content)):
+        raise Exception('gen jet matching kernel and jagged expression disagree')
+
+    timing = {}
+    for name, function in [('jagged', jagged), ('kernel', kernel)]:
+        tic = time.time()
+        for _ in range(repeat):
+            function()
+        timing[name] = (time.time() - tic)/repeat
+        print(f"{name:8s} {1000*timing[name]:8.1f} ms  ({nJet.sum()/timing[name]/1e6:.1f} M jets/s)")
+    return timing
+
+
+if __name__ == '__main__':
+    benchmarkGenJetMatching()
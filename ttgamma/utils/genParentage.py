@@ -1,11 +1,13 @@
-import numba
 import numpy as np
+from numba import prange
+
+from .jit import kernel
 
 #function to find the highest PID for particles
-@numba.jit(nopython=True)
+@kernel('int64[::1](int32[::1], int64[::1], int64[::1], int32[::1], int64[::1], int64[::1], int32[::1], int64[::1], int64[::1])', parallel=True)
 def maxHistoryPDGID(idxList_contents, idxList_starts, idxList_stops, pdgID_contents, pdgID_starts, pdgID_stops, motherIdx_contents, motherIdx_starts, motherIdx_stops):
     maxPDGID_array = np.ones(len(idxList_starts),np.int32)*-1
-    for i in range(len(idxList_starts)):
+    for i in prange(len(idxList_starts)):
         if idxList_starts[i]==idxList_stops[i]:
             continue
             
@@ -23,3 +25,22 @@ def maxHistoryPDGID(idxList_contents, idxList_starts, idxList_stops, pdgID_conte
     return maxPDGID_array
 
 
+
+#function to find the highest PID in the history of the gen particle matched to each object (-1 for objects without a match)
+#  returns one value per entry of idxList_contents, unlike maxHistoryPDGID which only follows the first object of each event
+@kernel('int64[::1](int32[::1], int64[::1], int64[::1], int32[::1], int64[::1], int64[::1], int32[::1], int64[::1], int64[::1])', parallel=True)
+def objectMaxHistoryPDGID(idxList_contents, idxList_starts, idxList_stops, pdgID_contents, pdgID_starts, pdgID_stops, motherIdx_contents, motherIdx_starts, motherIdx_stops):
+    maxPDGID_array = np.ones(len(idxList_contents),np.int32)*-1
+    for i in prange(len(idxList_starts)):
+        pdgID = pdgID_contents[pdgID_starts[i]:pdgID_stops[i]]
+        motherIdx = motherIdx_contents[motherIdx_starts[i]:motherIdx_stops[i]]
+
+        for j in range(idxList_starts[i], idxList_stops[i]):
+            idx = idxList_contents[j]
+            maxPDGID = -1
+            while idx>-1:
+                pdg = pdgID[idx]
+                maxPDGID = max(maxPDGID, abs(pdg))
+                idx = motherIdx[idx]
+            maxPDGID_array[j] = maxPDGID
+    return maxPDGID_array
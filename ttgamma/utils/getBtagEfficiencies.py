@@ -6,25 +6,107 @@ from coffea.lookup_tools import extractor, dense_lookup
 
 import numpy as np
 import pickle
+import sys
 
 btagEff_ptBins = np.array([30,50,70,100,140,200,500])
 
 btagEff_etaBins = np.arange(0,2.4001,.6)
 
+#2016 DeepCSV medium working point
+btagEff_WP = 0.6321
+
+
+#histograms of all selected jets and b-tagged jets, binned in pt, |eta| and hadron flavour
+def btagEfficiencyHists():
+    dataset_axis = hist.Cat("dataset", "Dataset")
+    jetPt_axis = hist.Bin('jetPt','jetPt',btagEff_ptBins)
+    jetEta_axis = hist.Bin('jetEta','jetEta',btagEff_etaBins)
+    jetFlav_axis = hist.Bin('jetFlav','jetFlav',[0,4,5,6])
+
+    return {'hJets'  : hist.Hist("Counts", dataset_axis, jetPt_axis, jetEta_axis, jetFlav_axis),
+            'hBJets' : hist.Hist("Counts", dataset_axis, jetPt_axis, jetEta_axis, jetFlav_axis),
+           }
+
+
+#fill the hJets and hBJets histograms of output from a JaggedCandidateArray of jets (with jetId, btag and hadFlav columns)
+def fillBtagEfficiencyHists(output, dataset, jets, bTagWP=btagEff_WP):
+    jetSelect = ((jets.pt > 30) &
+                 (abs(jets.eta) < 2.4) &
+                 ((jets.jetId >> 0 & 1)==1))
+
+    Jets = jets[jetSelect]
+    bJets = jets[jetSelect & (jets.btag>bTagWP)]
+    output['hJets'].fill(dataset=dataset,
+                         jetPt=Jets.pt.flatten(),
+                         jetEta=abs(Jets.eta).flatten(),
+                         jetFlav=Jets.hadFlav.flatten(),
+                        )
+
+    output['hBJets'].fill(dataset=dataset,
+                          jetPt=bJets.pt.flatten(),
+                          jetEta=abs(bJets.eta).flatten(),
+                          jetFlav=bJets.hadFlav.flatten(),
+                         )
+
+
+#derive the dense lookup of tagging efficiencies, indexed by (dataset, flavour, pt, eta), from the hJets and hBJets histograms
+def taggingEfficiencyLookup(hJets, hBJets):
+    l_total = hJets.integrate('jetFlav',slice(0,4)).values()
+    c_total = hJets.integrate('jetFlav',slice(4,5)).values()
+    b_total = hJets.integrate('jetFlav',slice(5,6)).values()
+
+    l_tagged = hBJets.integrate('jetFlav',slice(0,4)).values()
+    c_tagged = hBJets.integrate('jetFlav',slice(4,5)).values()
+    b_tagged = hBJets.integrate('jetFlav',slice(5,6)).values()
+
+    for k in l_total.keys():
+        l_total[k] = np.maximum(1,l_total[k])
+        c_total[k] = np.maximum(1,c_total[k])
+        b_total[k] = np.maximum(1,b_total[k])
+
+    #dense_lookup finds the sample with a searchsorted, so the samples must be sorted
+    btagEff = []
+    samples = []
+    for k in sorted(l_total.keys()):
+        btagEff.append(np.array([l_tagged.get(k, 0*l_total[k])/l_total[k],
+                                 c_tagged.get(k, 0*c_total[k])/c_total[k],
+                                 b_tagged.get(k, 0*b_total[k])/b_total[k]]))
+        samples.append(k[0])
+
+    return dense_lookup.dense_lookup(np.array(btagEff),(samples,[0,4,5],btagEff_ptBins,btagEff_etaBins))
+
+
+def saveTaggingEfficiencyLookup(lookup, fileName='taggingEfficienciesDenseLookup.pkl'):
+    with open(fileName,'wb') as _file:
+        pickle.dump(lookup,_file)
+
+
+#merge the lookups written for separate groups of samples (ex: the taggingEfficienciesDenseLookup_<mcType>.pkl of runFullDataset.py btagEff)
+#  into a single lookup, such as utils/taggingEfficienciesDenseLookup.pkl loaded by the processor
+#  a sample found in several files takes the values of the last one, so the current lookup can be given first to keep its other samples
+def mergeTaggingEfficiencyLookups(fileNames, fileName=None):
+    efficiencies = {}
+    for inputName in fileNames:
+        with open(inputName,'rb') as _file:
+            lookup = pickle.load(_file)
+        samples, flavours, ptBins, etaBins = lookup._axes
+        if not (list(flavours)==[0,4,5] and np.array_equal(ptBins,btagEff_ptBins) and np.allclose(etaBins,btagEff_etaBins)):
+            raise Exception(f'{inputName} does not have the binning of the b-tagging efficiencies')
+        for i, sample in enumerate(samples):
+            efficiencies[sample] = lookup._values[i]
+
+    samples = sorted(efficiencies)
+    lookup = dense_lookup.dense_lookup(np.array([efficiencies[sample] for sample in samples]),(samples,[0,4,5],btagEff_ptBins,btagEff_etaBins))
+    if not fileName is None:
+        saveTaggingEfficiencyLookup(lookup, fileName)
+    return lookup
+
+
 # Look at ProcessorABC to see the expected methods and what they are supposed to do
 class BjetEfficiencies(processor.ProcessorABC):
 #     def __init__(self, runNum = -1, eventNum = -1):
     def __init__(self):
-        dataset_axis = hist.Cat("dataset", "Dataset")
-        dataset_axis = hist.Cat("dataset", "Dataset")
-        jetPt_axis = hist.Bin('jetPt','jetPt',btagEff_ptBins)
-        jetEta_axis = hist.Bin('jetEta','jetEta',btagEff_etaBins)
-        jetFlav_axis = hist.Bin('jetFlav','jetFlav',[0,4,5,6])
-        self._accumulator = processor.dict_accumulator({
-
-            'hJets'  : hist.Hist("Counts", dataset_axis, jetPt_axis, jetEta_axis, jetFlav_axis),
-            'hBJets' : hist.Hist("Counts", dataset_axis, jetPt_axis, jetEta_axis, jetFlav_axis),
-        })
+        self._accumulator = processor.dict_accumulator(btagEfficiencyHists())
 
     @property
     def accumulator(self):
@@ -60,29 +142,13 @@ class BjetEfficiencies(processor.ProcessorABC):
             genIdx=df['Jet_genJetIdx'],
         )
         
-        jetSelect = ((jets.pt > 30) &
-                     (abs(jets.eta) < 2.4) &
-                     ((jets.jetId >> 0 & 1)==1))
-        
-        bTagWP = 0.6321
+        bTagWP = btagEff_WP
         if year == '2017':
             bTagWP = 0.4941
         if year == '2018':
             bTagWP = 0.4184
 
-        Jets = jets[jetSelect]
-        bJets = jets[jetSelect & (jets.btag>bTagWP)]
-        output['hJets'].fill(dataset=datasetFull,
-                             jetPt=Jets.pt.flatten(),
-                             jetEta=abs(Jets.eta).flatten(),
-                             jetFlav=Jets.hadFlav.flatten(),
-                            )
-        
-        output['hBJets'].fill(dataset=datasetFull,
-                              jetPt=bJets.pt.flatten(),
-                              jetEta=abs(bJets.eta).flatten(),
-                              jetFlav=bJets.hadFlav.flatten(),
-                             )
+        fillBtagEfficiencyHists(output, datasetFull, jets, bTagWP)
 
         return output
 
@@ -91,50 +157,28 @@ class BjetEfficiencies(processor.ProcessorABC):
 
 
 
-from fileList import *
-fileSet_noData = {x:fileSet_2016[x] for x in fileSet_2016 if not 'Data' in x}
-
-f = {'QCD_Pt20to30_Ele_2016': fileSet_2016['QCD_Pt20to30_Ele_2016'],
-     #'QCD_Pt300toInf_Ele_2016': fileSet_2016['QCD_Pt300toInf_Ele_2016'],
- }
-
-output = processor.run_uproot_job(fileSet_noData,
-                                  treename='Events',
-                                  processor_instance=BjetEfficiencies(),
-                                  executor=processor.futures_executor,
-                                  executor_args={'workers': 4, 'flatten': True},
-#                                   chunksize=50000,                                                                                          
-#                                   maxchunks=0                                                                                              
-                                 )
-
-
-
-l_total = output['hJets'].integrate('jetFlav',slice(0,4)).values()
-c_total = output['hJets'].integrate('jetFlav',slice(4,5)).values()
-b_total = output['hJets'].integrate('jetFlav',slice(5,6)).values()
-
-l_tagged = output['hBJets'].integrate('jetFlav',slice(0,4)).values()
-c_tagged = output['hBJets'].integrate('jetFlav',slice(4,5)).values()
-b_tagged = output['hBJets'].integrate('jetFlav',slice(5,6)).values()
-
-for k in l_total.keys():
-    l_total[k] = np.maximum(1,l_total[k])
-    c_total[k] = np.maximum(1,c_total[k])
-    b_total[k] = np.maximum(1,b_total[k])
-
-    if 0 in l_total[k]: print (k, 'light', l_total[k])
-    if 0 in l_total[k]: print (k, 'charm', c_total[k])
-    if 0 in l_total[k]: print (k, 'b', b_total[k])
-
-btagEff = []
-samples = []
-for k in l_total.keys():
-    btagEff.append(np.array([l_tagged[k]/l_total[k],c_tagged[k]/c_total[k],b_tagged[k]/b_total[k]]))
-    samples.append(k[0])
+# Merge the lookups of the sample groups into the lookup loaded by the processor:
+#   python -m ttgamma.utils.getBtagEfficiencies merge ttgamma/utils/taggingEfficienciesDenseLookup.pkl taggingEfficienciesDenseLookup_MC*.pkl
+#   (give ttgamma/utils/taggingEfficienciesDenseLookup.pkl first among the inputs as well to keep the samples which were not measured again)
+if __name__ == '__main__' and sys.argv[1:2] == ['merge']:
+    lookup = mergeTaggingEfficiencyLookups(sys.argv[3:], sys.argv[2])
+    print(f"{len(lookup._axes[0])} samples written to {sys.argv[2]}")
 
+# Standalone pass over all MC samples
+#   the same histograms can be filled during the main analysis pass with TTGammaProcessor(measureBtagEff=True), avoiding this extra pass
+elif __name__ == '__main__':
+    from fileList import *
+    fileSet_noData = {x:fileSet_2016[x] for x in fileSet_2016 if not 'Data' in x}
 
-taggingEffLookup = dense_lookup.dense_lookup(np.array(btagEff),(samples,[0,4,5],btagEff_ptBins,btagEff_etaBins))
+    output = processor.run_uproot_job(fileSet_noData,
+                                      treename='Events',
+                                      processor_instance=BjetEfficiencies(),
+                                      executor=processor.futures_executor,
+                                      executor_args={'workers': 4, 'flatten': True},
+    #                                   chunksize=50000,
+    #                                   maxchunks=0
+                                     )
 
+    taggingEffLookup = taggingEfficiencyLookup(output['hJets'], output['hBJets'])
 
-with open('taggingEfficienciesDenseLookup.pkl','wb') as _file:
-    pickle.dump(taggingEffLookup,_file)
+    saveTaggingEfficiencyLookup(taggingEffLookup, 'taggingEfficienciesDenseLookup.pkl')
@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+#modules which must not be imported as a side effect of importing ttgamma.utils (they load the corrections)
+heavyModules = ['ttgamma.processor']
+
+#modules imported by the analysis notebooks, timed together by default (ttgamma.utils itself is an empty package)
+notebookModules = ['ttgamma', 'ttgamma.utils.plotting', 'ttgamma.utils.likelihood', 'ttgamma.utils.toys']
+
+_measure = '''
+import sys, time
+tic = time.perf_counter()
+import {module}
+print(time.perf_counter() - tic, *[name in sys.modules for name in {heavyModules!r}])
+'''
+
+
+#time to import a module (or a list of modules) in a fresh python process, and whether it imported any of the heavy modules
+def importTime(module=notebookModules):
+    if not isinstance(module, str):
+        module = ', '.join(module)
+    code = _measure.format(module=module, heavyModules=heavyModules)
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout.split()
+    return float(output[0]), [name for name, imported in zip(heavyModules, output[1:]) if imported == 'True']
+
+
+#regression check of the import time of a module against a budget in seconds, using the fastest of a few imports
+#  (the first one also pays for reading and compiling the files), raises an exception if the budget is exceeded
+def checkImportTime(module=notebookModules, budget=1., repeat=3):
+    if not isinstance(module, str):
+        module = ', '.join(module)
+    times = []
+    for _ in range(repeat):
+        elapsed, imported = importTime(module)
+        if imported:
+            raise Exception(f'import {module} also imported {imported}')
+        times.append(elapsed)
+    if min(times) > budget:
+        raise Exception(f'import {module} took {min(times):.3f} s, over the budget of {budget:.3f} s')
+    print(f'import {module}: {min(times):.3f} s (budget {budget:.3f} s)')
+    return min(times)
+
+
+if __name__ == '__main__':
+    #python -m ttgamma.utils.importTime [module[,module...]] [budget]
+    checkImportTime(*[modules.split(',') for modules in sys.argv[1:2]], *[float(budget) for budget in sys.argv[2:3]])
@@ -0,0 +1,124 @@
+import zlib
+
+import numpy as np
+from awkward import Table
+from uproot_methods import TLorentzVectorArray
+
+#jet variations of each jet systematic, and the columns added to the jets for it
+jetVariations = {'nominal' : [],
+                 'JERUp'   : ['jer_up'],
+                 'JERDown' : ['jer_down'],
+                 'JESUp'   : ['jes_up'],
+                 'JESDown' : ['jes_down'],
+                }
+
+_signatureMap = {'JetPt': 'pt', 'JetEta': 'eta', 'Rho': 'rho', 'JetA': 'area'}
+
+
+def _arguments(function, jet):
+    return {key: getattr(jet, _signatureMap[key]).content for key in function.signature}
+
+
+def _updatePtMass(jet, pt, mass):
+    jet._content._contents['__fast_pt'] = pt
+    jet._content._contents['__fast_mass'] = mass
+
+
+#jets passing mask, with the columns copied into a new table (not a view of the full collection), so they can be updated in place
+def _select(jets, mask):
+    selected = mask.flatten()
+    content = Table()
+    for name in jets.content.columns:
+        content[name] = jets.content[name][selected]
+    return jets.__class__.fromcounts(mask.sum(), content)
+
+
+#seed of the JER smearing of one chunk, from the seed of the job and the file and first entry of the chunk
+#  so the smearing is reproducible, and independent between chunks
+def chunkSeed(seed, df):
+    fileName = df['fileuuid'] if 'fileuuid' in df else df['filename']
+    return zlib.crc32(f"{seed}_{fileName}_{df['entrystart']}".encode())
+
+
+#jet energy corrections and resolution smearing, like coffea's JetTransformer, but computing only what a jet systematic needs
+#  transform(jets, syst, mask, seed) corrects only the jets passing mask (a preselection on quantities which the corrections
+#  do not change, like eta and the jet ID), and returns those jets, with pt, mass and p4 updated to the nominal corrected values
+#  the pt and mass of the variation of syst are added as columns (pt_jer_up and mass_jer_up for JERUp, ...), the other variations are not computed
+#  the stochastic JER smearing draws one random number per jet of the full collection, from np.random.RandomState(seed)
+#  (or np.random if seed is None), so the corrected jets are exactly those given by JetTransformer.transform after np.random.seed(seed)
+class JetCorrector:
+    def __init__(self, jec, junc=None, jer=None, jersf=None):
+        if (jer is None) != (jersf is None):
+            raise Exception('Cannot apply JER-SF without an input JER, and vice-versa!')
+        self._jec = jec
+        self._junc = junc
+        self._jer = jer
+        self._jersf = jersf
+
+        # from PhysicsTools/PatUtils/interface/SmearedJetProducerT.h#L283
+        self.MIN_JET_ENERGY = 1e-2
+
+    def _smear(self, jersf, jet, ptGenJet, jersmear, minJetPt):
+        pt = jet.pt.content
+        smear = np.where(ptGenJet > 0,
+                         1 + (jersf - 1) * (pt - ptGenJet) / pt,
+                         1. + np.sqrt(np.maximum(jersf**2 - 1.0, 0)) * jersmear)
+        return np.where(smear * pt < minJetPt, minJetPt / pt, smear)
+
+    def transform(self, jets, syst='nominal', mask=None, seed=None):
+        if not syst in jetVariations:
+            raise Exception(f'{syst} is not in acceptable jet systematic types {list(jetVariations)}')
+        variations = jetVariations[syst]
+
+        nJets = jets.pt.flatten().size
+        if mask is None:
+            jet = jets
+            selected = slice(None)
+        else:
+            jet = _select(jets, mask)
+            selected = mask.flatten()
+
+        # initialize the jet momenta to raw values, and apply the jet energy corrections
+        _updatePtMass(jet, jet.ptRaw.content, jet.massRaw.content)
+        jec = self._jec.getCorrection(**_arguments(self._jec, jet))
+        _updatePtMass(jet, jec * jet.ptRaw.content, jec * jet.massRaw.content)
+
+        # the uncertainties are evaluated with the corrected, not yet smeared, jets
+        juncs = {}
+        if self._junc is not None and any(variation.startswith('jes') for variation in variations):
+            juncs = dict(self._junc.getUncertainty(**_arguments(self._junc, jet)))
+
+        if self._jer is not None:
+            jer = self._jer.getResolution(**_arguments(self._jer, jet))
+            jersf = self._jersf.getScaleFactor(**_arguments(self._jersf, jet))
+
+            random = np.random if seed is None else np.random.RandomState(seed)
+            jersmear = jer * random.normal(size=nJets)[selected]
+
+            ptGenJet = jet.ptGenJet.content if 'ptGenJet' in jet.columns else np.zeros_like(jet.pt.content)
+
+            # from PhysicsTools/PatUtils/interface/SmearedJetProducerT.h#L255-L264
+            minJetPt = self.MIN_JET_ENERGY / np.cosh(jet.eta.content)
+
+            # need to apply up and down jer-smear before applying central correction
+            for variation, column in [('jer_up', 1), ('jer_down', -1)]:
+                if variation in variations:
+                    smear = self._smear(jersf[:, column], jet, ptGenJet, jersmear, minJetPt)
+                    jet.add_attributes(**{f'pt_{variation}': smear * jet.pt.content,
+                                          f'mass_{variation}': smear * jet.mass.content})
+
+            smear = self._smear(jersf[:, 0], jet, ptGenJet, jersmear, minJetPt)
+            _updatePtMass(jet, smear * jet.pt.content, smear * jet.mass.content)
+
+        # have to apply central jersf before calculating junc
+        for name, values in juncs.items():
+            for variation, column in [('up', 0), ('down', 1)]:
+                if f'{name}_{variation}' in variations:
+                    jet.add_attributes(**{f'pt_{name}_{variation}': values[:, column] * jet.pt.content,
+                                          f'mass_{name}_{variation}': values[:, column] * jet.mass.content})
+
+        jet._content._contents['p4'] = TLorentzVectorArray.from_ptetaphim(jet.pt.content,
+                                                                          jet.eta.content,
+                                                                          jet.phi.content,
+                                                                          jet.mass.content)
+        return jet
@@ -0,0 +1,220 @@
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numba
+
+#compiled kernels of ttgamma/utils are cached on disk, so workers and batch jobs load them instead of compiling them again
+#  the cache is in TTGAMMA_NUMBA_CACHE_DIR if set (or NUMBA_CACHE_DIR), otherwise in numba's default location (__pycache__ next to the source)
+#  set this to a shared, writable directory for batch jobs, whose package installation is usually read only
+cacheDir = os.environ.get('TTGAMMA_NUMBA_CACHE_DIR')
+if cacheDir:
+    numba.config.CACHE_DIR = cacheDir
+
+_kernels = []
+_warm = False
+
+
+#decorator for the numba kernels, compiled in nopython mode and cached on disk
+#  signatures are the explicit types the kernel is used with (for both precision policies), which are compiled by warmUp()
+#  the kernel stays lazy for other types, which are compiled on first call
+#  parallel kernels run their prange loops (over events or objects) on the threads set by setThreads()
+def kernel(*signatures, parallel=False):
+    def decorator(function):
+        dispatcher = numba.jit(nopython=True, cache=True, parallel=parallel)(function)
+        _kernels.append((dispatcher, signatures))
+        return dispatcher
+    return decorator
+
+
+#compile a kernel generated at run time (like the object identification loops)
+#  numba can only cache functions defined in a file, so the source is written to a module in the cache directory, named by its hash
+def compileSource(source, name='kernel', parallel=False):
+    directory = os.path.join(numba.config.CACHE_DIR or tempfile.gettempdir(), 'ttgamma_kernels')
+    os.makedirs(directory, exist_ok=True)
+    moduleName = f"ttgamma_kernel_{hashlib.sha1(source.encode()).hexdigest()[:16]}"
+    path = os.path.join(directory, f'{moduleName}.py')
+    if not os.path.exists(path):
+        with open(f'{path}.{os.getpid()}', 'w') as f:
+            f.write(source)
+        os.replace(f'{path}.{os.getpid()}', path)
+
+    #the module is registered, so the cached kernel can find it again when it is loaded
+    if not moduleName in sys.modules:
+        spec = importlib.util.spec_from_file_location(moduleName, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[moduleName] = module
+    module = sys.modules[moduleName]
+    return numba.jit(nopython=True, cache=True, parallel=parallel)(getattr(module, name))
+
+
+#set the number of threads of the parallel kernels, for the calling thread (None keeps the current setting)
+#  at most NUMBA_NUM_THREADS, which is the number of cores unless set in the environment
+def setThreads(threads=None):
+    if not threads is None:
+        numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+    return numba.get_num_threads()
+
+
+#cores this process may use: the Cpus of the HTCondor slot when running in one, otherwise the cores it is allowed to run on
+def availableCores():
+    machineAd = os.environ.get('_CONDOR_MACHINE_AD')
+    if machineAd and os.path.exists(machineAd):
+        with open(machineAd) as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip() == 'Cpus':
+                    return int(value)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+#threads for the kernels of each of workers processes, so that the workers together do not use more threads than cores
+#  must be computed where the workers run (the cores of a batch slot are not those of the submitting node)
+def threadsPerWorker(workers, cores=None):
+    if cores is None:
+        cores = availableCores()
+    return max(1, cores // max(1, workers))
+
+
+#compile (or load from the cache) every kernel for its signatures, once per process
+#  used as the initializer of the worker processes, so the first chunk of each worker does not pay for the compilation
+def warmUp():
+    global _warm
+    if _warm:
+        return 0.
+    tic = time.time()
+    #import the modules defining kernels, so they are registered
+    from . import genParentage, genJetMatching, theoryWeights, objectID
+    for dispatcher, signatures in _kernels:
+        for signature in signatures:
+            dispatcher.compile(signature)
+    #the types of the object identification kernels are only known from the columns, they are loaded from the cache on first call
+    for selector in [objectID.muonID, objectID.electronID, objectID.photonID, objectID.jetID]:
+        if selector._kernel is None:
+            selector._compile()
+    _warm = True
+    return time.time() - tic
+
+
+#process pool whose workers are warmed up when they start, for the pool argument of processor.futures_executor
+def warmPool(max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=warmUp)
+
+
+_firstChunk = '''
+import time
+tic = time.time()
+from ttgamma import TTGammaProcessor
+from ttgamma.utils.jit import warmUp
+from coffea.processor import LazyDataFrame
+import uproot4
+imported = time.time()
+warm = warmUp() if {warm} else 0.
+with uproot4.open({fileName!r}) as f:
+    df = LazyDataFrame(f[{treename!r}], 0, {chunksize}, flatten=True)
+    df['dataset'] = {dataset!r}
+    df['filename'] = {fileName!r}
+    df['entrystart'] = 0
+    df['entrystop'] = {chunksize}
+    df['fileuuid'] = str(f.file.uuid)
+    TTGammaProcessor().process(df)
+print(imported - tic, warm, time.time() - tic)
+'''
+
+
+#time from the start of a fresh python process to the end of the processing of its first chunk
+#  returns the import time, the warm up time and the total time
+def timeToFirstChunk(fileName, dataset, treename='Events', chunksize=50000, warm=True, numbaCacheDir=None):
+    env = dict(os.environ)
+    if not numbaCacheDir is None:
+        env['NUMBA_CACHE_DIR'] = numbaCacheDir
+        env['TTGAMMA_NUMBA_CACHE_DIR'] = numbaCacheDir
+    code = _firstChunk.format(fileName=fileName, dataset=dataset, treename=treename, chunksize=chunksize, warm=warm)
+    output = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return [float(t) for t in output.split()[-3:]]
+
+
+#time to first chunk without compiled kernels (an empty numba cache, as a new worker or batch job had before) and with
+#  the kernels cached on disk and warmed up
+def compareTimeToFirstChunk(fileName, dataset, treename='Events', chunksize=50000):
+    results = {}
+    with tempfile.TemporaryDirectory() as numbaCacheDir:
+        results['cold'] = timeToFirstChunk(fileName, dataset, treename, chunksize, warm=False, numbaCacheDir=numbaCacheDir)
+        #fill the cache, then measure a new process loading the cached kernels
+        timeToFirstChunk(fileName, dataset, treename, chunksize, warm=True, numbaCacheDir=numbaCacheDir)
+        results['cached'] = timeToFirstChunk(fileName, dataset, treename, chunksize, warm=True, numbaCacheDir=numbaCacheDir)
+    for name, (imported, warm, total) in results.items():
+        print(f"{name:7s} import {imported:6.2f} s  warm up {warm:6.2f} s  first chunk done after {total:6.2f} s")
+    return results
+
+
+#scaling of the parallel kernels from 1 to NUMBA_NUM_THREADS threads, on random events
+#  returns the time per call of each kernel for each number of threads
+def benchmarkThreads(nEvents=500000, repeat=5, seed=0):
+    import numpy as np
+    from awkward import JaggedArray
+    from coffea.analysis_objects import JaggedCandidateArray
+    from .genParentage import objectMaxHistoryPDGID
+    from .genJetMatching import matchGenJets
+    from .objectID import muonID
+    warmUp()
+
+    random = np.random.RandomState(seed)
+    #gen particles whose mother is an earlier particle of the event, or -1
+    nGenPart = random.poisson(60, nEvents)
+    genPartIdx = JaggedArray.fromcounts(nGenPart, np.concatenate([np.arange(n) for n in nGenPart]).astype(np.int32))
+    motherIdx = genPartIdx.copy(content=(random.uniform(size=nGenPart.sum())*genPartIdx.content - 1).astype(np.int32))
+    pdgId = genPartIdx.copy(content=random.randint(-25, 26, size=nGenPart.sum()).astype(np.int32))
+    nJet = random.poisson(6, nEvents)
+    jetGenJetIdx = JaggedArray.fromcounts(nJet, random.randint(-1, 8, size=nJet.sum()).astype(np.int32))
+    genJetPt = JaggedArray.fromcounts(np.full(nEvents, 6), random.exponential(40., 6*nEvents).astype(np.float32))
+    nMuon = random.poisson(2, nEvents)
+    muons = JaggedCandidateArray.candidatesfromcounts(nMuon,
+                                                      pt=random.exponential(30., nMuon.sum()).astype(np.float32),
+                                                      eta=random.uniform(-3, 3, nMuon.sum()).astype(np.float32),
+                                                      phi=np.zeros(nMuon.sum(), dtype=np.float32),
+                                                      mass=np.zeros(nMuon.sum(), dtype=np.float32),
+                                                      tightId=random.uniform(size=nMuon.sum())<0.8,
+                                                      isPFcand=random.uniform(size=nMuon.sum())<0.9,
+                                                      isTracker=random.uniform(size=nMuon.sum())<0.9,
+                                                      isGlobal=random.uniform(size=nMuon.sum())<0.9,
+                                                      relIso=random.exponential(0.2, nMuon.sum()).astype(np.float32))
+
+    kernels = {'objectMaxHistoryPDGID': lambda: objectMaxHistoryPDGID(genPartIdx.content, genPartIdx.starts, genPartIdx.stops,
+                                                                      pdgId.content, pdgId.starts, pdgId.stops,
+                                                                      motherIdx.content, motherIdx.starts, motherIdx.stops),
+               'matchGenJets': lambda: matchGenJets(jetGenJetIdx, {'pt': genJetPt}),
+               'muonID': lambda: muonID.bitmask(muons),
+              }
+
+    threads = sorted(set([2**i for i in range(numba.config.NUMBA_NUM_THREADS.bit_length())] + [numba.config.NUMBA_NUM_THREADS]))
+    previous = setThreads()
+    timing = {}
+    try:
+        for name, function in kernels.items():
+            function()
+            for n in threads:
+                setThreads(n)
+                tic = time.time()
+                for _ in range(repeat):
+                    function()
+                timing[name, n] = (time.time() - tic)/repeat
+                print(f"{name:22s} {n:3d} threads {1000*timing[name, n]:8.1f} ms  (speedup {timing[name, 1]/timing[name, n]:.2f})")
+    finally:
+        setThreads(previous)
+    return timing
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['threads']:
+        benchmarkThreads()
+    else:
+        compareTimeToFirstChunk(*sys.argv[1:3])
@@ -0,0 +1,334 @@
+import numpy as np
+
+#layout of the mcYield table used in the likelihood fit: rows are samples, columns are photon categories
+#  the ttgamma scale factor scales the ttgamma row, the nonprompt scale factor scales the nonprompt column
+ttgammaRow = 0
+nonPromptColumn = -1
+
+#rows counted as top (ttgamma and ttbar) and columns counted as isolated photons (genuine and misID electrons)
+topRows = slice(0,2)
+isoColumns = slice(0,2)
+
+
+#split the sum over a region of the yield table into the pieces scaled by 1, ttgammaSF, nonPromptSF and ttgammaSF*nonPromptSF
+def _regionCoefficients(values, region):
+    isTTGamma = np.zeros(values.shape[-2:], dtype=bool)
+    isTTGamma[ttgammaRow] = True
+    isNonPrompt = np.zeros(values.shape[-2:], dtype=bool)
+    isNonPrompt[:,nonPromptColumn] = True
+
+    pieces = [~isTTGamma & ~isNonPrompt,
+              isTTGamma & ~isNonPrompt,
+              ~isTTGamma & isNonPrompt,
+              isTTGamma & isNonPrompt]
+
+    return np.stack([(values*(piece & region)).sum(axis=(-2,-1)) for piece in pieces], axis=-1)
+
+
+#reduce the fit inputs to the handful of sums needed by the chi2
+#  mcYield and mcYieldErr may carry extra leading dimensions (systematics, toys, ...), in which case every other input broadcasts against them
+def fitCoefficients(fitData):
+    if '_coefficients' in fitData:
+        return fitData
+
+    mcYield = np.asarray(fitData['mcYield'], dtype=np.float64)
+    mcYieldErr2 = np.asarray(fitData['mcYieldErr'], dtype=np.float64)**2
+
+    allRegion = np.ones(mcYield.shape[-2:], dtype=bool)
+    isoRegion = np.zeros(mcYield.shape[-2:], dtype=bool)
+    isoRegion[:,isoColumns] = True
+    topRegion = np.zeros(mcYield.shape[-2:], dtype=bool)
+    topRegion[topRows] = True
+
+    return {'_coefficients' : True,
+            'batchShape'    : mcYield.shape[:-2],
+            'nMC'           : _regionCoefficients(mcYield, allRegion),
+            'nMCErr2'       : _regionCoefficients(mcYieldErr2, allRegion),
+            'nIso'          : _regionCoefficients(mcYield, isoRegion),
+            'nIsoErr2'      : _regionCoefficients(mcYieldErr2, isoRegion),
+            'nTop'          : _regionCoefficients(mcYield, topRegion),
+            'nTopErr2'      : _regionCoefficients(mcYieldErr2, topRegion),
+            'photonPurity'    : np.asarray(fitData['photonPurity'], dtype=np.float64),
+            'photonPurityErr' : np.asarray(fitData['photonPurityErr'], dtype=np.float64),
+            'topPurity'       : np.asarray(fitData['topPurity'], dtype=np.float64),
+            'topPurityErr'    : np.asarray(fitData['topPurityErr'], dtype=np.float64),
+            'nData'           : np.asarray(fitData['nData'], dtype=np.float64),
+           }
+
+
+def _poly(coef, a, b):
+    return coef[...,0] + a*coef[...,1] + b*coef[...,2] + a*b*coef[...,3]
+
+
+#MC predictions of the total yield, photon purity and top purity (with their MC statistical uncertainties squared) for the given scale factors
+def predictions(ttgammaSF, nonPromptSF, fitData):
+    coef = fitCoefficients(fitData)
+    a = np.asarray(ttgammaSF, dtype=np.float64)
+    b = np.asarray(nonPromptSF, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nMC = _poly(coef['nMC'], a, b)
+        nMCErr2 = _poly(coef['nMCErr2'], a*a, b*b)
+
+        nIso = _poly(coef['nIso'], a, b)
+        nIsoErr2 = _poly(coef['nIsoErr2'], a*a, b*b)
+
+        nTop = _poly(coef['nTop'], a, b)
+        nTopErr2 = _poly(coef['nTopErr2'], a*a, b*b)
+
+        mcPhotonPurity = nIso/nMC
+        mcPhotonPurityErr2 = mcPhotonPurity**2 * (nIsoErr2/nIso**2 + nMCErr2/nMC**2)
+
+        mcTopPurity = nTop/nMC
+        mcTopPurityErr2 = mcTopPurity**2 * (nTopErr2/nTop**2 + nMCErr2/nMC**2)
+
+    return {'nMC'               : nMC,
+            'nMCErr2'           : nMCErr2,
+            'photonPurity'      : mcPhotonPurity,
+            'photonPurityErr2'  : mcPhotonPurityErr2,
+            'topPurity'         : mcTopPurity,
+            'topPurityErr2'     : mcTopPurityErr2,
+           }
+
+
+#chi2 (-2 log of the likelihood) of the purity and yield constraints, same definition as the original likelihoodFunction
+#  ttgammaSF and nonPromptSF can be arrays of any shape broadcastable against the batch shape of fitData
+def chi2(ttgammaSF, nonPromptSF, fitData):
+    coef = fitCoefficients(fitData)
+    mc = predictions(ttgammaSF, nonPromptSF, coef)
+    nData = coef['nData']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((coef['photonPurity'] - mc['photonPurity'])**2/(coef['photonPurityErr']**2 + mc['photonPurityErr2']) +
+                (coef['topPurity'] - mc['topPurity'])**2/(coef['topPurityErr']**2 + mc['topPurityErr2']) +
+                (nData - mc['nMC'])**2/(nData + mc['nMCErr2'])
+               )
+
+
+def _safeChi2(a, b, coef):
+    value = chi2(a, b, coef)
+    return np.where(np.isfinite(value), value, np.inf)
+
+
+#offsets of the 9-point stencil used for the finite-difference gradient and hessian
+_stencil = np.array([(i,j) for i in (-1,0,1) for j in (-1,0,1)], dtype=np.float64)
+#trial fractions of the newton step, evaluated together in the line search
+_lineSearch = 0.5**np.arange(12)
+
+
+#damped newton minimization run on every point of the batch at once
+#  x has shape (..., 2); coordinates with free==False are held fixed
+def _newtonMinimize(coef, x, free, nIter=100, tol=1e-9, h=1e-4):
+    freeA, freeB = free
+    fx = _safeChi2(x[...,0], x[...,1], coef)
+
+    for iteration in range(nIter):
+        pad = (slice(None),) + (None,)*(x.ndim-1)
+        da = (_stencil[:,0]*h)[pad]
+        db = (_stencil[:,1]*h)[pad]
+        f = _safeChi2(x[...,0] + da, x[...,1] + db, coef)
+
+        # stencil index = 3*(i+1) + (j+1)
+        f0 = f[4]
+        ga = (f[7] - f[1])/(2*h)
+        gb = (f[5] - f[3])/(2*h)
+        haa = (f[7] - 2*f0 + f[1])/h**2
+        hbb = (f[5] - 2*f0 + f[3])/h**2
+        hab = (f[8] - f[6] - f[2] + f[0])/(4*h**2)
+
+        #remove the fixed directions from the newton system
+        if not freeA:
+            ga = np.zeros_like(ga); haa = np.ones_like(haa); hab = np.zeros_like(hab)
+        if not freeB:
+            gb = np.zeros_like(gb); hbb = np.ones_like(hbb); hab = np.zeros_like(hab)
+
+        det = haa*hbb - hab**2
+        posDef = (haa > 0) & (det > 0) & np.isfinite(det)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stepA = np.where(posDef, -(hbb*ga - hab*gb)/det, 0.)
+            stepB = np.where(posDef, -(haa*gb - hab*ga)/det, 0.)
+
+            #fall back to a steepest descent step where the hessian is not positive definite
+            gNorm = np.hypot(ga, gb)
+            stepA = np.where(posDef, stepA, -0.1*ga/np.where(gNorm > 0, gNorm, 1.))
+            stepB = np.where(posDef, stepB, -0.1*gb/np.where(gNorm > 0, gNorm, 1.))
+
+        stepA = np.where(np.isfinite(stepA), stepA, 0.)
+        stepB = np.where(np.isfinite(stepB), stepB, 0.)
+
+        t = _lineSearch[pad]
+        trial = _safeChi2(x[...,0] + t*stepA, x[...,1] + t*stepB, coef)
+        best = np.argmin(trial, axis=0)
+        fBest = np.take_along_axis(trial, best[None], axis=0)[0]
+        tBest = np.where(fBest < fx, _lineSearch[best], 0.)
+
+        x = x.copy()
+        x[...,0] += tBest*stepA
+        x[...,1] += tBest*stepB
+        fx = np.minimum(fx, fBest)
+
+        if np.all(tBest*np.hypot(stepA, stepB) < tol):
+            break
+
+    return x, fx
+
+
+#find the minimum chi2 for the fit inputs
+#  ttgammaSF or nonPromptSF may be given (scalars or arrays) to hold that parameter fixed and minimize over the other one
+#  returns the best ttgammaSF, nonPromptSF and chi2 at the minimum, with the batch shape of the inputs
+def minimize(fitData, ttgammaSF=None, nonPromptSF=None, start=(1.,1.), nIter=100, tol=1e-9):
+    coef = fitCoefficients(fitData)
+
+    a0 = start[0] if ttgammaSF is None else ttgammaSF
+    b0 = start[1] if nonPromptSF is None else nonPromptSF
+    shape = np.broadcast_shapes(coef['batchShape'], np.shape(a0), np.shape(b0))
+
+    x = np.empty(shape + (2,), dtype=np.float64)
+    x[...,0] = a0
+    x[...,1] = b0
+
+    x, fx = _newtonMinimize(coef, x, (ttgammaSF is None, nonPromptSF is None), nIter=nIter, tol=tol)
+
+    return x[...,0], x[...,1], fx
+
+
+#chi2 on a grid of (ttgammaSF, nonPromptSF) points, evaluated in a single broadcast call
+#  the result has shape (len(nonPromptVals), len(ttgammaVals)), matching the plt.contourf convention
+#  if relative is True, the chi2 at the minimum is subtracted (giving -2*deltaNLL)
+def chi2Surface(fitData, ttgammaVals, nonPromptVals, relative=True):
+    coef = fitCoefficients(fitData)
+
+    ttgammaGrid, nonPromptGrid = np.meshgrid(ttgammaVals, nonPromptVals)
+    batchDims = len(coef['batchShape'])
+    pad = (Ellipsis,) + (None,)*batchDims
+
+    surface = chi2(ttgammaGrid[pad], nonPromptGrid[pad], coef)
+
+    if relative:
+        surface = surface - minimize(coef)[2]
+
+    return surface
+
+
+#################################
+# PROFILE LIKELIHOOD AND INTERVALS
+#################################
+
+_parameters = ['ttgammaSF', 'nonPromptSF']
+
+
+#combine a list of fit inputs (for example one per systematic) into a single batched fitData, stacked along a new leading axis
+def stackFitData(fitDataList):
+    return {key: np.stack([np.asarray(fitData[key], dtype=np.float64) for fitData in fitDataList])
+            for key in fitDataList[0]}
+
+
+#-2*deltaNLL at which a one parameter interval with confidence level cl is crossed (1 for cl=68.27%, 4 for cl=95.45%)
+def confidenceThreshold(cl):
+    from scipy.special import erfinv
+    return 2*erfinv(cl)**2
+
+
+def _checkParameter(parameter):
+    if not parameter in _parameters:
+        raise Exception(f'{parameter} is not in acceptable fit parameters {_parameters}')
+    return _parameters.index(parameter)
+
+
+#profiled -2*deltaNLL as a function of one parameter, minimizing over the other one for every scan point at once
+#  the result has shape (len(values),) + the batch shape of fitData
+def profile(fitData, parameter, values, start=(1.,1.)):
+    _checkParameter(parameter)
+    coef = fitCoefficients(fitData)
+
+    values = np.asarray(values, dtype=np.float64)
+    fixed = values.reshape(values.shape + (1,)*len(coef['batchShape']))
+
+    chi2Min = minimize(coef, start=start)[2]
+    chi2Profile = minimize(coef, start=start, **{parameter: fixed})[2]
+
+    return chi2Profile - chi2Min
+
+
+#find where the profile crosses the threshold on one side of the best fit
+#  the crossing is first bracketed by doubling the step away from the best fit, then refined with the Illinois false-position method
+def _findCrossing(func, best, direction, step=0.1, maxBracket=30, maxIter=60, tol=1e-7):
+    lo = best.copy()
+    fLo = func(lo)
+    step = np.full_like(best, step)
+    hi = best + direction*step
+    fHi = func(hi)
+
+    for i in range(maxBracket):
+        needsStep = ~(fHi > 0)
+        if not needsStep.any():
+            break
+        lo = np.where(needsStep & np.isfinite(fHi), hi, lo)
+        fLo = np.where(needsStep & np.isfinite(fHi), fHi, fLo)
+        step = np.where(needsStep, 2*step, step)
+        hi = np.where(needsStep, best + direction*step, hi)
+        fHi = np.where(needsStep, func(hi), fHi)
+
+    bracketed = (fLo <= 0) & (fHi > 0)
+    lastSide = np.zeros(best.shape, dtype=np.int8)
+    x = hi.copy()
+
+    for i in range(maxIter):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = (lo*fHi - hi*fLo)/(fHi - fLo)
+        x = np.where(np.isfinite(x), x, 0.5*(lo + hi))
+        fx = func(x)
+
+        below = fx <= 0
+        side = np.where(below, 1, -1).astype(np.int8)
+
+        #Illinois modification: halve the function value of an endpoint retained twice in a row
+        fHi = np.where(below & (lastSide==1), 0.5*fHi, fHi)
+        fLo = np.where(~below & (lastSide==-1), 0.5*fLo, fLo)
+
+        lo = np.where(below, x, lo)
+        fLo = np.where(below, fx, fLo)
+        hi = np.where(below, hi, x)
+        fHi = np.where(below, fHi, fx)
+        lastSide = side
+
+        if np.all((np.abs(fx) < tol) | (np.abs(hi - lo) < tol) | ~bracketed):
+            break
+
+    return np.where(bracketed, x, np.nan)
+
+
+def _interval(coef, parameter, bestFit, chi2Min, threshold):
+    iParam = _checkParameter(parameter)
+    best = bestFit[iParam]
+
+    def func(value):
+        return minimize(coef, start=bestFit, **{parameter: value})[2] - chi2Min - threshold
+
+    up = _findCrossing(func, best, +1)
+    down = _findCrossing(func, best, -1)
+
+    return up - best, down - best
+
+
+#asymmetric profile likelihood interval on one parameter at confidence level cl
+#  returns the best fit value and the (positive) up and (negative) down errors, with the batch shape of fitData
+def interval(fitData, parameter, cl=0.682689492137086, start=(1.,1.)):
+    coef = fitCoefficients(fitData)
+    ttgammaSF, nonPromptSF, chi2Min = minimize(coef, start=start)
+    up, down = _interval(coef, parameter, (ttgammaSF, nonPromptSF), chi2Min, confidenceThreshold(cl))
+
+    return (ttgammaSF, nonPromptSF)[_checkParameter(parameter)], up, down
+
+
+#best fit with intervals on both parameters, replacing maximizeLikelihood(fitData, find1sigma=True)
+#  returns ttgammaSF, ttgammaUp, ttgammaDown, nonPromptSF, nonPromptUp, nonPromptDown, chi2Min
+def fitWithErrors(fitData, cl=0.682689492137086, start=(1.,1.)):
+    coef = fitCoefficients(fitData)
+    ttgammaSF, nonPromptSF, chi2Min = minimize(coef, start=start)
+    threshold = confidenceThreshold(cl)
+
+    ttgammaUp, ttgammaDown = _interval(coef, 'ttgammaSF', (ttgammaSF, nonPromptSF), chi2Min, threshold)
+    nonPromptUp, nonPromptDown = _interval(coef, 'nonPromptSF', (ttgammaSF, nonPromptSF), chi2Min, threshold)
+
+    return ttgammaSF, ttgammaUp, ttgammaDown, nonPromptSF, nonPromptUp, nonPromptDown, chi2Min
@@ -0,0 +1,108 @@
+import json
+import sys
+import time
+
+import numpy as np
+from coffea.lumi_tools import LumiData
+
+
+#packed (run << 32 | lumi) key of luminosity sections, ordered by run then luminosity section
+def lumiKey(runs, lumis):
+    return (np.asarray(runs).astype(np.uint64) << np.uint64(32)) | np.asarray(lumis).astype(np.uint64)
+
+
+#certified luminosity sections of a golden JSON ({"run": [[firstLumi, lastLumi], ...], ...})
+#  the ranges of all runs are stored as sorted arrays of first and last keys, so an event is certified if the last range starting
+#  at or before its key ends at or after it: a single searchsorted over the events of a chunk, without any loop over runs
+#  the events of a file are grouped by luminosity section, so the lookup is done once per block of consecutive events with the same key
+class LumiMask:
+    def __init__(self, jsonFile):
+        with open(jsonFile) as f:
+            certified = json.load(f)
+
+        runs = np.array([int(run) for run, ranges in certified.items() for _ in ranges], dtype=np.uint64)
+        ranges = np.array([lumis for run, ranges in certified.items() for lumis in ranges], dtype=np.uint64).reshape(-1, 2)
+        first = lumiKey(runs, ranges[:, 0])
+        last = lumiKey(runs, ranges[:, 1])
+
+        order = np.argsort(first, kind='stable')
+        self._first = first[order]
+        #the running maximum makes overlapping ranges safe, the last key of a run is always below the keys of the next runs
+        self._last = np.maximum.accumulate(last[order]) if len(last) > 0 else last
+
+    def __call__(self, runs, lumis):
+        keys = lumiKey(runs, lumis)
+        if len(keys) == 0:
+            return np.zeros(0, dtype=bool)
+        blocks = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        blockKeys = keys[blocks]
+        idx = np.searchsorted(self._first, blockKeys, side='right') - 1
+        certified = (idx >= 0) & (blockKeys <= self._last[np.maximum(idx, 0)])
+        return np.repeat(certified, np.diff(np.append(blocks, len(keys))))
+
+
+#set of the (run, lumi) pairs of the events passing mask, for a set_accumulator in the processor output
+def processedLumis(runs, lumis, mask=None):
+    keys = lumiKey(runs, lumis)
+    if not mask is None:
+        keys = keys[mask]
+    keys = np.unique(keys)
+    return set(zip((keys >> np.uint64(32)).tolist(), (keys & np.uint64(0xffffffff)).tolist()))
+
+
+#processed luminosity sections of a merged output, in the golden JSON format (to be given to brilcalc)
+def lumiJSON(lumis, jsonFile=None):
+    ranges = {}
+    for run, lumi in sorted(lumis):
+        runRanges = ranges.setdefault(str(run), [])
+        if len(runRanges) > 0 and runRanges[-1][1] == lumi - 1:
+            runRanges[-1][1] = lumi
+        else:
+            runRanges.append([lumi, lumi])
+    if not jsonFile is None:
+        with open(jsonFile, 'w') as f:
+            json.dump(ranges, f)
+    return ranges
+
+
+#integrated luminosity of the processed luminosity sections of a merged output, from the brilcalc csv output (--byls) of the golden JSON
+#  to be compared with the luminosity used to normalize the MC (lumis in utils/crossSections.py)
+def recordedLuminosity(lumis, lumiCsv):
+    return LumiData(lumiCsv).get_lumi(np.array(sorted(lumis), dtype=np.uint32).reshape(-1, 2))
+
+
+#certified luminosity sections which were not processed (missing files or failed chunks), as a golden JSON dict
+def missingLumis(lumis, jsonFile):
+    with open(jsonFile) as f:
+        certified = json.load(f)
+    missing = set()
+    for run, ranges in certified.items():
+        for first, last in ranges:
+            missing.update((int(run), lumi) for lumi in range(first, last + 1))
+    return lumiJSON(missing - set(lumis))
+
+
+#throughput of the mask on random events spread over the runs of a golden JSON, for events ordered by luminosity section
+#  as in the data files (about 500 events per section) and for shuffled events
+def benchmarkLumiMask(jsonFile, nEvents=10000000, repeat=5, seed=0):
+    mask = LumiMask(jsonFile)
+    random = np.random.RandomState(seed)
+    keys = mask._first[random.randint(0, len(mask._first), nEvents//500)] + random.randint(0, 20, nEvents//500).astype(np.uint64)
+    keys = np.repeat(np.sort(keys), 500)
+
+    timing = {}
+    for order in ['ordered', 'shuffled']:
+        if order == 'shuffled':
+            random.shuffle(keys)
+        runs = (keys >> np.uint64(32)).astype(np.uint32)
+        lumis = (keys & np.uint64(0xffffffff)).astype(np.uint32)
+        tic = time.time()
+        for _ in range(repeat):
+            passing = mask(runs, lumis)
+        timing[order] = (time.time() - tic)/repeat
+        print(f"{order:8s} {len(keys)} events in {1000*timing[order]:.1f} ms ({len(keys)/timing[order]/1e6:.1f} M events/s), {passing.mean():.3f} certified")
+    return timing
+
+
+if __name__ == '__main__':
+    benchmarkLumiMask(sys.argv[1])
@@ -0,0 +1,84 @@
+from coffea import hist
+
+from .crossSections import crossSections, lumis
+
+#number of generated events in each MC sample, before skimming
+mcEventYields_2016 = {'DYjetsM10to50_2016': 35114961.0, 'DYjetsM50_2016': 146280395.0, 'GJets_HT40To100_2016': 9326139.0, 'GJets_HT100To200_2016': 10104155.0, 'GJets_HT200To400_2016': 20527506.0, 'GJets_HT400To600_2016': 5060070.0, 'GJets_HT600ToInf_2016': 5080857.0, 'QCD_Pt20to30_Ele_2016': 9241500.0, 'QCD_Pt30to50_Ele_2016': 11508842.0, 'QCD_Pt50to80_Ele_2016': 45789059.0, 'QCD_Pt80to120_Ele_2016': 77800204.0, 'QCD_Pt120to170_Ele_2016': 75367655.0, 'QCD_Pt170to300_Ele_2016': 11105095.0, 'QCD_Pt300toInf_Ele_2016': 7090318.0, 'QCD_Pt20to30_Mu_2016': 31878740.0, 'QCD_Pt30to50_Mu_2016': 29936360.0, 'QCD_Pt50to80_Mu_2016': 19662175.0, 'QCD_Pt80to120_Mu_2016': 23686772.0, 'QCD_Pt120to170_Mu_2016': 7897731.0, 'QCD_Pt170to300_Mu_2016': 17350231.0, 'QCD_Pt300to470_Mu_2016': 49005976.0, 'QCD_Pt470to600_Mu_2016': 19489276.0, 'QCD_Pt600to800_Mu_2016': 9981311.0, 'QCD_Pt800to1000_Mu_2016': 19940747.0, 'QCD_Pt1000toInf_Mu_2016': 13608903.0, 'ST_s_channel_2016': 6137801.0, 'ST_tW_channel_2016': 4945734.0, 'ST_tbarW_channel_2016': 4942374.0, 'ST_tbar_channel_2016': 17780700.0, 'ST_t_channel_2016': 31848000.0, 'TTGamma_Dilepton_2016': 5728644.0, 'TTGamma_Hadronic_2016': 5635346.0, 'TTGamma_SingleLept_2016': 10991612.0, 'TTWtoLNu_2016': 2716249.0, 'TTWtoQQ_2016': 430310.0, 'TTZtoLL_2016': 6420825.0, 'TTbarPowheg_Dilepton_2016': 67339946.0, 'TTbarPowheg_Hadronic_2016': 67963984.0, 'TTbarPowheg_Semilept_2016': 106438920.0, 'W1jets_2016': 45283121.0, 'W2jets_2016': 60438768.0, 'W3jets_2016': 59300029.0, 'W4jets_2016': 29941394.0, 'WGamma_01J_5f_2016': 6103817.0, 'ZGamma_01J_5f_lowMass_2016': 9696539.0, 'WW_2016': 7982180.0, 'WZ_2016': 3997571.0, 'ZZ_2016': 1988098.0}
+
+#versioned normalization inputs
+#  add a new version instead of editing an existing one, so outputs normalized with older versions stay reproducible
+normalizationTables = {
+    '2016_v1' : {'luminosity'    : lumis[2016],
+                 'crossSections' : crossSections,
+                 'mcEventYields' : mcEventYields_2016,
+                },
+}
+defaultNormalization = '2016_v1'
+
+#histograms which must keep raw (unnormalized) counts, and systematics which are filled without any event weight
+unnormalizedHists = ['hJets', 'hBJets']
+unweightedSystematics = ['noweight']
+
+
+#normalization factor (xsec * luminosity / number of generated events) for each MC dataset in processedEvents
+#  processedEvents maps the full dataset name to the number of processed events, the number of generated events is taken from
+#  the table (or from mcEventYields, if given), as the processed events of a skimmed or partly processed sample are not all generated events
+def normalizationFactors(processedEvents, version=defaultNormalization, mcEventYields=None):
+    table = normalizationTables[version]
+    if mcEventYields is None:
+        mcEventYields = table['mcEventYields']
+
+    missing = sorted(datasetFull for datasetFull in processedEvents if not datasetFull in mcEventYields)
+    if len(missing) > 0:
+        raise Exception(f'no number of generated events for {", ".join(missing)} in the normalization {version}')
+
+    factors = {}
+    for datasetFull in processedEvents:
+        dataset = datasetFull.replace('_2016','')
+        factors[datasetFull] = table['crossSections'][dataset] * table['luminosity'] / mcEventYields[datasetFull]
+
+    return factors
+
+
+#scale (in place) the histograms of a processor output by per-dataset factors, keyed by full dataset name
+def _scaleOutput(output, factors):
+    for name, h in output.items():
+        if not isinstance(h, hist.Hist) or name in unnormalizedHists:
+            continue
+        if not 'dataset' in [ax.name for ax in h.axes()]:
+            continue
+
+        present = set(i.name for i in h.identifiers('dataset'))
+        datasetFactors = {k.replace('_2016',''): v for k, v in factors.items() if k.replace('_2016','') in present}
+
+        if 'systematic' in [ax.name for ax in h.axes()]:
+            scale = {(dataset, syst.name): factor
+                     for dataset, factor in datasetFactors.items()
+                     for syst in h.identifiers('systematic') if not syst.name in unweightedSystematics}
+            h.scale(scale, axis=('dataset','systematic'))
+        else:
+            h.scale(datasetFactors, axis='dataset')
+
+
+#normalize the histograms of a processor output to cross section times luminosity, using a version of the normalization table
+#  the factors applied are recorded in output['normalization'] as (version, dataset, factor), so an already normalized
+#  output (including merged outputs) can be renormalized with a different version without reprocessing
+#  a merged output whose parts were normalized with different versions (or factors) is refused, as it can not be renormalized as a whole
+def normalize(output, version=defaultNormalization, mcEventYields=None):
+    newFactors = normalizationFactors(output['processedEvents'], version, mcEventYields)
+
+    versions = set(appliedVersion for appliedVersion, _, _ in output['normalization'])
+    if len(versions) > 1:
+        raise Exception(f'the output merges parts normalized with different versions ({", ".join(sorted(versions))}), renormalize the parts with the same version before merging them')
+    applied = {}
+    for _, dataset, factor in output['normalization']:
+        if applied.setdefault(dataset, factor) != factor:
+            raise Exception(f'the output merges parts of {dataset} normalized with different factors, renormalize the parts with the same version before merging them')
+    factors = {dataset: factor/applied.get(dataset, 1.) for dataset, factor in newFactors.items()}
+
+    _scaleOutput(output, factors)
+
+    output['normalization'].clear()
+    output['normalization'].update((version, dataset, factor) for dataset, factor in newFactors.items())
+
+    return output
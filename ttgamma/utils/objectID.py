@@ -0,0 +1,170 @@
+import re
+
+import numpy as np
+from awkward import JaggedArray
+
+from .jit import compileSource
+
+
+_names = re.compile(r'\b[A-Za-z_]\w*\b')
+_reserved = ['abs', 'min', 'max', 'and', 'or', 'not', 'True', 'False']
+
+
+#declarative object identification
+#  an ObjectID is a list of named cuts on the columns of a collection, each a python expression on one object
+#  (e.g. 'abs(eta) < 2.4', '(vidCuts >> 8 & 3) >= 2'), and a set of selections built from those cuts
+#  all the cuts are evaluated in a single compiled loop over the objects, which returns a packed bitmask per object
+#  (bit k set if the object passes the k-th cut), and every selection is then one comparison on that bitmask
+#  a selection is a dict with:  'require' : cuts which must all pass
+#                               'fail'    : cuts which must all fail (for inverted sidebands)
+#                               'exclude' : other selections which must not pass
+#  the tight muon, electron and jet selections are not defined here, they are given by the processor with withSelection
+class ObjectID:
+    def __init__(self, cuts, selections):
+        if len(cuts) > 63:
+            raise Exception(f'{len(cuts)} cuts do not fit in the 63 bits of the mask')
+
+        self.cuts = dict(cuts)
+        self.bits = {name: 1 << i for i, name in enumerate(self.cuts)}
+        self.selections = selections
+
+        columns = []
+        for expression in self.cuts.values():
+            for name in _names.findall(expression):
+                if not name in _reserved and not name in columns:
+                    columns.append(name)
+        self.columns = columns
+        self._kernel = None
+        self._derived = {}
+
+    #ObjectID with one more selection, requiring a list of cuts given either by name or as new expressions
+    #  ex: muonID.withSelection('tight', ['pt > 30', 'eta2p4'])
+    #  the result is memoized, so the loop of a given definition is only compiled once
+    def withSelection(self, name, cuts):
+        key = (name, tuple(cuts))
+        if not key in self._derived:
+            newCuts = dict(self.cuts)
+            require = []
+            for i, cut in enumerate(cuts):
+                if not cut in self.cuts:
+                    newCuts[f'{name}{i}'] = cut
+                    cut = f'{name}{i}'
+                require.append(cut)
+            selections = dict(self.selections)
+            selections[name] = {'require': require}
+            self._derived[key] = ObjectID(newCuts, selections)
+        return self._derived[key]
+
+    #generate the source of the loop evaluating every cut, and compile it (cached on disk, see utils/jit.py)
+    def _compile(self):
+        arguments = [f'c_{name}' for name in self.columns]
+
+        def column(match):
+            return match.group(0) if match.group(0) in _reserved else f'c_{match.group(0)}[i]'
+
+        lines = ["from numba import prange",
+                 f"def kernel({', '.join(arguments)}, out):",
+                 "    for i in prange(out.size):",
+                 "        mask = 0"]
+        for name, expression in self.cuts.items():
+            test = _names.sub(column, expression)
+            lines += [f"        if {test}:",
+                      f"            mask |= {self.bits[name]}"]
+        lines += ["        out[i] = mask"]
+
+        self._kernel = compileSource('\n'.join(lines) + '\n', parallel=True)
+
+    #packed bitmask of every object of a JaggedCandidateArray
+    #  columns which are not part of the collection (like the results of delta R cleaning) are passed as keyword arguments
+    def bitmask(self, candidates, **columns):
+        if self._kernel is None:
+            self._compile()
+
+        arrays = []
+        for name in self.columns:
+            array = columns[name] if name in columns else getattr(candidates, name)
+            arrays.append(np.ascontiguousarray(array.flatten()))
+
+        out = np.zeros(candidates.counts.sum(), dtype=np.uint64)
+        self._kernel(*arrays, out)
+        return JaggedArray.fromcounts(candidates.counts, out)
+
+    def _mask(self, cuts):
+        mask = 0
+        for name in cuts:
+            mask |= self.bits[name]
+        return np.uint64(mask)
+
+    #objects passing a selection, as a jagged boolean array from the bitmask
+    def passes(self, bitmask, selection):
+        definition = self.selections[selection]
+        required = self._mask(definition.get('require', []))
+        failed = self._mask(definition.get('fail', []))
+
+        content = bitmask.content
+        result = (content & (required | failed)) == required
+        for other in definition.get('exclude', []):
+            result &= ~self.passes(bitmask, other).content
+        return bitmask.copy(content=result)
+
+
+#the loose selections exclude the tight ones, so they can only be evaluated once the tight selection has been added
+muonID = ObjectID(
+    cuts = {'pt15'    : 'pt > 15',
+            'eta2p4'  : 'abs(eta) < 2.4',
+            'looseId' : 'isPFcand and (isTracker or isGlobal)',
+            'iso0p25' : 'relIso < 0.25',
+           },
+    selections = {'loose' : {'require' : ['pt15', 'eta2p4', 'looseId', 'iso0p25'], 'exclude' : ['tight']},
+                 },
+)
+
+electronID = ObjectID(
+    cuts = {'pt15'     : 'pt > 15',
+            'eta2p4'   : 'abs(eta) < 2.4',
+            'vetoId'   : 'cutBased >= 1',
+            'etaGap'   : 'abs(eta) < 1.4442 or abs(eta) > 1.566',
+            'd0'       : '(abs(eta) < 1.479 and abs(d0) < 0.05) or (abs(eta) > 1.479 and abs(d0) < 0.1)',
+            'dz'       : '(abs(eta) < 1.479 and abs(dz) < 0.1) or (abs(eta) > 1.479 and abs(dz) < 0.2)',
+           },
+    selections = {'loose' : {'require' : ['pt15', 'eta2p4', 'vetoId', 'etaGap', 'd0', 'dz'], 'exclude' : ['tight']},
+                 },
+)
+
+#photon VID cuts are 2 bits each in vidNestedWPBitmap, a value >= 2 passes the medium working point
+_photonSelect = ['pt20', 'eta1p4442', 'ecal', 'eleVeto', 'noPixelSeed', 'dRmu', 'dRele']
+_photonVIDNoChIso = ['vidMinPt', 'vidSCEta', 'vidHoverE', 'vidSieie', 'vidNeuIso', 'vidPhoIso']
+
+photonID = ObjectID(
+    cuts = {'pt20'        : 'pt > 20',
+            'eta1p4442'   : 'abs(eta) < 1.4442',
+            'ecal'        : 'isEE or isEB',
+            'eleVeto'     : 'passEleVeto',
+            'noPixelSeed' : 'not pixelSeed',
+            'dRmu'        : 'dRphomu',
+            'dRele'       : 'dRphoele',
+            'mediumId'    : 'photonId >= 2',
+            'vidMinPt'    : '(vidCuts >> 0 & 3) >= 2',
+            'vidSCEta'    : '(vidCuts >> 2 & 3) >= 2',
+            'vidHoverE'   : '(vidCuts >> 4 & 3) >= 2',
+            'vidSieie'    : '(vidCuts >> 6 & 3) >= 2',
+            'vidChIso'    : '(vidCuts >> 8 & 3) >= 2',
+            'vidNeuIso'   : '(vidCuts >> 10 & 3) >= 2',
+            'vidPhoIso'   : '(vidCuts >> 12 & 3) >= 2',
+           },
+    selections = {'select'        : {'require' : _photonSelect},
+                  'tight'         : {'require' : _photonSelect + ['mediumId']},
+                  'looseNoChIso'  : {'require' : _photonSelect + _photonVIDNoChIso},
+                  'chIsoSideband' : {'require' : _photonSelect + _photonVIDNoChIso, 'fail' : ['vidChIso']},
+                 },
+)
+
+#the delta R cleaning cuts take the results of the cleaning, passed as the dRjetmu, dRjetele and dRjetpho columns
+jetID = ObjectID(
+    cuts = {'jetId'     : '(jetId >> 1 & 1) == 1',
+            'dRmu'      : 'dRjetmu',
+            'dRele'     : 'dRjetele',
+            'dRpho'     : 'dRjetpho',
+           },
+    selections = {},
+)
@@ -0,0 +1,157 @@
+import time
+import tracemalloc
+
+import numpy as np
+from awkward import JaggedArray, Table, ObjectArray
+from coffea import hist, processor
+
+#floating point types of the precision policies of the processor
+#  float32: input columns are kept as they are read (NanoAOD floats are float32), and derived kinematics, scale factors
+#           and weights are computed and stored in float32
+#  float64: input columns are passed through as they are read, and derived kinematics, scale factors and weights are computed
+#           in float64 (numpy's default), this is the default, as the processor always did, and the reference used for validation
+#  in both cases the histograms accumulate the (float32 or float64) weights in float64, since coffea fills with np.bincount
+precisionTypes = {'float32' : np.float32,
+                  'float64' : np.float64,
+                 }
+
+
+#cast the floating point content of a numpy array, jagged array, table or object array (like p4) to dtype, other types are returned unchanged
+def castFloat(array, dtype):
+    if isinstance(array, JaggedArray):
+        return array.copy(content=castFloat(array.content, dtype))
+    if isinstance(array, ObjectArray):
+        array._content = castFloat(array._content, dtype)
+        return array
+    if isinstance(array, Table):
+        for name in array._contents:
+            array._contents[name] = castFloat(array._contents[name], dtype)
+        return array
+    if isinstance(array, np.ndarray) and array.dtype.kind == 'f' and array.dtype != dtype:
+        return array.astype(dtype)
+    return array
+
+
+#cast (in place) every floating point column of a JaggedCandidateArray, including its p4
+#  used after steps which compute new columns in float64, like the jet energy corrections
+def castCandidates(candidates, dtype):
+    contents = candidates._content._contents
+    for name in contents:
+        contents[name] = castFloat(contents[name], dtype)
+
+
+#dataframe view applying the precision policy to the columns read from the input dataframe
+class PrecisionDataFrame:
+    def __init__(self, df, dtype):
+        self._df = df
+        self._dtype = dtype
+        self._columns = {}
+
+    def __getitem__(self, key):
+        if not key in self._columns:
+            self._columns[key] = castFloat(self._df[key], self._dtype)
+        return self._columns[key]
+
+    def __setitem__(self, key, value):
+        self._columns[key] = value
+
+    def __contains__(self, key):
+        return key in self._columns or key in self._df
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        return getattr(self._df, key)
+
+
+#processor.Weights keeping the event weights and their variations in dtype
+class Weights(processor.Weights):
+    def __init__(self, size, storeIndividual=False, dtype=np.float64):
+        super().__init__(size, storeIndividual)
+        self._dtype = dtype
+        self._weight = np.ones(size, dtype=dtype)
+
+    def add(self, name, weight, weightUp=None, weightDown=None, shift=False):
+        weight = np.asarray(weight, dtype=self._dtype)
+        if not weightUp is None:
+            weightUp = np.array(weightUp, dtype=self._dtype)
+        if not weightDown is None:
+            weightDown = np.array(weightDown, dtype=self._dtype)
+        super().add(name, weight, weightUp, weightDown, shift)
+
+
+#compare the histograms of two processor outputs, bin by bin
+#  for each histogram, returns the relative difference of the total yield, the largest bin difference in units of the
+#  statistical uncertainty of the reference, and the fraction of bins which differ
+def compareOutputs(reference, test):
+    comparison = {}
+    for name, hRef in reference.items():
+        if not isinstance(hRef, hist.Hist):
+            continue
+        hTest = test[name]
+
+        valuesRef = hRef.values(sumw2=True, overflow='all')
+        valuesTest = hTest.values(sumw2=True, overflow='all')
+
+        sumRef, sumTest, maxPull, nDiff, nBins = 0., 0., 0., 0, 0
+        for key, (sumw, sumw2) in valuesRef.items():
+            sumwTest = valuesTest.get(key, (np.zeros_like(sumw),))[0]
+            diff = np.abs(sumwTest - sumw)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pull = np.where(sumw2 > 0, diff/np.sqrt(sumw2), np.where(diff > 0, np.inf, 0.))
+            sumRef += sumw.sum()
+            sumTest += sumwTest.sum()
+            maxPull = max(maxPull, pull.max(initial=0.))
+            nDiff += (diff > 1e-6*np.abs(sumw)).sum()
+            nBins += sumw.size
+
+        comparison[name] = {'yieldRelDiff' : (sumTest - sumRef)/sumRef if sumRef != 0 else 0.,
+                            'maxPull'      : maxPull,
+                            'fracBinsDiff' : nDiff/nBins if nBins > 0 else 0.,
+                           }
+    return comparison
+
+
+#peak memory allocated while processing one chunk, and the processing time
+def chunkMemory(processor_instance, df):
+    tracemalloc.start()
+    tic = time.time()
+    processor_instance.process(df)
+    elapsed = time.time() - tic
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+#validation of the float32 policy against the float64 reference (the processor without any cast of the input columns)
+#  processorFactory(precision) returns a processor using that precision policy, both are run over the same chunks
+#  returns the histogram comparison and the peak memory and time to process the first chunk with each policy
+def validatePrecision(processorFactory, fileset, treename='Events', chunksize=50000, maxchunks=1, flatten=True):
+    import uproot4
+    from coffea.processor import LazyDataFrame
+
+    outputs = {}
+    memory = {}
+    for precision in ['float64', 'float32']:
+        outputs[precision] = processor.run_uproot_job(fileset,
+                                                      treename=treename,
+                                                      processor_instance=processorFactory(precision),
+                                                      executor=processor.iterative_executor,
+                                                      executor_args={'flatten': flatten, 'status': False},
+                                                      chunksize=chunksize,
+                                                      maxchunks=maxchunks,
+                                                     )
+
+        dataset, files = next(iter(fileset.items()))
+        with uproot4.open(files[0]) as f:
+            df = LazyDataFrame(f[treename], 0, chunksize, flatten=flatten)
+            df['dataset'] = dataset
+            memory[precision] = chunkMemory(processorFactory(precision), df)
+
+    comparison = compareOutputs(outputs['float64'], outputs['float32'])
+    for name, c in comparison.items():
+        print(f"{name:30s} yield {c['yieldRelDiff']:+.2e}  max pull {c['maxPull']:.3f}  bins differing {100*c['fracBinsDiff']:.2f}%")
+    for precision, (peak, elapsed) in memory.items():
+        print(f"{precision}: peak chunk memory {peak/1024**2:.1f} MB, {elapsed:.2f} s")
+
+    return comparison, memory
@@ -0,0 +1,270 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import uproot4
+from coffea.processor import LazyDataFrame
+from tqdm import tqdm
+
+from .jit import warmUp
+from .faultTolerance import readError, errorMessage
+
+
+#byte budget shared between the reader threads and the processing loop
+#  a read is only started once the bytes held by chunks in flight leave room for it (a single chunk is always allowed)
+class _MemoryBudget:
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.used = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._condition:
+            while not self.closed and self.used > 0 and self.used + nbytes > self.maxBytes:
+                self._condition.wait()
+            self.used += nbytes
+
+    def adjust(self, nbytes):
+        with self._condition:
+            self.used += nbytes
+            self._condition.notify_all()
+
+    def release(self, nbytes):
+        self.adjust(-nbytes)
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+def _nbytes(array):
+    if hasattr(array, 'content'):
+        return _nbytes(array.content) + array.starts.nbytes + array.stops.nbytes
+    return getattr(array, 'nbytes', 0)
+
+
+#split every file of the fileset into (dataset, filename, entrystart, entrystop) chunks
+#  also returns the largest uncompressed size of a chunk, from the basket sizes of the branches to prefetch (of all the branches if
+#  they are not known yet), used as the size of a chunk until the first one has been read
+def _chunks(fileset, treename, chunksize, maxchunks, branches, pool):
+    items = [(dataset, filename) for dataset, files in fileset.items() for filename in files]
+
+    def numEntries(item):
+        with uproot4.open(item[1]) as f:
+            tree = f[treename]
+            names = [name for name in branches.get(item[0], tree.keys()) if name in tree]
+            nbytes = sum(tree[name].uncompressed_bytes for name in names)
+            return tree.num_entries, nbytes/max(1, tree.num_entries)
+
+    chunks = []
+    nChunks = {}
+    chunkBytes = 0
+    for (dataset, filename), (nEntries, entryBytes) in zip(items, pool.map(numEntries, items)):
+        chunkBytes = max(chunkBytes, int(entryBytes*min(chunksize, nEntries)))
+        for start in range(0, nEntries, chunksize):
+            if not maxchunks is None and nChunks.get(dataset, 0) >= maxchunks:
+                break
+            chunks.append((dataset, filename, start, min(start + chunksize, nEntries)))
+            nChunks[dataset] = nChunks.get(dataset, 0) + 1
+    return chunks, chunkBytes
+
+
+#open a chunk and read (and decompress) the requested branches, run in a background thread
+#  branches which are not prefetched are still read lazily when the processor asks for them
+def _readChunk(chunk, treename, branches, flatten, readLatency):
+    dataset, filename, start, stop = chunk
+    if readLatency > 0:
+        time.sleep(readLatency)
+
+    file = uproot4.open(filename)
+    try:
+        df = LazyDataFrame(file[treename], start, stop, flatten=flatten)
+        for branch in branches.get(dataset, ()):
+            if branch in df:
+                _ = df[branch]
+    except Exception:
+        file.close()
+        raise
+    df['dataset'] = dataset
+    df['filename'] = filename
+    df['treename'] = treename
+    df['entrystart'] = start
+    df['entrystop'] = stop
+    df['fileuuid'] = str(file.file.uuid)
+
+    nbytes = sum(_nbytes(df[branch]) for branch in df.materialized)
+    return file, df, nbytes
+
+
+#run a processor over a fileset in a single process, overlapping I/O with computation
+#  while one chunk is processed, up to `prefetch` following chunks are read and decompressed by `readThreads` background threads,
+#  holding at most maxMemory bytes of prefetched branches at a time
+#  the branches to prefetch are learned from the first chunk of each dataset (the branches the processor materialized),
+#  or can be given explicitly as a list or a {dataset: list} mapping
+#  readLatency injects an artificial delay (seconds) before every chunk read, to emulate remote reads with local files
+#  with prefetch=0 every chunk is read and processed serially in the main thread, as a reference
+#  with isolate, a chunk which can not be read (see utils/faultTolerance.py) is read and processed again serially up to retries times,
+#  with an exponential backoff starting at backoff seconds, and if it still fails it is recorded in output['failedChunks']
+#  instead of stopping the job
+def run_prefetch_job(fileset, treename, processor_instance, chunksize=50000, maxchunks=None,
+                     prefetch=4, readThreads=2, maxMemory=2*1024**3, branches=None, flatten=True,
+                     readLatency=0., status=True, savemetrics=False, isolate=False, retries=2, backoff=5.):
+    output = processor_instance.accumulator.identity()
+    metrics = {'readwait': 0., 'processtime': 0., 'chunks': 0, 'entries': 0, 'bytes': 0}
+
+    #compile the numba kernels before the first chunk, while nothing is read yet
+    metrics['warmup'] = warmUp()
+
+    if branches is None:
+        branches = {}
+    elif not isinstance(branches, dict):
+        branches = {dataset: list(branches) for dataset in fileset}
+    learnBranches = {dataset: not dataset in branches for dataset in fileset}
+
+    with ThreadPoolExecutor(max_workers=max(1, readThreads)) as pool:
+        chunks, chunkBytes = _chunks(fileset, treename, chunksize, maxchunks, branches, pool)
+
+        budget = _MemoryBudget(maxMemory)
+        inFlight = queue.Queue(maxsize=max(1, prefetch))
+        estimate = {'nbytes': chunkBytes, 'measured': False}
+        stop = threading.Event()
+
+        #the budget is reserved in chunk order by the scheduler (so a later chunk can never starve the one being waited for),
+        #  using the largest chunk seen so far as estimate (the size from the baskets until a chunk has been read),
+        #  and corrected once the chunk has actually been read
+        def measured(nbytes):
+            estimate['nbytes'] = max(estimate['nbytes'], nbytes) if estimate['measured'] else nbytes
+            estimate['measured'] = True
+
+        def read(chunk, reserved):
+            try:
+                result = _readChunk(chunk, treename, branches, flatten, readLatency)
+            except Exception:
+                budget.release(reserved)
+                raise
+            budget.adjust(result[2] - reserved)
+            measured(result[2])
+            return result
+
+        #the first chunk of a dataset whose branches are not known yet is read lazily in the main thread,
+        #  the following chunks of that dataset are only scheduled once its branch list has been learned
+        learned = {dataset: threading.Event() for dataset in fileset}
+        for dataset in fileset:
+            if not learnBranches[dataset]:
+                learned[dataset].set()
+
+        def schedule():
+            firstSeen = set()
+            for chunk in chunks:
+                dataset = chunk[0]
+                if learnBranches[dataset] and not dataset in firstSeen:
+                    firstSeen.add(dataset)
+                    inFlight.put((chunk, None))
+                    continue
+                while not learned[dataset].wait(0.1):
+                    if stop.is_set():
+                        return
+                if prefetch > 0:
+                    reserved = estimate['nbytes']
+                    budget.acquire(reserved)
+                if stop.is_set():
+                    return
+                inFlight.put((chunk, pool.submit(read, chunk, reserved) if prefetch > 0 else None))
+            inFlight.put(None)
+
+        scheduler = threading.Thread(target=schedule, daemon=True)
+        scheduler.start()
+
+        #returns the dataframe of the chunk, the bytes read and the time at which the read was done
+        def processChunk(chunk, future):
+            if future is None:
+                file, df, nbytes = _readChunk(chunk, treename, branches, flatten, readLatency)
+                budget.adjust(nbytes)
+                measured(nbytes)
+            else:
+                file, df, nbytes = future.result()
+            toc = time.time()
+
+            try:
+                output.add(processor_instance.process(df))
+            finally:
+                file.close()
+                budget.release(nbytes)
+            return df, nbytes, toc
+
+        #read and process again a chunk which failed with a read error, any other error is raised
+        #  returns None for the chunk if it still fails, and records it in the output
+        def retryChunk(chunk, exception):
+            for attempt in range(retries + 1):
+                if readError(exception) is None:
+                    raise exception
+                if attempt == retries:
+                    break
+                time.sleep(backoff*2**attempt)
+                try:
+                    return processChunk(chunk, None)
+                except Exception as e:
+                    exception = e
+            output['failedChunks'].add(chunk + (errorMessage(readError(exception)),))
+            return None, 0, time.time()
+
+        try:
+            for _ in tqdm(range(len(chunks)), disable=not status, unit='chunk', desc='Processing'):
+                tic = time.time()
+                chunk, future = inFlight.get()
+                try:
+                    df, nbytes, toc = processChunk(chunk, future)
+                except Exception as e:
+                    if not isolate:
+                        raise
+                    df, nbytes, toc = retryChunk(chunk, e)
+
+                #(if the first chunk of a dataset failed, the next ones are read lazily)
+                dataset = chunk[0]
+                if not learned[dataset].is_set():
+                    branches[dataset] = [] if df is None else sorted(df.materialized)
+                    learned[dataset].set()
+
+                metrics['readwait'] += toc - tic
+                metrics['processtime'] += time.time() - toc
+                metrics['chunks'] += 1
+                metrics['entries'] += 0 if df is None else df.size
+                metrics['bytes'] += nbytes
+        finally:
+            stop.set()
+            budget.close()
+            #unblock the scheduler if it is waiting on a full queue, and drop the chunks already prefetched
+            pending = []
+            while scheduler.is_alive() or not inFlight.empty():
+                try:
+                    item = inFlight.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if not item is None and not item[1] is None and not item[1].cancel():
+                    pending.append(item[1])
+            for future in pending:
+                if future.exception() is None:
+                    future.result()[0].close()
+
+    processor_instance.postprocess(output)
+
+    if savemetrics:
+        return output, metrics
+    return output
+
+
+#compare the serial and the prefetching loop on the same (local) fileset, with an injected per-chunk read latency
+#  returns {prefetch: (wall time, metrics)} for each prefetch depth
+def benchmarkPrefetch(fileset, treename, processor_instance, prefetchDepths=(0, 2, 4), readLatency=0.5, **kwargs):
+    results = {}
+    for prefetch in prefetchDepths:
+        tic = time.time()
+        _, metrics = run_prefetch_job(fileset, treename, processor_instance, prefetch=prefetch,
+                                      readLatency=readLatency, savemetrics=True, status=False, **kwargs)
+        results[prefetch] = (time.time() - tic, metrics)
+        print(f"prefetch={prefetch}: {results[prefetch][0]:.1f} s total, {metrics['readwait']:.1f} s waiting for reads, "
+              f"{metrics['processtime']:.1f} s processing, {metrics['chunks']} chunks")
+    return results
@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import uproot4
+
+#ROOT compression algorithm ids, the compression setting of a file is 100*algorithm + level
+codecs = {'ZLIB' : 1,
+          'LZMA' : 2,
+          'LZ4'  : 4,
+          'ZSTD' : 5,
+         }
+
+
+#branches read by the analysis (TTGammaProcessor with the exercise filled in, and the utils it calls), for each type of file
+#  data files get the common branches, MC files the MC branches as well (counters of the jagged branches are added when writing)
+#  a branch the processor starts reading must be added here, or the skims have to be written again (see checkBranches)
+skimBranches = {'common' : ['run', 'luminosityBlock', 'event', 'fixedGridRhoFastjetAll',
+                            'HLT_IsoMu24', 'HLT_IsoTkMu24', 'HLT_Ele27_WPTight_Gsf',
+                            'Muon_pt', 'Muon_eta', 'Muon_phi', 'Muon_mass', 'Muon_charge', 'Muon_tightId',
+                            'Muon_isGlobal', 'Muon_isTracker', 'Muon_isPFcand', 'Muon_pfRelIso04_all',
+                            'Electron_pt', 'Electron_eta', 'Electron_phi', 'Electron_mass', 'Electron_charge',
+                            'Electron_cutBased', 'Electron_dxy', 'Electron_dz',
+                            'Photon_pt', 'Photon_eta', 'Photon_phi', 'Photon_cutBased', 'Photon_electronVeto', 'Photon_pixelSeed',
+                            'Photon_isScEtaEB', 'Photon_isScEtaEE', 'Photon_pfRelIso03_chg', 'Photon_sieie', 'Photon_vidNestedWPBitmap',
+                            'Jet_pt', 'Jet_eta', 'Jet_phi', 'Jet_mass', 'Jet_jetId', 'Jet_btagDeepB', 'Jet_area', 'Jet_rawFactor',
+                           ],
+                'MC'     : ['Generator_weight', 'LHEWeight_originalXWGTUP', 'Pileup_nTrueInt',
+                            'LHEPdfWeight', 'LHEScaleWeight', 'PSWeight',
+                            'GenPart_pt', 'GenPart_eta', 'GenPart_phi', 'GenPart_mass', 'GenPart_pdgId', 'GenPart_status',
+                            'GenPart_statusFlags', 'GenPart_genPartIdxMother',
+                            'GenJet_pt', 'GenJet_eta', 'GenJet_phi', 'GenJet_mass',
+                            'Jet_hadronFlavour', 'Jet_genJetIdx', 'Photon_genPartIdx', 'Photon_genPartFlav',
+                           ],
+               }
+
+
+#branches to keep in a file, by type: a file with generator level branches is MC
+#  branches missing from the file are left out (ex: samples without LHE weights)
+def fileBranches(fileName, treename='Events'):
+    with uproot4.open(fileName) as f:
+        available = set(f[treename].keys())
+    names = skimBranches['common'] + (skimBranches['MC'] if 'Generator_weight' in available else [])
+    return [name for name in names if name in available]
+
+
+#branches read by a processor, found by running it over the first entries of a file and collecting the branches it materialized
+def processorBranches(fileName, processor_instance, treename='Events', entries=10000):
+    from coffea.processor import LazyDataFrame
+
+    with uproot4.open(fileName) as f:
+        df = LazyDataFrame(f[treename], 0, entries, flatten=True)
+        df['dataset'] = os.path.basename(fileName).split('_skim')[0]
+        df['filename'] = fileName
+        df['treename'] = treename
+        df['entrystart'] = 0
+        df['entrystop'] = df.size
+        processor_instance.process(df)
+
+        return sorted(df.materialized)
+
+
+#branches a processor read on the first entries of each file, which are not kept in the skims of that file
+#  (branches read only for some events can still be missed, this is a check, not a way to build the list)
+def checkBranches(fileNames, processor_instance, treename='Events', entries=10000):
+    missing = set()
+    for fileName in fileNames:
+        with uproot4.open(fileName) as f:
+            available = set(f[treename].keys())
+        kept = fileBranches(fileName, treename)
+        #the counters of the kept jagged branches are written as well
+        kept += [f"n{name.split('_')[0]}" for name in kept]
+        missing.update(name for name in processorBranches(fileName, processor_instance, treename, entries)
+                       if name in available and not name in kept)
+    return sorted(missing)
+
+
+#number of entries per cluster, reduced so that the clusters tile the processing chunks exactly
+def basketEntriesForChunk(basketEntries, chunksize):
+    return chunksize // int(np.ceil(chunksize/basketEntries))
+
+
+#rewrite the tree of a skim keeping only a list of branches (and the counters of the jagged ones), with a chosen compression codec and level
+#  clusters hold basketEntries entries (if chunksize is given, adjusted so that processing chunks never split a cluster),
+#  and every branch buffer is basketSize bytes
+#  written with PyROOT, since the uproot3 writer cannot write LZ4 compressed jagged branches that can be read back
+def recompressFile(inputFile, outputFile, branches=None, treename='Events', codec='LZ4', level=4, basketEntries=50000, chunksize=None, basketSize=256*1024):
+    import ROOT
+
+    if not chunksize is None:
+        basketEntries = basketEntriesForChunk(basketEntries, chunksize)
+
+    inFile = ROOT.TFile.Open(inputFile)
+    tree = inFile.Get(treename)
+
+    if not branches is None:
+        keep = set(branches)
+        for name in branches:
+            leafCount = tree.GetBranch(name).GetListOfLeaves().At(0).GetLeafCount()
+            if leafCount:
+                keep.add(leafCount.GetName())
+        tree.SetBranchStatus('*', 0)
+        for name in keep:
+            tree.SetBranchStatus(name, 1)
+
+    outFile = ROOT.TFile(outputFile, 'RECREATE', '', 100*codecs[codec] + level)
+    newTree = tree.CloneTree(0)
+    newTree.SetAutoFlush(basketEntries)
+    newTree.SetBasketSize('*', basketSize)
+    newTree.CopyEntries(tree)
+    newTree.Write()
+
+    outFile.Close()
+    inFile.Close()
+
+    return outputFile
+
+
+#time reading (and decompressing) a list of branches of a file (all of them by default), returns (uncompressed bytes, seconds)
+def readThroughput(fileName, branches=None, treename='Events', repeat=3):
+    times = []
+    with uproot4.open(fileName) as f:
+        tree = f[treename]
+        if branches is None:
+            branches = tree.keys()
+        nbytes = sum(tree[name].uncompressed_bytes for name in branches)
+        for i in range(repeat):
+            tic = time.time()
+            tree.arrays(branches,
+                        decompression_executor=uproot4.source.futures.TrivialExecutor(),
+                        interpretation_executor=uproot4.source.futures.TrivialExecutor())
+            times.append(time.time() - tic)
+    return nbytes, min(times)
+
+
+#recompress local sample files with each configuration (codec, level, basketEntries) and report file size and decompression throughput
+#  the input files themselves are the first row, read with the same branches
+def benchmark(inputFiles, configs, branches=None, treename='Events', workDir='recompressBenchmark', chunksize=None, repeat=3, basketSize=256*1024):
+    os.makedirs(workDir, exist_ok=True)
+
+    results = []
+    for codec, level, basketEntries in [(None, None, None)] + list(configs):
+        size, nbytes, seconds = 0, 0, 0.
+        for inputFile in inputFiles:
+            if codec is None:
+                fileName = inputFile
+            else:
+                fileName = os.path.join(workDir, f"{codec}{level}_{basketEntries}_{os.path.basename(inputFile)}")
+                recompressFile(inputFile, fileName, branches, treename, codec, level, basketEntries, chunksize, basketSize)
+            size += os.path.getsize(fileName)
+            n, t = readThroughput(fileName, branches, treename, repeat)
+            nbytes += n
+            seconds += t
+
+        results.append({'codec': codec or 'input', 'level': level, 'basketEntries': basketEntries,
+                        'size': size, 'uncompressed': nbytes, 'seconds': seconds, 'throughput': nbytes/seconds/1024**2})
+        print(f"{results[-1]['codec']:>6} {str(level):>5} {str(basketEntries):>8}: "
+              f"{size/1024**2:8.1f} MB  {nbytes/1024**2:8.1f} MB uncompressed  {results[-1]['throughput']:8.1f} MB/s")
+
+    return results
+
+
+def _parseConfig(config):
+    codec, level, basketEntries = config.split(':')
+    return codec.upper(), int(level), int(basketEntries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rewrite skims with only the branches the analysis reads, and a chosen compression and basket layout")
+    parser.add_argument('inputs', nargs='+', help="input skim files")
+    parser.add_argument('-o', '--outputDir', default='recompressed')
+    parser.add_argument('--treename', default='Events')
+    parser.add_argument('--codec', default='LZ4', choices=sorted(codecs))
+    parser.add_argument('--level', type=int, default=4)
+    parser.add_argument('--basketEntries', type=int, default=50000)
+    parser.add_argument('--basketSize', type=int, default=256*1024, help="buffer size of each branch, in bytes")
+    parser.add_argument('--chunksize', type=int, default=50000, help="chunk size used when processing, baskets are aligned to it")
+    parser.add_argument('--allBranches', action='store_true', help="keep every branch instead of the ones read by the analysis (skimBranches)")
+    parser.add_argument('--checkBranches', action='store_true', help="only list the branches TTGammaProcessor reads on the inputs which are not kept")
+    parser.add_argument('--benchmark', nargs='*', metavar='CODEC:LEVEL:BASKETENTRIES',
+                        help="compare configurations on the input files instead of converting them, e.g. LZ4:4:50000 ZLIB:1:50000")
+    args = parser.parse_args()
+
+    if args.checkBranches:
+        from ttgamma import TTGammaProcessor
+        missing = checkBranches(args.inputs, TTGammaProcessor(), args.treename)
+        print(f"Branches read by the processor which are not kept: {', '.join(missing) if len(missing) > 0 else 'none'}")
+        sys.exit(1 if len(missing) > 0 else 0)
+
+    if not args.benchmark is None:
+        configs = [_parseConfig(c) for c in args.benchmark] or [('LZ4', 4, args.basketEntries), ('ZLIB', 1, args.basketEntries), ('LZMA', 4, args.basketEntries)]
+        branches = None if args.allBranches else fileBranches(args.inputs[0], args.treename)
+        benchmark(args.inputs, configs, branches, args.treename, args.outputDir, args.chunksize, basketSize=args.basketSize)
+        sys.exit(0)
+
+    os.makedirs(args.outputDir, exist_ok=True)
+    for inputFile in args.inputs:
+        outputFile = os.path.join(args.outputDir, os.path.basename(inputFile))
+        branches = None if args.allBranches else fileBranches(inputFile, args.treename)
+        recompressFile(inputFile, outputFile, branches, args.treename, args.codec, args.level, args.basketEntries, args.chunksize, args.basketSize)
+        print(f"{inputFile}: {os.path.getsize(inputFile)/1024**2:.1f} MB -> {os.path.getsize(outputFile)/1024**2:.1f} MB")
@@ -0,0 +1,75 @@
+import numpy as np
+import coffea.processor as processor
+
+
+#PackedSelection with memoized combinations of cuts, aware of which cuts change with a systematic variation
+#  cuts are added as with PackedSelection; cuts which change with a systematic (like the jet selections with the jet energy
+#  variations) can also be added for that systematic, add(name, mask, syst='JESUp')
+#  all(*names, syst=...) returns the combination for that systematic, memoized by the set of cuts and by the systematic only
+#  if one of the cuts has a variation for it: weight-only systematics reuse the nominal masks, and systematics varying
+#  some cuts reuse the memoized combination of the other cuts and only combine the varied ones
+#  mask is an optional selection required by every combination (like the certified luminosity sections for data)
+#  the memoized masks are returned to every caller, so they are read-only: an in-place change (mask &= other) raises
+class SelectionCache:
+    def __init__(self, mask=None):
+        self._selection = processor.PackedSelection()
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self._variations = {}
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def names(self):
+        return self._selection.names
+
+    def add(self, name, selection, syst=None):
+        if syst is None:
+            self._selection.add(name, selection)
+        else:
+            self._variations[(name, syst)] = np.asarray(selection, dtype=bool)
+        #a new cut invalidates only the combinations using it
+        self._cache = {key: mask for key, mask in self._cache.items() if not name in key[0]}
+
+    def all(self, *names, syst=None):
+        varied = [name for name in names if (name, syst) in self._variations]
+        key = (frozenset(names), syst if len(varied) > 0 else None)
+
+        if key in self._cache:
+            self.hits += 1
+            return self._cache[key]
+        self.misses += 1
+
+        if len(varied) > 0:
+            mask = self.all(*[name for name in names if not name in varied]).copy()
+            for name in varied:
+                mask &= self._variations[(name, syst)]
+        else:
+            mask = self._selection.all(*names)
+            if not self._mask is None:
+                mask = mask & self._mask
+
+        mask.flags.writeable = False
+        self._cache[key] = mask
+        return mask
+
+    def require(self, syst=None, **names):
+        mask = self.all(*[name for name, value in names.items() if value], syst=syst)
+        for name, value in names.items():
+            if not value:
+                varied = (name, syst) in self._variations
+                mask = mask & ~(self._variations[(name, syst)] if varied else self._selection.all(name))
+        return mask
+
+    #add the hit and miss counts to an accumulator, like a defaultdict_accumulator(int) in the processor output
+    def report(self, accumulator):
+        accumulator['hits'] += self.hits
+        accumulator['misses'] += self.misses
+        return accumulator
+
+
+#fraction of the selection.all() calls answered from the cache, from the counts reported to the processor output
+#  None if selection.all() was never called
+def hitRate(accumulator):
+    calls = accumulator['hits'] + accumulator['misses']
+    return accumulator['hits']/calls if calls > 0 else None
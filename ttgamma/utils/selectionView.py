@@ -0,0 +1,106 @@
+import numpy as np
+from awkward import JaggedArray
+
+
+def _isCompact(array):
+    return array.starts.size == 0 or (array.starts[0] == 0 and (array.starts[1:] == array.stops[:-1]).all())
+
+
+#number of selected objects in each event, and the positions of the selected objects in the flattened mask
+def _selectionCounts(mask):
+    flat = mask.flatten()
+    passed = np.concatenate([[0], np.cumsum(flat)])
+    stops = np.cumsum(mask.counts)
+    return passed[stops] - passed[stops - mask.counts], np.flatnonzero(flat)
+
+
+#selected subset of the objects of a JaggedCandidateArray, stored as the positions of the selected objects in the parent
+#  instead of copying every column (and the cached p4) when applying a selection mask, only the counts and the index are kept,
+#  and a column is gathered from the parent the first time it is used
+#  supports the operations the processor uses on selected collections:
+#    view.counts, view.pt (any column), view['p4'], view[mask] (a further selection with a jagged mask),
+#    view[eventMask] (the events passing a flat boolean mask), view[:, :n] (leading objects)
+#  view.materialize() returns the equivalent JaggedCandidateArray
+class SelectionView:
+    def __init__(self, parent, mask=None, counts=None, index=None):
+        if isinstance(parent, SelectionView):
+            if not mask is None:
+                counts, selected = _selectionCounts(mask)
+                index = parent._index[selected]
+            else:
+                index = parent._index[index]
+            parent = parent._parent
+        elif not mask is None:
+            counts, selected = _selectionCounts(mask)
+            #position of every selected object in the content of the parent columns
+            if _isCompact(parent):
+                index = selected
+            else:
+                index = selected + np.repeat(parent.starts - (np.cumsum(parent.counts) - parent.counts), parent.counts)[selected]
+
+        self._parent = parent
+        self._counts = counts
+        self._index = index
+        self._columns = {}
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def size(self):
+        return self._counts.size
+
+    def __len__(self):
+        return self._counts.size
+
+    @property
+    def starts(self):
+        return np.cumsum(self._counts) - self._counts
+
+    @property
+    def stops(self):
+        return np.cumsum(self._counts)
+
+    @property
+    def columns(self):
+        return self._parent.columns
+
+    def _column(self, name):
+        if not name in self._columns:
+            column = self._parent[name] if name in self._parent.columns else getattr(self._parent, name)
+            self._columns[name] = column.__class__.fromcounts(self._counts, column.content[self._index])
+        return self._columns[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._column(name)
+        except (KeyError, ValueError):
+            raise AttributeError(name)
+
+    def __getitem__(self, where):
+        if isinstance(where, str):
+            return self._column(where)
+
+        #leading objects, view[:, :n]
+        if isinstance(where, tuple) and len(where) == 2 and where[0] == slice(None):
+            n = where[1].stop
+            if not isinstance(where[1], slice) or not where[1].start in [None, 0] or not where[1].step in [None, 1] or n is None:
+                raise NotImplementedError(f'{where} is not supported by SelectionView')
+            local = np.arange(self._index.size) - np.repeat(self.starts, self._counts)
+            return SelectionView(self._parent, counts=np.minimum(self._counts, n), index=self._index[local < n])
+
+        #further selection with a jagged mask of the view
+        if isinstance(where, JaggedArray):
+            return SelectionView(self, mask=where)
+
+        #selection of events with a flat boolean mask, keeping the selected objects of the events passing it
+        if isinstance(where, np.ndarray) and where.dtype == bool and where.shape == self._counts.shape:
+            return SelectionView(self._parent, counts=self._counts[where], index=self._index[np.repeat(where, self._counts)])
+
+        raise NotImplementedError(f'{where} is not supported by SelectionView')
+
+    def materialize(self):
+        return self._parent.__class__.fromcounts(self._counts, self._parent.content[self._index])
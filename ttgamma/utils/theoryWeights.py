@@ -0,0 +1,95 @@
+import numpy as np
+from awkward import JaggedArray
+from numba import prange
+
+from .jit import kernel
+
+#names of the theory systematic variations, in the order of the columns computed by theoryKernel
+theoryVariations = ['PDFUp', 'PDFDown', 'Q2ScaleUp', 'Q2ScaleDown', 'ISRUp', 'ISRDown', 'FSRUp', 'FSRDown']
+
+#positions of the 6 scale variations (muR, muF varied by 0.5 or 2, without the anti-correlated ones) in LHEScaleWeight,
+#  for the two conventions of 9 and 44 scale weights
+_scale9 = np.array([0, 1, 3, 5, 7, 8])
+_scale44 = np.array([0, 5, 15, 24, 34, 39])
+
+
+#function to compute the theory weight variations of the selected events, in a single loop over the jagged weight arrays
+#  PDF:     envelope of the LHEPdfWeight normalized to the first (nominal) weight
+#  Q2Scale: envelope of the 6 scale variations of LHEScaleWeight
+#  ISR/FSR: PSWeight (ISRDown, FSRDown, ISRUp, FSRUp), corrected by LHEWeight_originalXWGTUP/Generator_weight
+#  the number of weights can change from event to event, events without the needed weights get variations of 1
+@kernel(*[f'void(int64[::1], {t}[::1], int64[::1], int64[::1], {t}[::1], int64[::1], int64[::1], {t}[::1], int64[::1], int64[::1], {t}[::1], {t}[::1], int64[::1], int64[::1], {t}[:, ::1])'
+          for t in ['float32', 'float64']], parallel=True)
+def theoryKernel(events,
+                 pdf_contents, pdf_starts, pdf_stops,
+                 scale_contents, scale_starts, scale_stops,
+                 ps_contents, ps_starts, ps_stops,
+                 generatorWeight, originalWeight,
+                 scale9, scale44, out):
+    for k in prange(len(events)):
+        i = events[k]
+        for j in range(out.shape[1]):
+            out[k, j] = 1.
+
+        start, stop = pdf_starts[i], pdf_stops[i]
+        if stop > start:
+            nominal = pdf_contents[start]
+            if nominal == 0:
+                nominal = 1.
+            #(the nominal weight itself has a ratio of 1, even when it is 0 and replaced by 1)
+            up, down = 1., 1.
+            for j in range(start + 1, stop):
+                variation = pdf_contents[j]/nominal
+                up = max(up, variation)
+                down = min(down, variation)
+            out[k, 0] = up
+            out[k, 1] = down
+
+        start, stop = scale_starts[i], scale_stops[i]
+        if stop - start == 9 or stop - start == 44:
+            selector = scale9 if stop - start == 9 else scale44
+            up, down = scale_contents[start + selector[0]], scale_contents[start + selector[0]]
+            for j in selector:
+                up = max(up, scale_contents[start + j])
+                down = min(down, scale_contents[start + j])
+            out[k, 2] = up
+            out[k, 3] = down
+
+        start, stop = ps_starts[i], ps_stops[i]
+        if stop - start == 4:
+            ratio = 1.
+            if generatorWeight[i] != 0 and generatorWeight[i] != originalWeight[i]:
+                ratio = originalWeight[i]/generatorWeight[i]
+            out[k, 4] = ps_contents[start + 2]*ratio
+            out[k, 5] = ps_contents[start + 0]*ratio
+            out[k, 6] = ps_contents[start + 3]*ratio
+            out[k, 7] = ps_contents[start + 1]*ratio
+
+
+#contents, starts and stops of a jagged branch, read either as a JaggedArray or flattened with its counter branch
+def _jagged(df, name):
+    array = df[name]
+    if isinstance(array, JaggedArray):
+        return np.ascontiguousarray(array.content), array.starts, array.stops
+    counts = df[f'n{name}']
+    stops = np.cumsum(counts)
+    return np.ascontiguousarray(array.reshape(-1)), stops - counts, stops
+
+
+#theory weight variations for the events passing mask (all events if mask is None), as a dict of arrays over the selected events
+#  raises a KeyError if the sample does not have the generator weights
+def theoryWeights(df, mask=None, dtype=np.float64):
+    events = np.arange(df.size) if mask is None else np.flatnonzero(mask)
+
+    generatorWeight = np.asarray(df['Generator_weight']).reshape(-1)
+    originalWeight = np.asarray(df['LHEWeight_originalXWGTUP']).reshape(-1)
+
+    out = np.empty((events.size, len(theoryVariations)), dtype=dtype)
+    theoryKernel(events,
+                 *_jagged(df, 'LHEPdfWeight'),
+                 *_jagged(df, 'LHEScaleWeight'),
+                 *_jagged(df, 'PSWeight'),
+                 generatorWeight, originalWeight,
+                 _scale9, _scale44, out)
+
+    return {name: out[:, i] for i, name in enumerate(theoryVariations)}
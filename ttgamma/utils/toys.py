@@ -0,0 +1,126 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .likelihood import fitCoefficients, predictions, minimize, fitWithErrors
+
+
+#generate pseudo-datasets for the likelihood fit, all toys at once as arrays with a leading (nToys) axis
+#  truth is the (ttgammaSF, nonPromptSF) used to generate the toys, by default the best fit of fitData
+#  each toy fluctuates:  nData, poisson around the MC prediction at the truth
+#                        the purity measurements, gaussian around the MC prediction at the truth with the measured uncertainties
+#                        mcYield, gaussian within mcYieldErr (bootstrap of the MC statistical uncertainty), truncated at zero
+def generateToys(fitData, nToys, truth=None, seed=None, fluctuateData=True, fluctuatePurity=True, fluctuateMC=True):
+    rng = np.random.default_rng(seed)
+    coef = fitCoefficients(fitData)
+
+    if truth is None:
+        truth = minimize(coef)[:2]
+    mc = predictions(truth[0], truth[1], coef)
+
+    mcYield = np.asarray(fitData['mcYield'], dtype=np.float64)
+    mcYieldErr = np.asarray(fitData['mcYieldErr'], dtype=np.float64)
+
+    toyYield = np.broadcast_to(mcYield, (nToys,) + mcYield.shape)
+    if fluctuateMC:
+        toyYield = np.maximum(toyYield + rng.standard_normal(toyYield.shape)*mcYieldErr, 0.)
+
+    if fluctuateData:
+        toyData = rng.poisson(mc['nMC'], nToys).astype(np.float64)
+    else:
+        toyData = np.full(nToys, coef['nData'])
+
+    photonPurityErr = np.broadcast_to(coef['photonPurityErr'], nToys)
+    topPurityErr = np.broadcast_to(coef['topPurityErr'], nToys)
+    if fluctuatePurity:
+        toyPhotonPurity = mc['photonPurity'] + rng.standard_normal(nToys)*photonPurityErr
+        toyTopPurity = mc['topPurity'] + rng.standard_normal(nToys)*topPurityErr
+    else:
+        toyPhotonPurity = np.broadcast_to(coef['photonPurity'], nToys)
+        toyTopPurity = np.broadcast_to(coef['topPurity'], nToys)
+
+    return {'mcYield'         : toyYield,
+            'mcYieldErr'      : np.broadcast_to(mcYieldErr, toyYield.shape),
+            'photonPurity'    : toyPhotonPurity,
+            'photonPurityErr' : photonPurityErr,
+            'topPurity'       : toyTopPurity,
+            'topPurityErr'    : topPurityErr,
+            'nData'           : toyData,
+           }
+
+
+#fit a batch of toys, optionally with the profile likelihood intervals of every toy
+def fitToys(toyData, withErrors=True, cl=0.682689492137086):
+    if withErrors:
+        names = ['ttgammaSF', 'ttgammaUp', 'ttgammaDown', 'nonPromptSF', 'nonPromptUp', 'nonPromptDown', 'chi2Min']
+        return dict(zip(names, fitWithErrors(toyData, cl=cl)))
+
+    names = ['ttgammaSF', 'nonPromptSF', 'chi2Min']
+    return dict(zip(names, minimize(toyData)))
+
+
+def _runToyBatch(args):
+    fitData, nToys, truth, seed, withErrors, cl, options = args
+    toyData = generateToys(fitData, nToys, truth=truth, seed=seed, **options)
+    return fitToys(toyData, withErrors=withErrors, cl=cl)
+
+
+#generate and fit nToys pseudo-datasets, split into batches of at most batchSize toys
+#  with workers > 1 the batches are spread over a process pool, each batch with an independent random stream spawned from seed
+#  options are passed on to generateToys (fluctuateData, fluctuatePurity, fluctuateMC)
+def runToys(fitData, nToys, truth=None, seed=None, workers=1, batchSize=2000, withErrors=True, cl=0.682689492137086, **options):
+    if truth is None:
+        truth = tuple(float(x) for x in minimize(fitData)[:2])
+
+    nBatches = max(1, int(np.ceil(nToys/batchSize)))
+    batchToys = [len(b) for b in np.array_split(np.arange(nToys), nBatches)]
+    seeds = np.random.SeedSequence(seed).spawn(nBatches)
+
+    fitData = {key: np.asarray(fitData[key], dtype=np.float64) for key in ['mcYield', 'mcYieldErr', 'photonPurity', 'photonPurityErr', 'topPurity', 'topPurityErr', 'nData']}
+    jobs = [(fitData, n, truth, s, withErrors, cl, options) for n, s in zip(batchToys, seeds)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(_runToyBatch, jobs))
+    else:
+        batches = [_runToyBatch(job) for job in jobs]
+
+    results = {key: np.concatenate([batch[key] for batch in batches]) for key in batches[0]}
+    results['truth'] = truth
+
+    return results
+
+
+#pull distributions, coverage and toy-based intervals from the output of runToys
+#  pulls use the up (down) error of each toy when the fit is below (above) the truth
+#  toy intervals are the central quantiles of the fitted values containing a fraction cl of the toys
+def toySummary(results, cl=0.682689492137086):
+    summary = {}
+    for i, parameter in enumerate(['ttgamma', 'nonPrompt']):
+        fit = results[f'{parameter}SF']
+        truth = results['truth'][i]
+        converged = np.isfinite(fit)
+
+        quantiles = np.quantile(fit[converged], [0.5 - cl/2, 0.5, 0.5 + cl/2])
+        summary[f'{parameter}SF'] = {'mean'     : fit[converged].mean(),
+                                     'std'      : fit[converged].std(),
+                                     'median'   : quantiles[1],
+                                     'interval' : (quantiles[0] - quantiles[1], quantiles[2] - quantiles[1]),
+                                     'nFailed'  : int((~converged).sum()),
+                                    }
+
+        if f'{parameter}Up' in results:
+            up = results[f'{parameter}Up']
+            down = results[f'{parameter}Down']
+            valid = converged & np.isfinite(up) & np.isfinite(down)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pull = np.where(fit < truth, (fit - truth)/up, (fit - truth)/-down)
+
+            covered = (fit + down <= truth) & (truth <= fit + up)
+            summary[f'{parameter}SF'].update({'pull'      : pull[valid],
+                                              'pullMean'  : pull[valid].mean(),
+                                              'pullWidth' : pull[valid].std(),
+                                              'coverage'  : covered[valid].mean(),
+                                             })
+
+    return summary
@@ -0,0 +1,75 @@
+import numpy as np
+
+from .precision import Weights
+
+
+#event weights of the processor, with the nominal weight and all of its systematic variations precomputed as a matrix
+#  weights are added as with processor.Weights, which keeps the product of the nominal weights and the ratio of each variation,
+#  but only for the events passing mask (the events which can be filled in a histogram, all of them if mask is None):
+#  the weights given to add are arrays over these events (arrays over all the events are also accepted, and reduced to them),
+#  so all the weight arithmetic is done for these events only, and the events outside of mask have a weight of 1
+#  build() computes a matrix with one row per event passing mask and one column per variation (the first column is the nominal weight)
+#  weight(modifier, mask) then returns the column of that variation for the events passing mask, without any arithmetic
+class WeightMatrix(Weights):
+    def __init__(self, size, mask=None, storeIndividual=False, dtype=np.float64):
+        self._size = size
+        self._selected = np.arange(size) if mask is None else np.flatnonzero(mask)
+        super().__init__(self._selected.size, storeIndividual, dtype)
+        self._rows = np.full(size, -1, dtype=np.int64)
+        self._rows[self._selected] = np.arange(self._selected.size)
+        self._matrix = None
+        self._columns = {}
+
+    def _compact(self, array):
+        if array is None:
+            return None
+        array = np.asarray(array)
+        if array.shape[0] == self._size and self._selected.size != self._size:
+            return array[self._selected]
+        return array
+
+    def add(self, name, weight, weightUp=None, weightDown=None, shift=False):
+        super().add(name, self._compact(weight), self._compact(weightUp), self._compact(weightDown), shift)
+        self._matrix = None
+
+    def _ratio(self, modifier, rows):
+        if 'Down' in modifier and not modifier in self._modifiers:
+            return 1./self._modifiers[modifier.replace('Down', 'Up')][rows]
+        return self._modifiers[modifier][rows]
+
+    def build(self):
+        variations = [None] + sorted(self.variations)
+
+        matrix = np.empty((self._selected.size, len(variations)), dtype=self._dtype)
+        matrix[:, 0] = self._weight
+        for i, modifier in enumerate(variations[1:], 1):
+            np.multiply(self._weight, self._ratio(modifier, slice(None)), out=matrix[:, i])
+
+        self._matrix = matrix
+        self._columns = {modifier: i for i, modifier in enumerate(variations)}
+        return matrix
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self.build()
+        return self._matrix
+
+    #weights of the rows of the events passing mask
+    def _column(self, modifier, rows):
+        if not self._matrix is None:
+            return self._matrix[rows, self._columns[modifier]]
+        nominal = self._weight[rows]
+        return nominal if modifier is None else nominal*self._ratio(modifier, rows)
+
+    def weight(self, modifier=None, mask=None):
+        if mask is None and self._selected.size == self._size:
+            return self._column(modifier, slice(None))
+
+        rows = self._rows if mask is None else self._rows[mask]
+        inside = rows >= 0
+        if inside.all():
+            return self._column(modifier, rows)
+        out = np.ones(rows.size, dtype=self._dtype)
+        out[inside] = self._column(modifier, rows[inside])
+        return out